@@ -0,0 +1,617 @@
+#!/usr/bin/env python
+
+"""Micro-benchmarks for hot paths of the Controller and Switches
+
+Usage: python bench.py [codec] [controller] [memory] [routing] [topology] [messages]
+                       [alternates] [handling] [all] [--entries N] [--repeat R]
+                       [--switches N] [--messages M] [--flap-every K]
+                       [--sizes N,N,...] [--sample S] [--kinds ring,grid,...]
+                       [--engines incremental,full,csr] [--flaps F] [--seed K]
+                       [--cache-sizes N,N,...] [--ecmp N]
+                       [--json FILE]
+       python bench.py --compare OLD.json NEW.json
+
+Author: Matt Bowring
+Email: mbowring@purdue.edu
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import struct
+import threading
+import time
+import tracemalloc
+from array import array
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import common
+from common import (
+    Topology, RoutingEntry,
+    LOCALHOST, KEY_HOST, KEY_PORT, KEY_NEIGHBOR_ID, KEY_ALIVE, BIN_ROUTING_UPDATE,
+    UNREACHABLE_HOP, UNREACHABLE_DISTANCE, MAX_ROUTES_PER_UPDATE,
+    get_option,
+    serialize_routing_update, deserialize_routing_update, deserialize_routing_update_flat,
+    serialize_topology_update, serialize_switch_heartbeat,
+)
+from topogen import GENERATORS, generate, ring_topology
+
+
+# Reference codec: the per-field pack/slice implementation common.py used before
+# precompiled structs, kept here as the baseline to compare against.
+
+def legacy_serialize_routing_update(routes: List[RoutingEntry], version: int = 0) -> bytes:
+    data = struct.pack('!BIH', BIN_ROUTING_UPDATE, version, len(routes))
+    for route in routes:
+        data += struct.pack('!iiiii', route[0], route[1], route[2], route[3], route[4])
+    return data
+
+def legacy_deserialize_routing_update(data: bytes) -> Tuple[int, List[RoutingEntry]]:
+    offset = 1
+    version, num_routes = struct.unpack('!IH', data[offset:offset+6])
+    offset += 6
+    routes = []
+    for _ in range(num_routes):
+        sid, did, hop, dist, backup = struct.unpack('!iiiii', data[offset:offset+20])
+        offset += 20
+        routes.append([sid, did, hop, dist, backup])
+    return version, routes
+
+
+def best_time(fn: Callable, *args, repeat: int = 5) -> float:
+    """Best wall time of repeat calls, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def sample_routes(entries: int) -> List[RoutingEntry]:
+    return [[0, did, did % 97, did * 3, did % 89] for did in range(entries)]
+
+
+def bench_codec(entries: int, repeat: int) -> Dict[str, float]:
+    """Encode/decode throughput in routing entries per second."""
+    routes = sample_routes(min(entries, 0xFFFF))
+    data = bytes(serialize_routing_update(routes))
+    assert data == legacy_serialize_routing_update(routes)
+
+    cases = {
+        'encode_legacy': (legacy_serialize_routing_update, routes),
+        'encode': (serialize_routing_update, routes),
+        'decode_legacy': (legacy_deserialize_routing_update, data),
+        'decode': (deserialize_routing_update, data),
+        'decode_flat': (deserialize_routing_update_flat, data),
+    }
+    return {name: len(routes) / best_time(fn, arg, repeat=repeat)
+            for name, (fn, arg) in cases.items()}
+
+
+def _controller_rate(mode: str, n: int, messages: int, flap_every: int,
+                     out: "multiprocessing.Queue", window: int = 256) -> None:
+    # Runs in a child process so each controller starts clean and never has to be torn down
+    import controller as ctl
+    from controller_async import start_async_controller
+
+    ctl.LOG_FILE = os.devnull
+    topo = ring_topology(n)
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind((LOCALHOST, 0))
+    sw = {sid: {KEY_HOST: LOCALHOST, KEY_PORT: sink.getsockname()[1]} for sid in range(n)}
+    ctrl = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    ctrl.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 24)
+    ctrl.bind((LOCALHOST, 0))
+    cache = ctl.RoutingCache()
+
+    if mode == 'threaded':
+        controller = ctl.Controller(ctrl, sw, topo, cache)
+        controller.start()
+        threading.Thread(target=ctl.serve_threaded, args=(controller,), daemon=True).start()
+    else:
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        controller = asyncio.run_coroutine_threadsafe(
+            start_async_controller(ctrl, sw, topo, cache), loop).result()
+
+    # Heartbeats from every switch, with a link flapping every flap_every messages
+    reports = []
+    down = False
+    seq = [0] * n
+    for i in range(messages):
+        sid = i % n
+        if flap_every and i % flap_every == 0:
+            down = not down
+            nbrs = [(nid, True) for nid, _ in topo[sid]]
+            nbrs[0] = (nbrs[0][0], not down)
+            seq[sid] += 1
+            reports.append(serialize_topology_update(sid, nbrs, seq[sid]))
+        else:
+            # Heartbeats are built when sent, with the table version the switch would hold
+            reports.append((sid, seq[sid]))
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    addr = ctrl.getsockname()
+    start = time.perf_counter()
+    for i, data in enumerate(reports):
+        # Keep a bounded number in flight so the receive buffer never overflows
+        while i - controller.messages_handled >= window:
+            time.sleep(0.0005)
+        if isinstance(data, tuple):
+            data = serialize_switch_heartbeat(*data, controller.tracker.version.get(data[0], 0))
+        client.sendto(data, addr)
+    last_count, last_change = 0, time.perf_counter()
+    while controller.messages_handled < messages and time.perf_counter() - last_change < 1.0:
+        time.sleep(0.005)
+        if controller.messages_handled != last_count:
+            last_count, last_change = controller.messages_handled, time.perf_counter()
+    handled = controller.messages_handled
+    out.put((handled, last_change - start))
+
+
+def bench_controller(n: int, messages: int, flap_every: int) -> Dict[str, float]:
+    """Switch reports (heartbeats and topology updates) handled per second by each
+    controller loop."""
+    results: Dict[str, float] = {}
+    for mode in ('threaded', 'async'):
+        out: "multiprocessing.Queue" = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_controller_rate,
+                                       args=(mode, n, messages, flap_every, out))
+        proc.start()
+        handled, elapsed = out.get()
+        proc.terminate()
+        proc.join()
+        results[mode] = handled / elapsed if elapsed > 0 else 0.0
+    return results
+
+
+def _sample_table(sid: int, n: int) -> Tuple[List[int], List[int]]:
+    # Hops and distances shaped like a real table, a few destinations unreachable
+    hop = [UNREACHABLE_HOP if did % 101 == 50 else (sid + did) % n for did in range(n)]
+    dist = [UNREACHABLE_DISTANCE if did % 101 == 50 else 10 + (sid * did) % 500
+            for did in range(n)]
+    return hop, dist
+
+
+def _traced_bytes(build: Callable[[], object]) -> int:
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return used
+
+
+def bench_memory(sizes: List[int], sample: int) -> Dict[str, float]:
+    """MB held by routes_by_switch: RoutingEntry lists versus RouteTable arrays.
+    Measured on sample switches' tables and scaled to all n switches."""
+    from routing import RouteTable
+
+    results: Dict[str, float] = {}
+    for n in sizes:
+        count = min(sample, n)
+        tables = [_sample_table(sid, n) for sid in range(count)]
+
+        def as_rows() -> object:
+            return [[[sid, did, hop[did], dist[did], hop[did]] for did in range(n)]
+                    for sid, (hop, dist) in enumerate(tables)]
+
+        def as_arrays() -> object:
+            return [RouteTable(sid, array('i', hop), array('i', dist), array('i', hop))
+                    for sid, (hop, dist) in enumerate(tables)]
+
+        for name, build in (('rows', as_rows), ('arrays', as_arrays)):
+            results[f"{n}_{name}"] = _traced_bytes(build) * n / count / 1e6
+    return results
+
+
+def bench_cache_memory(kind: str, sizes: List[int], engines: List[str],
+                       seed: int) -> Dict[str, float]:
+    """MB held by a RoutingCache once it has computed the tables of a kind
+    fabric, per engine: the tables, the memo and whatever the engine keeps
+    between updates, such as the incremental engine's shortest path trees."""
+    from controller import RoutingCache
+
+    results: Dict[str, float] = {}
+    for n in sizes:
+        topo = generate(kind, n, seed)
+        n = len(topo)
+        for engine in engines:
+            def build() -> object:
+                cache = RoutingCache(engine)
+                cache.update(topo, n, 0)
+                return cache
+            results[f"{kind}/{n}/{engine}"] = _traced_bytes(build) / 1e6
+    return results
+
+
+def calls_per_second(fn: Callable, *args, repeat: int = 5, budget: float = 0.02) -> float:
+    """Best rate of repeat batches of calls, each batch about budget seconds long."""
+    start = time.perf_counter()
+    fn(*args)
+    calls = max(1, min(100000, int(budget / max(time.perf_counter() - start, 1e-7))))
+
+    def batch() -> None:
+        for _ in range(calls):
+            fn(*args)
+    return calls / best_time(batch, repeat=repeat)
+
+
+def sample_neighbors(count: int) -> List[dict]:
+    return [{KEY_NEIGHBOR_ID: nid, KEY_ALIVE: nid % 3 != 0, KEY_HOST: LOCALHOST,
+             KEY_PORT: 40000 + nid} for nid in range(count)]
+
+
+def bench_messages(entries: int, repeat: int) -> Dict[str, float]:
+    """Calls per second of every serialize_*/deserialize_* function in common.py,
+    on messages of typical size: 8 neighbors, one datagram of routing rows
+    and, for fragments, a table of entries destinations."""
+    rows = sample_routes(MAX_ROUTES_PER_UPDATE)
+    table = sample_routes(entries)
+    nbrs = [(nid, nid % 3 != 0) for nid in range(8)]
+    payload = bytes(64)
+    encoded = {
+        'register_request': common.serialize_register_request(3, 40003),
+        'register_response': common.serialize_register_response(sample_neighbors(8)),
+        'routing_update': bytes(common.serialize_routing_update(rows, 7)),
+        'routing_fragment': bytes(common.serialize_routing_fragments(table, 7)[0]),
+        'routing_resync': common.serialize_routing_resync(3, 7),
+        'data': bytes(common.serialize_data(1, 2, 64, payload, 5)),
+        'switch_lookup': common.serialize_switch_lookup(3, LOCALHOST, 40003),
+        'keep_alive': common.serialize_keep_alive(3),
+        'topology_update': common.serialize_topology_update(3, nbrs, 9),
+        'switch_heartbeat': common.serialize_switch_heartbeat(3, 9, 7),
+    }
+    cases: Dict[str, Tuple[Callable, tuple]] = {
+        'serialize_register_request': (common.serialize_register_request, (3, 40003)),
+        'serialize_register_response': (common.serialize_register_response,
+                                         (sample_neighbors(8),)),
+        'serialize_routing_update': (common.serialize_routing_update, (rows, 7)),
+        'serialize_routing_delta': (common.serialize_routing_delta, (rows, 7)),
+        'serialize_routing_fragments': (common.serialize_routing_fragments, (table, 7)),
+        'serialize_routing_resync': (common.serialize_routing_resync, (3, 7)),
+        'serialize_data': (common.serialize_data, (1, 2, 64, payload, 5)),
+        'serialize_switch_lookup': (common.serialize_switch_lookup, (3, LOCALHOST, 40003)),
+        'serialize_keep_alive': (common.serialize_keep_alive, (3,)),
+        'serialize_topology_update': (common.serialize_topology_update, (3, nbrs, 9)),
+        'serialize_switch_heartbeat': (common.serialize_switch_heartbeat, (3, 9, 7)),
+        'serialize_topology_resync': (common.serialize_topology_resync, (9,)),
+    }
+    for name, data in encoded.items():
+        cases[f'deserialize_{name}'] = (getattr(common, f'deserialize_{name}'), (data,))
+    cases['deserialize_routing_update_flat'] = (common.deserialize_routing_update_flat,
+                                                (encoded['routing_update'],))
+    # Forwarding and dispatch helpers on the same hot paths
+    cases['data_destination'] = (common.data_destination, (encoded['data'],))
+    cases['with_ttl'] = (common.with_ttl, (encoded['data'], 63))
+    cases['topology_update_sender'] = (common.topology_update_sender,
+                                       (encoded['topology_update'],))
+
+    missing = [name for name in dir(common) if name.startswith(('serialize_', 'deserialize_'))
+               and name not in cases]
+    assert not missing, f"no benchmark for {', '.join(missing)}"
+    return {name: calls_per_second(fn, *args, repeat=repeat)
+            for name, (fn, args) in sorted(cases.items())}
+
+
+def without_link(topo: Topology, sid: int) -> Topology:
+    """Copy of topo with the first link of sid removed."""
+    nid = topo[sid][0][0]
+    down = {u: list(nbrs) for u, nbrs in topo.items()}
+    down[sid] = [(v, c) for v, c in down[sid] if v != nid]
+    down[nid] = [(v, c) for v, c in down[nid] if v != sid]
+    return down
+
+
+def bench_routing(kinds: List[str], sizes: List[int], engines: List[str],
+                  repeat: int, seed: int) -> Dict[str, float]:
+    """Microseconds per RoutingCache.update: the first computation for a
+    topology, then one link going down and coming back up. The memo is off,
+    so every update computes."""
+    from controller import RoutingCache, RoutingTableLRU, ROUTING_CSR
+    from routing import np
+
+    results: Dict[str, float] = {}
+    for kind in kinds:
+        for size in sizes:
+            topo = generate(kind, size, seed)
+            n = len(topo)
+            down = without_link(topo, max(topo, key=lambda u: len(topo[u])))
+            for engine in engines:
+                if engine == ROUTING_CSR and np is None:
+                    continue
+                name = f"{kind}/{n}/{engine}"
+                # Large fabrics take seconds per computation; once is enough
+                runs = repeat if n < 1000 else 1
+                results[f"{name}/full"] = best_time(
+                    lambda: RoutingCache(engine, memo=RoutingTableLRU(0)).update(topo, n, 0),
+                    repeat=runs) * 1e6
+                cache = RoutingCache(engine, memo=RoutingTableLRU(0))
+                cache.update(topo, n, 0)
+                version = 0
+                best = {'link_down': float('inf'), 'link_up': float('inf')}
+                for _ in range(runs):
+                    for case, state in (('link_down', down), ('link_up', topo)):
+                        version += 1
+                        start = time.perf_counter()
+                        cache.update(state, n, version)
+                        best[case] = min(best[case], time.perf_counter() - start)
+                for case, elapsed in best.items():
+                    results[f"{name}/{case}"] = elapsed * 1e6
+    return results
+
+
+def bench_alternates(kinds: List[str], sizes: List[int], max_paths: int,
+                     repeat: int, seed: int) -> Dict[str, float]:
+    """Microseconds spent on loop-free alternates and equal-cost sets alone:
+    for every switch after a first computation, and for the switches whose
+    alternates a link going down can change."""
+    from controller import (RoutingCache, RoutingTableLRU, add_alternates,
+                            ROUTING_CSR, ROUTING_FULL)
+    from routing import backup_dependents, merge_tables, np
+
+    engine = ROUTING_CSR if np is not None else ROUTING_FULL
+    results: Dict[str, float] = {}
+    for kind in kinds:
+        for size in sizes:
+            topo = generate(kind, size, seed)
+            n = len(topo)
+            down = without_link(topo, max(topo, key=lambda u: len(topo[u])))
+            before = RoutingCache(engine, memo=RoutingTableLRU(0))
+            after = RoutingCache(engine, memo=RoutingTableLRU(0))
+            before.update(topo, n, 0)
+            after.update(down, n, 0)
+            runs = repeat if n < 1000 else 1
+            results[f"{kind}/{n}/all"] = best_time(
+                add_alternates, dict(before.routes_by_switch), topo, range(n), max_paths,
+                repeat=runs) * 1e6
+            tables, changed, moved = merge_tables(before.routes_by_switch, after.routes_by_switch)
+            affected = backup_dependents(changed, moved, topo, down)
+            results[f"{kind}/{n}/link_down"] = best_time(
+                add_alternates, tables, down, affected, max_paths, repeat=runs) * 1e6
+    return results
+
+
+def bench_topology(kinds: List[str], sizes: List[int], repeat: int,
+                   seed: int) -> Dict[str, float]:
+    """Microseconds per build_topology, with every switch alive and with one
+    switch dead and each of its neighbors reporting the link down."""
+    from controller import build_topology
+
+    results: Dict[str, float] = {}
+    for kind in kinds:
+        for size in sizes:
+            topo = generate(kind, size, seed)
+            n = len(topo)
+            alive = {sid: True for sid in topo}
+            nbrs = {sid: {nid: True for nid, _ in topo[sid]} for sid in topo}
+            results[f"{kind}/{n}/all_alive"] = best_time(
+                build_topology, topo, alive, nbrs, repeat=repeat) * 1e6
+            dead = max(topo, key=lambda u: len(topo[u]))
+            alive[dead] = False
+            for nid, _ in topo[dead]:
+                nbrs[nid][dead] = False
+            results[f"{kind}/{n}/switch_dead"] = best_time(
+                build_topology, topo, alive, nbrs, repeat=repeat) * 1e6
+    return results
+
+
+class NullSocket:
+    """Counts what the controller sends instead of sending it."""
+
+    def __init__(self) -> None:
+        self.sent: int = 0
+
+    def sendto(self, data: bytes, addr: Tuple[str, int]) -> None:
+        self.sent += 1
+
+
+def bench_handling(kinds: List[str], sizes: List[int], messages: int, flaps: int,
+                   seed: int) -> Dict[str, float]:
+    """Microseconds for the controller to handle one TOPOLOGY_UPDATE, end to
+    end: a byte-identical repeat, a new report with no change, and a link
+    flap, which includes the recompute and the routing updates it sends."""
+    from controller import Controller, RecomputeDebouncer, RoutingCache, RoutingTableLRU
+
+    results: Dict[str, float] = {}
+    for kind in kinds:
+        for size in sizes:
+            topo = generate(kind, size, seed)
+            n = len(topo)
+            sid = max(topo, key=lambda u: len(topo[u]))
+            addr = (LOCALHOST, 40000 + sid)
+            sw = {s: {KEY_HOST: LOCALHOST, KEY_PORT: 40000 + s} for s in topo}
+            # No hold-down, so every change is recomputed and sent at once
+            controller = Controller(NullSocket(), sw, topo, RoutingCache(memo=RoutingTableLRU(0)),
+                                    debouncer=RecomputeDebouncer(0.0, 0.0), logging=False)
+            controller.start()
+            nbrs = [(nid, True) for nid, _ in topo[sid]]
+            seq = 1
+            report = serialize_topology_update(sid, nbrs, seq)
+            controller.handle_message(report, addr)
+
+            def timed(datagrams: List[bytes]) -> float:
+                start = time.perf_counter()
+                for data in datagrams:
+                    controller.handle_message(data, addr)
+                return (time.perf_counter() - start) / len(datagrams) * 1e6
+
+            results[f"{kind}/{n}/repeat"] = timed([report] * messages)
+            unchanged = [serialize_topology_update(sid, nbrs, seq + i + 1) for i in range(messages)]
+            seq += messages
+            results[f"{kind}/{n}/no_change"] = timed(unchanged)
+            flapping = []
+            for i in range(flaps):
+                state = list(nbrs)
+                state[0] = (state[0][0], i % 2 == 1)
+                seq += 1
+                flapping.append(serialize_topology_update(sid, state, seq))
+            results[f"{kind}/{n}/flap"] = timed(flapping)
+    return results
+
+
+def report(title: str, results: Dict[str, float], unit: str) -> None:
+    print(title)
+    width = max([16] + [len(name) + 2 for name in results])
+    for name, value in results.items():
+        print(f"  {name:<{width}}{value:>16,.{1 if abs(value) < 100 else 0}f} {unit}")
+    for name, value in results.items():
+        legacy = results.get(name.split('_')[0] + '_legacy')
+        if legacy and not name.endswith('_legacy'):
+            print(f"  {name} speedup: {value / legacy:.1f}x")
+
+
+def positional_args(argv: List[str]) -> List[str]:
+    # Arguments that are neither --options nor their values
+    args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg.startswith('--'):
+            skip = True
+        else:
+            args.append(arg)
+    return args
+
+
+def git_commit() -> Optional[str]:
+    try:
+        done = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return done.stdout.strip() if done.returncode == 0 else None
+
+
+def run_metadata() -> Dict[str, object]:
+    return {
+        'commit': git_commit(),
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'system': platform.platform(),
+        'cpus': os.cpu_count(),
+        'argv': sys.argv[1:],
+    }
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> int:
+    """Print the change of every result both runs have; returns the number
+    that got worse by more than threshold (a fraction)."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('commit') or old_path} -> {new['meta'].get('commit') or new_path}")
+    regressions = 0
+    for suite, result in new['suites'].items():
+        before = old['suites'].get(suite)
+        if before is None:
+            continue
+        print(f"{suite} ({result['unit']})")
+        # Rates are better higher, times and sizes lower
+        higher_is_better = result['unit'].endswith('/s')
+        for name, value in result['values'].items():
+            was = before['values'].get(name)
+            if not was or value is None:
+                continue
+            change = value / was - 1.0
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"  {name:<40}{was:>16,.1f}{value:>16,.1f}{change:>+9.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    compare_paths = get_option(sys.argv, '--compare')
+    if compare_paths is not None:
+        new_path = positional_args(sys.argv[1:])
+        if not new_path:
+            print("bench.py --compare OLD.json NEW.json [--threshold FRACTION]")
+            sys.exit(1)
+        threshold = float(get_option(sys.argv, '--threshold', '0.1'))
+        sys.exit(1 if compare(compare_paths, new_path[0], threshold) else 0)
+
+    entries = int(get_option(sys.argv, '--entries', '10000'))
+    repeat = int(get_option(sys.argv, '--repeat', '5'))
+    seed = int(get_option(sys.argv, '--seed', '0'))
+    kinds = get_option(sys.argv, '--kinds', ','.join(GENERATORS)).split(',')
+    suites = positional_args(sys.argv[1:]) or ['codec']
+    if 'all' in suites:
+        suites = ['codec', 'messages', 'topology', 'routing', 'alternates', 'handling', 'memory',
+                  'controller']
+    json_path = get_option(sys.argv, '--json')
+    collected: Dict[str, Dict[str, object]] = {}
+
+    def sizes(default: str) -> List[int]:
+        return [int(n) for n in get_option(sys.argv, '--sizes', default).split(',')]
+
+    def record(suite: str, title: str, results: Dict[str, float], unit: str) -> None:
+        report(title, results, unit)
+        collected[suite] = {'title': title, 'unit': unit, 'values': results}
+
+    if 'codec' in suites:
+        record('codec', f"codec ({entries} routing entries)", bench_codec(entries, repeat),
+               "entries/s")
+    if 'messages' in suites:
+        record('messages', f"message codec (fragments of a {entries}-entry table)",
+               bench_messages(entries, repeat), "calls/s")
+    if 'topology' in suites:
+        record('topology', "build_topology", bench_topology(
+            kinds, sizes('10,100,1000,10000'), repeat, seed), "us")
+    if 'routing' in suites:
+        engines = get_option(sys.argv, '--engines', 'incremental,full').split(',')
+        record('routing', f"RoutingCache.update ({', '.join(engines)})", bench_routing(
+            kinds, sizes('10,100,1000'), engines, repeat, seed), "us")
+    if 'alternates' in suites:
+        from controller import ECMP_MAX_PATHS
+        max_paths = int(get_option(sys.argv, '--ecmp', str(ECMP_MAX_PATHS)))
+        record('alternates', f"add_alternates (up to {max_paths} equal-cost hops)",
+               bench_alternates(kinds, sizes('100,1000'), max_paths, repeat, seed), "us")
+    if 'handling' in suites:
+        messages = int(get_option(sys.argv, '--messages', '20000'))
+        flaps = int(get_option(sys.argv, '--flaps', '20'))
+        record('handling', f"TOPOLOGY_UPDATE handling ({messages} reports, {flaps} flaps)",
+               bench_handling(kinds, sizes('10,100,1000'), messages, flaps, seed), "us/msg")
+    if 'memory' in suites:
+        memory_sizes = sizes('1000,5000,10000')
+        sample = int(get_option(sys.argv, '--sample', '20'))
+        results = bench_memory(memory_sizes, sample)
+        record('memory', f"routing table memory (scaled from {sample} switches)", results, "MB")
+        for n in memory_sizes:
+            print(f"  {n} switches: {results[f'{n}_rows'] / results[f'{n}_arrays']:.0f}x smaller")
+        engines = get_option(sys.argv, '--engines', 'incremental,full,csr').split(',')
+        cache_sizes = [int(n) for n in get_option(sys.argv, '--cache-sizes', '500,1500').split(',')]
+        record('cache_memory', f"RoutingCache memory after a full compute ({kinds[0]})",
+               bench_cache_memory(kinds[0], cache_sizes, engines, seed), "MB")
+    if 'controller' in suites:
+        n = int(get_option(sys.argv, '--switches', '200'))
+        messages = int(get_option(sys.argv, '--messages', '20000'))
+        flap_every = int(get_option(sys.argv, '--flap-every', '500'))
+        record('controller', f"controller ({n} switches, {messages} switch reports, "
+               f"link flap every {flap_every})",
+               bench_controller(n, messages, flap_every), "msgs/s")
+
+    if json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump({'meta': run_metadata(), 'suites': collected}, f, indent=2)
+        print(f"Results written to {json_path}")
+
+
+if __name__ == "__main__":
+    main()
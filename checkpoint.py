@@ -0,0 +1,211 @@
+"""Controller state checkpoints for warm restarts
+Author: Matt Bowring
+Email: mbowring@purdue.edu
+"""
+
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from common import SwitchInfo, KEY_HOST, KEY_PORT, get_option
+from routing import RouteTable
+
+CHECKPOINT_MAGIC: bytes = b'SDNC'
+CHECKPOINT_FORMAT: int = 1
+CHECKPOINT_INTERVAL: float = 1.0  # (seconds) between checks for state worth saving
+
+# File layout, big-endian like the wire format. Tables come first so that
+# their blocks start 4-byte aligned in the mapping.
+#   header
+#   hop, dist and backup blocks: n tables of n int32 each, if has_tables
+#   num_switches * (SWITCH_RECORD, host null-terminated, neighbors * NEIGHBOR_RECORD)
+#   num_ecmp * (ECMP_RECORD, count * int32 next hop)
+CHECKPOINT_HEADER = struct.Struct('!4sHBxIIdII4x')
+SWITCH_RECORD = struct.Struct('!iiBIIH')
+NEIGHBOR_RECORD = struct.Struct('!iB')
+ECMP_RECORD = struct.Struct('!iiB')
+
+_SWAP: bool = sys.byteorder == 'little'
+
+
+def _ints(values: array) -> bytes:
+    if not _SWAP:
+        return values.tobytes()
+    swapped = array('i', values)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+class Checkpoint:
+    """Controller state that lets a restarted controller carry on without
+    the switches registering again: their addresses, liveness and neighbor
+    views, the sequence numbers of their topology updates, the routing
+    tables and the table version each switch holds."""
+
+    __slots__ = ('n', 'topology_version', 'saved_at', 'sw', 'switch_alive',
+                 'switch_neighbors', 'topology_seq', 'tables', 'versions')
+
+    def __init__(self, n: int, topology_version: int, sw: Dict[int, SwitchInfo],
+                 switch_alive: Dict[int, bool], switch_neighbors: Dict[int, Dict[int, bool]],
+                 topology_seq: Dict[int, int], tables: Dict[int, RouteTable],
+                 versions: Dict[int, int], saved_at: float = 0.0) -> None:
+        self.n = n
+        self.topology_version = topology_version
+        self.saved_at = saved_at
+        self.sw = sw
+        self.switch_alive = switch_alive
+        self.switch_neighbors = switch_neighbors
+        self.topology_seq = topology_seq
+        self.tables = tables
+        self.versions = versions
+
+    def write(self, path: str) -> int:
+        """Write atomically to path; returns the file size."""
+        n = self.n
+        has_tables = len(self.tables) == n and all(
+            len(self.tables.get(sid, ())) == n for sid in range(n))
+        ecmp = [(sid, did, hops) for sid, table in sorted(self.tables.items())
+                for did, hops in sorted(table.ecmp.items())] if has_tables else []
+
+        parts: List[bytes] = [CHECKPOINT_HEADER.pack(
+            CHECKPOINT_MAGIC, CHECKPOINT_FORMAT, 1 if has_tables else 0, n,
+            self.topology_version, time.time(), len(self.sw), len(ecmp))]
+        if has_tables:
+            for field in ('hop', 'dist', 'backup'):
+                parts.extend(_ints(getattr(self.tables[sid], field)) for sid in range(n))
+        for sid, info in sorted(self.sw.items()):
+            nbrs = self.switch_neighbors.get(sid, {})
+            parts.append(SWITCH_RECORD.pack(
+                sid, info[KEY_PORT], 1 if self.switch_alive.get(sid, False) else 0,
+                self.topology_seq.get(sid, 0), self.versions.get(sid, 0), len(nbrs)))
+            parts.append(info[KEY_HOST].encode('utf-8') + b'\x00')
+            parts.extend(NEIGHBOR_RECORD.pack(nid, 1 if alive else 0)
+                         for nid, alive in nbrs.items())
+        for sid, did, hops in ecmp:
+            parts.append(ECMP_RECORD.pack(sid, did, len(hops)))
+            parts.append(struct.pack(f'!{len(hops)}i', *hops))
+
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            f.writelines(parts)
+        os.replace(tmp, path)
+        return sum(len(part) for part in parts)
+
+
+def load_checkpoint(path: str, n: Optional[int] = None) -> Optional[Checkpoint]:
+    """Map and parse a checkpoint. None if there is none, it is unreadable,
+    or it was taken for a fabric of other than n switches."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _parse(mm, n)
+    except (OSError, ValueError, struct.error, UnicodeDecodeError) as e:
+        print(f"Ignoring checkpoint {path}: {e}", file=sys.stderr)
+        return None
+
+
+def _parse(mm: mmap.mmap, expected_n: Optional[int]) -> Optional[Checkpoint]:
+    (magic, fmt, has_tables, n, topology_version, saved_at,
+     num_switches, num_ecmp) = CHECKPOINT_HEADER.unpack_from(mm)
+    if magic != CHECKPOINT_MAGIC or fmt != CHECKPOINT_FORMAT:
+        raise ValueError("not a controller checkpoint")
+    if expected_n is not None and n != expected_n:
+        raise ValueError(f"taken for {n} switches, config has {expected_n}")
+    offset = CHECKPOINT_HEADER.size
+
+    blocks: List[List[array]] = []
+    if has_tables:
+        row = 4 * n
+        for _ in range(3):
+            block = []
+            for _ in range(n):
+                values = array('i')
+                values.frombytes(mm[offset:offset + row])
+                if _SWAP:
+                    values.byteswap()
+                block.append(values)
+                offset += row
+            blocks.append(block)
+
+    sw: Dict[int, SwitchInfo] = {}
+    switch_alive: Dict[int, bool] = {}
+    switch_neighbors: Dict[int, Dict[int, bool]] = {}
+    topology_seq: Dict[int, int] = {}
+    versions: Dict[int, int] = {}
+    for _ in range(num_switches):
+        sid, port, alive, seq, version, count = SWITCH_RECORD.unpack_from(mm, offset)
+        offset += SWITCH_RECORD.size
+        end = mm.find(b'\x00', offset)
+        host = mm[offset:end].decode('utf-8')
+        offset = end + 1
+        sw[sid] = {KEY_HOST: host, KEY_PORT: port}
+        switch_alive[sid] = bool(alive)
+        if seq:
+            topology_seq[sid] = seq
+        if version:
+            versions[sid] = version
+        nbrs: Dict[int, bool] = {}
+        for _ in range(count):
+            nid, nbr_alive = NEIGHBOR_RECORD.unpack_from(mm, offset)
+            offset += NEIGHBOR_RECORD.size
+            nbrs[nid] = bool(nbr_alive)
+        switch_neighbors[sid] = nbrs
+
+    ecmp: Dict[int, Dict[int, Tuple[int, ...]]] = {}
+    for _ in range(num_ecmp):
+        sid, did, count = ECMP_RECORD.unpack_from(mm, offset)
+        offset += ECMP_RECORD.size
+        ecmp.setdefault(sid, {})[did] = struct.unpack_from(f'!{count}i', mm, offset)
+        offset += 4 * count
+
+    tables: Dict[int, RouteTable] = {}
+    if blocks:
+        hops, dists, backups = blocks
+        tables = {sid: RouteTable(sid, hops[sid], dists[sid], backups[sid], ecmp.get(sid, {}))
+                  for sid in range(n)}
+    return Checkpoint(n, topology_version, sw, switch_alive, switch_neighbors, topology_seq,
+                      tables, versions, saved_at)
+
+
+class CheckpointWriter:
+    """Saves the controller's state to path every interval seconds, but only
+    when it has changed since the last save. The caller supplies a cheap
+    signature of the state and a snapshot function."""
+
+    def __init__(self, path: str, interval: float = CHECKPOINT_INTERVAL) -> None:
+        self.path = path
+        self.interval = interval
+        self.next_check: float = 0.0
+        self._saved: Optional[Hashable] = None
+        self.saves: int = 0
+
+    def due(self, now: float) -> bool:
+        return now >= self.next_check
+
+    def maybe_save(self, now: float, signature: Hashable,
+                   snapshot: Callable[[], Checkpoint]) -> bool:
+        self.next_check = now + self.interval
+        if signature == self._saved:
+            return False
+        try:
+            snapshot().write(self.path)
+        except OSError as e:
+            print(f"Checkpoint to {self.path} failed: {e}", file=sys.stderr)
+            return False
+        self._saved = signature
+        self.saves += 1
+        return True
+
+
+def checkpoint_writer_from_args(argv: List[str]) -> Optional[CheckpointWriter]:
+    """Writer for --checkpoint FILE every --checkpoint-interval seconds, or None."""
+    path = get_option(argv, '--checkpoint')
+    if path is None:
+        return None
+    return CheckpointWriter(path, float(get_option(argv, '--checkpoint-interval',
+                                                   str(CHECKPOINT_INTERVAL))))
@@ -4,12 +4,15 @@ Email: mbowring@purdue.edu
 """
 
 import struct
-from typing import Dict, List, Tuple, Any
+import sys
+from array import array
+from itertools import chain
+from typing import Dict, List, Tuple, Any, Optional
 
 # Type aliases
 Topology = Dict[int, List[Tuple[int, int]]]  # {switch_id: [(neighbor_id, cost), ...]}
 SwitchInfo = Dict[str, Any]  # {'host': str, 'port': int}
-RoutingEntry = List[int]  # [switch_id, dest_id, next_hop, distance]
+RoutingEntry = List[int]  # [switch_id, dest_id, next_hop, distance, backup_hop]
 NeighborInfo = Dict[str, Any]  # {'id': int, 'alive': bool, 'host': str, 'port': int}
 
 # Network constants
@@ -17,6 +20,8 @@ LOCALHOST: str = '127.0.0.1'
 BUFFER_SIZE: int = 4096
 UPDATE_DELAY: int = 2  # (seconds)
 TIMEOUT: int = 3 * UPDATE_DELAY
+FRAGMENT_TIMEOUT: int = UPDATE_DELAY  # (seconds) to wait for the rest of a fragmented table
+LIVENESS_TICK: float = 0.1  # (seconds) resolution of liveness timeouts
 
 # Distance constants
 UNREACHABLE_DISTANCE: int = 9999
@@ -34,57 +39,204 @@ BIN_REGISTER_RESPONSE: int = 2
 BIN_ROUTING_UPDATE: int = 3
 BIN_KEEP_ALIVE: int = 4
 BIN_TOPOLOGY_UPDATE: int = 5
+BIN_ROUTING_DELTA: int = 6
+BIN_ROUTING_RESYNC: int = 7
+BIN_ROUTING_FRAGMENT: int = 8
+BIN_SWITCH_HEARTBEAT: int = 9
+BIN_TOPOLOGY_RESYNC: int = 10
+BIN_DATA: int = 11
+BIN_SWITCH_LOOKUP: int = 12
+
+# Precompiled message layouts
+MSG_TYPE = struct.Struct('!B')
+REGISTER_REQUEST = struct.Struct('!Bii')
+REGISTER_RESPONSE_HEADER = struct.Struct('!BH')
+REGISTER_RESPONSE_ITEM = struct.Struct('!iBi')
+ROUTING_HEADER = struct.Struct('!BIH')
+ROUTING_FRAGMENT_HEADER = struct.Struct('!BIHHBH')
+ROUTE = struct.Struct('!iiiii')
+ROUTING_RESYNC = struct.Struct('!BiI')
+KEEP_ALIVE = struct.Struct('!Bi')
+TOPOLOGY_HEADER = struct.Struct('!BiIH')
+TOPOLOGY_ITEM = struct.Struct('!iB')
+SWITCH_HEARTBEAT = struct.Struct('!BiII')
+TOPOLOGY_RESYNC = struct.Struct('!BI')
+DATA_HEADER = struct.Struct('!BiiBHH')
+SWITCH_LOOKUP = struct.Struct('!Bii')
+
+# Offset of the TTL byte in a DATA message, rewritten in place when forwarding
+DATA_TTL_OFFSET: int = 9
+DEFAULT_TTL: int = 64
+MAX_DATA_PAYLOAD: int = BUFFER_SIZE - DATA_HEADER.size
+
+# Routing rows that fit in one datagram, with and without fragment framing
+ROUTE_SIZE: int = ROUTE.size
+MAX_ROUTES_PER_UPDATE: int = (BUFFER_SIZE - ROUTING_HEADER.size) // ROUTE_SIZE
+MAX_ROUTES_PER_FRAGMENT: int = (BUFFER_SIZE - ROUTING_FRAGMENT_HEADER.size) // ROUTE_SIZE
+
+# Wire integers are big-endian; native arrays need a byteswap on little-endian hosts
+_SWAP: bool = sys.byteorder == 'little'
+
+# Command line helpers
+
+def get_option(argv: List[str], flag: str, default: Optional[str] = None) -> Optional[str]:
+    """Return the value following flag in argv, or default if absent."""
+    for i, arg in enumerate(argv):
+        if arg == flag and i + 1 < len(argv):
+            return argv[i + 1]
+    return default
+
+def has_flag(argv: List[str], flag: str) -> bool:
+    return flag in argv
+
+def parse_failures(argv: List[str]) -> Dict[int, int]:
+    """-f <switch id>:<neighbor id> link failures in argv, may be repeated."""
+    failures: Dict[int, int] = {}
+    for i, arg in enumerate(argv):
+        if arg == '-f' and i + 1 < len(argv):
+            sid, nid = argv[i + 1].split(':')
+            failures[int(sid)] = int(nid)
+    return failures
 
 # Serialization functions
 
+def _pack_routes(buf: bytearray, offset: int, routes: List[RoutingEntry]) -> None:
+    # Rows go in as one flat int array instead of a pack call per row
+    flat = array('i', chain.from_iterable(routes))
+    if _SWAP:
+        flat.byteswap()
+    buf[offset:offset + ROUTE_SIZE * len(routes)] = memoryview(flat).cast('B')
+
+def _routing_message(msg_type: int, routes: List[RoutingEntry], version: int) -> bytearray:
+    buf = bytearray(ROUTING_HEADER.size + ROUTE_SIZE * len(routes))
+    ROUTING_HEADER.pack_into(buf, 0, msg_type, version, len(routes))
+    _pack_routes(buf, ROUTING_HEADER.size, routes)
+    return buf
+
 def serialize_register_request(switch_id: int, port: int) -> bytes:
     """Serialize REGISTER_REQUEST to binary format.
     Format: [1B type][4B switch_id][4B port]
     """
-    return struct.pack('!Bii', BIN_REGISTER_REQUEST, switch_id, port)
+    return REGISTER_REQUEST.pack(BIN_REGISTER_REQUEST, switch_id, port)
 
 def serialize_register_response(neighbors: List[NeighborInfo]) -> bytes:
     """Serialize REGISTER_RESPONSE to binary format.
     Format: [1B type][2B num_neighbors][for each: 4B id, 1B alive, 4B port, host as null-terminated]
     """
-    data = struct.pack('!BH', BIN_REGISTER_RESPONSE, len(neighbors))
-    for nbr in neighbors:
-        host_bytes = nbr[KEY_HOST].encode('utf-8') + b'\x00'
-        data += struct.pack('!iBi', nbr[KEY_NEIGHBOR_ID], 1 if nbr[KEY_ALIVE] else 0, nbr[KEY_PORT])
-        data += host_bytes
-    return data
+    hosts = [nbr[KEY_HOST].encode('utf-8') + b'\x00' for nbr in neighbors]
+    buf = bytearray(REGISTER_RESPONSE_HEADER.size + REGISTER_RESPONSE_ITEM.size * len(neighbors)
+                    + sum(len(h) for h in hosts))
+    REGISTER_RESPONSE_HEADER.pack_into(buf, 0, BIN_REGISTER_RESPONSE, len(neighbors))
+    offset = REGISTER_RESPONSE_HEADER.size
+    for nbr, host_bytes in zip(neighbors, hosts):
+        REGISTER_RESPONSE_ITEM.pack_into(buf, offset, nbr[KEY_NEIGHBOR_ID],
+                                         1 if nbr[KEY_ALIVE] else 0, nbr[KEY_PORT])
+        offset += REGISTER_RESPONSE_ITEM.size
+        buf[offset:offset + len(host_bytes)] = host_bytes
+        offset += len(host_bytes)
+    return buf
+
+def serialize_routing_update(routes: List[RoutingEntry], version: int = 0) -> bytes:
+    """Serialize ROUTING_UPDATE (a switch's full table) to binary format.
+    Format: [1B type][4B version][2B num_routes][for each: 4B sid, 4B did, 4B hop, 4B dist, 4B backup hop]
+    """
+    return _routing_message(BIN_ROUTING_UPDATE, routes, version)
+
+def serialize_routing_delta(routes: List[RoutingEntry], version: int) -> bytes:
+    """Serialize ROUTING_DELTA (changed rows only) to binary format.
+    Applies on top of table version - 1.
+    Format: [1B type][4B version][2B num_routes][for each: 4B sid, 4B did, 4B hop, 4B dist, 4B backup hop]
+    """
+    return _routing_message(BIN_ROUTING_DELTA, routes, version)
+
+def serialize_routing_fragments(routes: List[RoutingEntry], version: int,
+                                delta: bool = False) -> List[bytes]:
+    """Serialize a full table or delta into datagrams no larger than BUFFER_SIZE.
+    Small tables go out as a single ROUTING_UPDATE/ROUTING_DELTA, larger ones
+    as ROUTING_FRAGMENTs.
+    Format: [1B type][4B version][2B frag_index][2B frag_total][1B delta]
+            [2B num_routes][for each: 4B sid, 4B did, 4B hop, 4B dist, 4B backup hop]
+    """
+    if len(routes) <= MAX_ROUTES_PER_UPDATE:
+        if delta:
+            return [serialize_routing_delta(routes, version)]
+        return [serialize_routing_update(routes, version)]
+    total = (len(routes) + MAX_ROUTES_PER_FRAGMENT - 1) // MAX_ROUTES_PER_FRAGMENT
+    frags = []
+    for index in range(total):
+        chunk = routes[index * MAX_ROUTES_PER_FRAGMENT:(index + 1) * MAX_ROUTES_PER_FRAGMENT]
+        buf = bytearray(ROUTING_FRAGMENT_HEADER.size + ROUTE_SIZE * len(chunk))
+        ROUTING_FRAGMENT_HEADER.pack_into(buf, 0, BIN_ROUTING_FRAGMENT, version, index, total,
+                                          1 if delta else 0, len(chunk))
+        _pack_routes(buf, ROUTING_FRAGMENT_HEADER.size, chunk)
+        frags.append(buf)
+    return frags
+
+def routing_fragments_size(num_routes: int, delta: bool = False) -> Tuple[int, int, int]:
+    """Message type, number of datagrams and total bytes serialize_routing_fragments
+    produces for num_routes routes, without building them."""
+    if num_routes <= MAX_ROUTES_PER_UPDATE:
+        msg_type = BIN_ROUTING_DELTA if delta else BIN_ROUTING_UPDATE
+        return msg_type, 1, ROUTING_HEADER.size + ROUTE_SIZE * num_routes
+    total = (num_routes + MAX_ROUTES_PER_FRAGMENT - 1) // MAX_ROUTES_PER_FRAGMENT
+    return (BIN_ROUTING_FRAGMENT, total,
+            ROUTING_FRAGMENT_HEADER.size * total + ROUTE_SIZE * num_routes)
 
-def serialize_routing_update(routes: List[RoutingEntry]) -> bytes:
-    """Serialize ROUTING_UPDATE to binary format.
-    Format: [1B type][2B num_routes][for each: 4B sid, 4B did, 4B hop, 4B dist]
+def serialize_routing_resync(switch_id: int, version: int) -> bytes:
+    """Serialize ROUTING_RESYNC (switch asks for its full table) to binary format.
+    Format: [1B type][4B switch_id][4B version held by the switch]
     """
-    data = struct.pack('!BH', BIN_ROUTING_UPDATE, len(routes))
-    for route in routes:
-        data += struct.pack('!iiii', route[0], route[1], route[2], route[3])
-    return data
+    return ROUTING_RESYNC.pack(BIN_ROUTING_RESYNC, switch_id, version)
+
+def serialize_data(src: int, dst: int, ttl: int, payload: bytes, flow: int = 0) -> bytes:
+    """Serialize DATA (a packet forwarded hop by hop between switches).
+    Packets of one flow take the same path through equal-cost next hops.
+    Format: [1B type][4B src switch][4B dst switch][1B ttl][2B flow][2B payload length][payload]
+    """
+    return DATA_HEADER.pack(BIN_DATA, src, dst, ttl, flow, len(payload)) + payload
+
+def serialize_switch_lookup(switch_id: int, host: str = '', port: int = -1) -> bytes:
+    """Serialize SWITCH_LOOKUP, a query for a switch's address or the
+    controller's answer. Port -1 means unknown.
+    Format: [1B type][4B switch_id][4B port][host as null-terminated]
+    """
+    return SWITCH_LOOKUP.pack(BIN_SWITCH_LOOKUP, switch_id, port) + host.encode('utf-8') + b'\x00'
 
 # Deserialization functions
 
+def message_type(data: bytes) -> int:
+    return data[0]
+
+def _unpack_routes(view: memoryview, num_routes: int) -> List[RoutingEntry]:
+    return [list(r) for r in ROUTE.iter_unpack(view[:ROUTE_SIZE * num_routes])]
+
+def _unpack_routes_flat(view: memoryview, num_routes: int) -> array:
+    flat = array('i')
+    flat.frombytes(view[:ROUTE_SIZE * num_routes])
+    if _SWAP:
+        flat.byteswap()
+    return flat
+
 def deserialize_register_request(data: bytes) -> Tuple[int, int]:
     """Deserialize REGISTER_REQUEST from binary format.
     Returns: (switch_id, port)
     """
-    _, switch_id, port = struct.unpack('!Bii', data[:9])
+    _, switch_id, port = REGISTER_REQUEST.unpack_from(data)
     return switch_id, port
 
 def deserialize_register_response(data: bytes) -> List[NeighborInfo]:
     """Deserialize REGISTER_RESPONSE from binary format."""
-    offset = 1  # Skip type byte
-    num_neighbors = struct.unpack('!H', data[offset:offset+2])[0]
-    offset += 2
+    view = memoryview(data)
+    _, num_neighbors = REGISTER_RESPONSE_HEADER.unpack_from(view)
+    offset = REGISTER_RESPONSE_HEADER.size
 
     neighbors = []
     for _ in range(num_neighbors):
-        nid, alive, port = struct.unpack('!iBi', data[offset:offset+9])
-        offset += 9
+        nid, alive, port = REGISTER_RESPONSE_ITEM.unpack_from(view, offset)
+        offset += REGISTER_RESPONSE_ITEM.size
         # Read null-terminated host string
         host_end = data.index(b'\x00', offset)
-        host = data[offset:host_end].decode('utf-8')
+        host = str(view[offset:host_end], 'utf-8')
         offset = host_end + 1
 
         neighbors.append({
@@ -96,42 +248,103 @@ def deserialize_register_response(data: bytes) -> List[NeighborInfo]:
 
     return neighbors
 
-def deserialize_routing_update(data: bytes) -> List[RoutingEntry]:
-    """Deserialize ROUTING_UPDATE from binary format."""
-    offset = 1  # Skip type byte
-    num_routes = struct.unpack('!H', data[offset:offset+2])[0]
-    offset += 2
+def deserialize_routing_update(data: bytes) -> Tuple[int, List[RoutingEntry]]:
+    """Deserialize ROUTING_UPDATE or ROUTING_DELTA from binary format.
+    Returns: (version, routes)
+    """
+    _, version, num_routes = ROUTING_HEADER.unpack_from(data)
+    return version, _unpack_routes(memoryview(data)[ROUTING_HEADER.size:], num_routes)
 
-    routes = []
-    for _ in range(num_routes):
-        sid, did, hop, dist = struct.unpack('!iiii', data[offset:offset+16])
-        offset += 16
-        routes.append([sid, did, hop, dist])
+def deserialize_routing_update_flat(data: bytes) -> Tuple[int, array]:
+    """Deserialize ROUTING_UPDATE or ROUTING_DELTA without building per-row lists.
+    Returns: (version, routes) where routes is a flat array('i') of
+    sid, did, hop, dist, backup_hop repeated for every row (ROUTE).
+    """
+    _, version, num_routes = ROUTING_HEADER.unpack_from(data)
+    return version, _unpack_routes_flat(memoryview(data)[ROUTING_HEADER.size:], num_routes)
 
-    return routes
+def deserialize_routing_fragment(data: bytes) -> Tuple[int, int, int, bool, List[RoutingEntry]]:
+    """Deserialize ROUTING_FRAGMENT from binary format.
+    Returns: (version, frag_index, frag_total, delta, routes)
+    """
+    _, version, index, total, delta, num_routes = ROUTING_FRAGMENT_HEADER.unpack_from(data)
+    routes = _unpack_routes(memoryview(data)[ROUTING_FRAGMENT_HEADER.size:], num_routes)
+    return version, index, total, bool(delta), routes
+
+def deserialize_routing_resync(data: bytes) -> Tuple[int, int]:
+    """Deserialize ROUTING_RESYNC from binary format.
+    Returns: (switch_id, version)
+    """
+    _, switch_id, version = ROUTING_RESYNC.unpack_from(data)
+    return switch_id, version
 
 def serialize_keep_alive(switch_id: int) -> bytes:
-    return struct.pack('!Bi', BIN_KEEP_ALIVE, switch_id)
+    return KEEP_ALIVE.pack(BIN_KEEP_ALIVE, switch_id)
 
 def deserialize_keep_alive(data: bytes) -> int:
-    _, switch_id = struct.unpack('!Bi', data[:5])
+    _, switch_id = KEEP_ALIVE.unpack_from(data)
     return switch_id
 
-def serialize_topology_update(switch_id: int, neighbors: List[Tuple[int, bool]]) -> bytes:
-    data = struct.pack('!BiH', BIN_TOPOLOGY_UPDATE, switch_id, len(neighbors))
+def serialize_topology_update(switch_id: int, neighbors: List[Tuple[int, bool]],
+                              seq: int = 0) -> bytes:
+    """Serialize TOPOLOGY_UPDATE, sent when a neighbor's alive state changes.
+    Format: [1B type][4B switch_id][4B seq][2B count] + count * [4B neighbor_id][1B alive]
+    """
+    buf = bytearray(TOPOLOGY_HEADER.size + TOPOLOGY_ITEM.size * len(neighbors))
+    TOPOLOGY_HEADER.pack_into(buf, 0, BIN_TOPOLOGY_UPDATE, switch_id, seq, len(neighbors))
+    offset = TOPOLOGY_HEADER.size
     for nid, alive in neighbors:
-        data += struct.pack('!iB', nid, 1 if alive else 0)
-    return data
-
-def deserialize_topology_update(data: bytes) -> Tuple[int, List[Tuple[int, bool]]]:
-    offset = 1
-    switch_id = struct.unpack('!i', data[offset:offset+4])[0]
-    offset += 4
-    num_neighbors = struct.unpack('!H', data[offset:offset+2])[0]
-    offset += 2
-    neighbors = []
-    for _ in range(num_neighbors):
-        nid, alive = struct.unpack('!iB', data[offset:offset+5])
-        offset += 5
-        neighbors.append((nid, bool(alive)))
-    return switch_id, neighbors
+        TOPOLOGY_ITEM.pack_into(buf, offset, nid, 1 if alive else 0)
+        offset += TOPOLOGY_ITEM.size
+    return buf
+
+def topology_update_sender(data: bytes) -> int:
+    # Sender id without decoding the neighbor list
+    return TOPOLOGY_HEADER.unpack_from(data)[1]
+
+def deserialize_topology_update(data: bytes) -> Tuple[int, int, List[Tuple[int, bool]]]:
+    """Returns: (switch_id, seq, [(neighbor_id, alive), ...])"""
+    _, switch_id, seq, num_neighbors = TOPOLOGY_HEADER.unpack_from(data)
+    start = TOPOLOGY_HEADER.size
+    view = memoryview(data)[start:start + TOPOLOGY_ITEM.size * num_neighbors]
+    neighbors = [(nid, bool(alive)) for nid, alive in TOPOLOGY_ITEM.iter_unpack(view)]
+    return switch_id, seq, neighbors
+
+def serialize_switch_heartbeat(switch_id: int, seq: int, version: int) -> bytes:
+    """Serialize SWITCH_HEARTBEAT, the periodic liveness signal to the controller.
+    Format: [1B type][4B switch_id][4B seq of the switch's latest TOPOLOGY_UPDATE]
+            [4B version of the switch's installed routing table]
+    """
+    return SWITCH_HEARTBEAT.pack(BIN_SWITCH_HEARTBEAT, switch_id, seq, version)
+
+def deserialize_switch_heartbeat(data: bytes) -> Tuple[int, int, int]:
+    """Returns: (switch_id, seq, version)"""
+    _, switch_id, seq, version = SWITCH_HEARTBEAT.unpack_from(data)
+    return switch_id, seq, version
+
+def serialize_topology_resync(seq: int) -> bytes:
+    """Serialize TOPOLOGY_RESYNC (controller asks a switch for its neighbor states).
+    Format: [1B type][4B latest seq the controller holds]
+    """
+    return TOPOLOGY_RESYNC.pack(BIN_TOPOLOGY_RESYNC, seq)
+
+def deserialize_data(data: bytes) -> Tuple[int, int, int, memoryview]:
+    """Returns: (src, dst, ttl, payload)"""
+    _, src, dst, ttl, _, length = DATA_HEADER.unpack_from(data)
+    return src, dst, ttl, memoryview(data)[DATA_HEADER.size:DATA_HEADER.size + length]
+
+def data_destination(data: bytes) -> Tuple[int, int, int, int]:
+    # Forwarding only needs (src, dst, ttl, flow); the payload is not touched
+    _, src, dst, ttl, flow, _ = DATA_HEADER.unpack_from(data)
+    return src, dst, ttl, flow
+
+def with_ttl(data: bytes, ttl: int) -> bytearray:
+    buf = bytearray(data)
+    buf[DATA_TTL_OFFSET] = ttl
+    return buf
+
+def deserialize_switch_lookup(data: bytes) -> Tuple[int, str, int]:
+    """Returns: (switch_id, host, port)"""
+    _, switch_id, port = SWITCH_LOOKUP.unpack_from(data)
+    end = data.index(b'\x00', SWITCH_LOOKUP.size)
+    return switch_id, bytes(data[SWITCH_LOOKUP.size:end]).decode('utf-8'), port
@@ -5,24 +5,62 @@ Author: Matt Bowring
 Email: mbowring@purdue.edu
 """
 
+import atexit
+import hashlib
 import sys
 import socket
-import struct
 import threading
 import time
 from datetime import datetime
 import heapq
-from typing import Dict, List, Tuple, Optional
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Optional
 
 from common import (
     Topology, SwitchInfo, RoutingEntry, NeighborInfo,
-    LOCALHOST, BUFFER_SIZE, UNREACHABLE_DISTANCE, UNREACHABLE_HOP,
+    LOCALHOST, BUFFER_SIZE, UNREACHABLE_HOP,
     KEY_HOST, KEY_PORT, KEY_NEIGHBOR_ID, KEY_ALIVE,
-    BIN_REGISTER_REQUEST, BIN_TOPOLOGY_UPDATE,
-    UPDATE_DELAY, TIMEOUT,
-    serialize_register_response, serialize_routing_update,
-    deserialize_register_request, deserialize_topology_update,
+    BIN_REGISTER_REQUEST, BIN_TOPOLOGY_UPDATE, BIN_ROUTING_RESYNC, BIN_SWITCH_HEARTBEAT,
+    BIN_SWITCH_LOOKUP,
+    LIVENESS_TICK,
+    serialize_register_response, serialize_routing_fragments,
+    deserialize_register_request, deserialize_topology_update, deserialize_routing_resync,
+    topology_update_sender, deserialize_switch_heartbeat, serialize_topology_resync,
+    serialize_switch_lookup, deserialize_switch_lookup,
+    message_type,
+    get_option, has_flag,
 )
+from checkpoint import Checkpoint, CheckpointWriter, load_checkpoint, checkpoint_writer_from_args
+from eventlog import AsyncLogWriter, log_writer_from_args
+from topology import TopologyConfigError, load_topology
+from liveness import TimerWheel, FailureDetector, FixedTimeout, detector_from_args
+from routing import (
+    IncrementalRouter, ParallelRouter, RouteTable, backup_dependents, csr_routing_tables,
+    merge_tables, switch_alternates, np,
+)
+
+# Routing engines selectable with --routing
+ROUTING_FULL: str = 'full'
+ROUTING_INCREMENTAL: str = 'incremental'
+ROUTING_CSR: str = 'csr'
+ROUTING_ENGINES = (ROUTING_FULL, ROUTING_INCREMENTAL, ROUTING_CSR)
+
+# Recompute batching, overridable with --hold-down/--max-delay
+RECOMPUTE_HOLD_DOWN: float = 0.25  # (seconds) of quiet before a recompute
+RECOMPUTE_MAX_DELAY: float = 1.0  # (seconds) cap on how long an event may wait
+
+# Equal-cost next hops shipped per destination, overridable with --ecmp; the
+# default of 1 ships only the primary hop, since the sets grow tables and recomputes
+ECMP_MAX_PATHS: int = 1
+
+# Tables kept for recently seen topologies, overridable with --route-cache/--route-cache-mb
+ROUTE_CACHE_ENTRIES: int = 16
+ROUTE_CACHE_MB: int = 512
+
+# Table versions skipped after a warm restart, so that switches accept the
+# restored controller's tables even if the checkpoint lagged behind
+RESTORE_VERSION_GAP: int = 1024
 
 # Please do not modify the name of the log file, otherwise you will lose points because the grader won't be able to find your log file
 LOG_FILE = "Controller.log"
@@ -74,7 +112,7 @@ def register_response_sent(switch_id: int) -> None:
 # One example can be found in the sample log in starter code.
 # After switch 1 is killed, the routing update from the controller does not have routes from switch 1 to other switches.
 
-def routing_table_update(routing_table: List[RoutingEntry]) -> None:
+def routing_table_update(routing_table: Iterable[RoutingEntry]) -> None:
     log: List[str] = []
     log.append(str(datetime.time(datetime.now())) + "\n")
     log.append("Routing Update\n")
@@ -116,41 +154,214 @@ def topology_update_switch_alive(switch_id: int) -> None:
     log.append(f"Switch Alive {switch_id}\n")
     write_to_log(log)
 
+# Background writer for log records; None writes synchronously
+LOG_WRITER: Optional[AsyncLogWriter] = None
+
 def write_to_log(log: List[str]) -> None:
+    if LOG_WRITER is not None:
+        LOG_WRITER.write(LOG_FILE, log)
+        return
     with open(LOG_FILE, 'a+') as log_file:
         log_file.write("\n\n")
         # Write to log
         log_file.writelines(log)
 
+def topology_fingerprint(topo: Topology, n: int) -> bytes:
+    """Canonical hash of a topology: the same switches and links give the
+    same fingerprint whatever the order they are listed in."""
+    flat = array('i', [n])
+    flat.extend(sorted(topo))
+    for u, v, cost in sorted((u, v, cost) for u, edges in topo.items() for v, cost in edges):
+        flat.extend((u, v, cost))
+    return hashlib.blake2b(flat.tobytes(), digest_size=16).digest()
+
+def tables_size(tables: Dict[int, RouteTable]) -> int:
+    # Bytes held by a set of tables, counting shared vectors once per table
+    # (ECMP hop tuples are sized from their lengths, which is exact for tuples)
+    size = sys.getsizeof(tables)
+    empty, slot = sys.getsizeof(()), sys.getsizeof((0,)) - sys.getsizeof(())
+    for table in tables.values():
+        size += (sys.getsizeof(table.hop) + sys.getsizeof(table.dist)
+                 + sys.getsizeof(table.backup) + sys.getsizeof(table.ecmp)
+                 + empty * len(table.ecmp) + slot * sum(map(len, table.ecmp.values())))
+    return size
+
+class RoutingTableLRU:
+    """Computed routing tables of recently seen topologies, keyed by
+    topology_fingerprint and bounded by entry count and total bytes. When
+    a flapping link takes the topology back to a state seen before, its
+    tables come from here instead of a recompute."""
+
+    def __init__(self, max_entries: int = ROUTE_CACHE_ENTRIES,
+                 max_bytes: int = ROUTE_CACHE_MB << 20) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[bytes, Tuple[Dict[int, RouteTable], int]]" = OrderedDict()
+        self.bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: bytes) -> Optional[Dict[int, RouteTable]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        # Tables are never modified once computed, so a shallow copy is enough
+        return dict(entry[0])
+
+    def put(self, key: bytes, tables: Dict[int, RouteTable]) -> None:
+        size = tables_size(tables)
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self._entries[key] = (dict(tables), size)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def summary(self) -> str:
+        return (f"Routing table cache: {self.hits} hits, {self.misses} misses, "
+                f"{self.evictions} evictions, {len(self._entries)} entries, "
+                f"{self.bytes / 1e6:.1f} MB")
+
 class RoutingCache:
-    def __init__(self) -> None:
+    def __init__(self, engine: str = ROUTING_INCREMENTAL, verify: bool = False,
+                 workers: int = 1, ecmp_paths: int = ECMP_MAX_PATHS,
+                 memo: Optional[RoutingTableLRU] = None) -> None:
         self._last_topo: Optional[Topology] = None
-        self.routes_by_switch: Dict[int, List[RoutingEntry]] = {}
+        self._last_version: Optional[int] = None
+        self.routes_by_switch: Dict[int, RouteTable] = {}
         self._n: int = 0
-
-    def update(self, topo: Topology, n: int) -> bool:
-        if self._last_topo == topo and self._n == n:
-            return False
-        self.routes_by_switch = self._compute_routing_tables(topo, n)
+        self._engine = engine
+        self._verify = verify
+        self.ecmp_paths = max(1, ecmp_paths)
+        # Full recomputes (full engine, incremental rebuilds) shard sources over workers
+        self._parallel = ParallelRouter(workers) if workers != 1 else None
+        self._router = IncrementalRouter(parallel=self._parallel) \
+            if engine == ROUTING_INCREMENTAL else None
+        # Topology and tables of the last computation, which the next one is
+        # diffed against; the incremental router's trees belong to them. They
+        # lag behind _last_topo after a memo hit
+        self._computed_topo: Optional[Topology] = None
+        self._computed_tables: Dict[int, RouteTable] = {}
+        self._computed_n: int = 0
+        self.memo = memo if memo is not None else RoutingTableLRU()
+        self.verify_mismatches: int = 0
+
+    def update(self, topo: Topology, n: int, version: Optional[int] = None) -> bool:
+        # With a version from the caller an unchanged topology costs one comparison,
+        # otherwise fall back to comparing the whole topology
+        if self._n == n and self._last_topo is not None:
+            if version is not None and version == self._last_version:
+                return False
+            if version is None and self._last_topo == topo:
+                return False
+        key = topology_fingerprint(topo, n) if self.memo.max_entries > 0 else None
+        cached = self.memo.get(key) if key is not None else None
+        if cached is not None:
+            self.routes_by_switch = cached
+        else:
+            self._compute(topo, n)
+        if self._verify and (cached is not None or self._engine != ROUTING_FULL
+                             or self._parallel is not None):
+            self._check_against_full(topo, n)
+        if cached is None and key is not None:
+            self.memo.put(key, self.routes_by_switch)
         self._last_topo = topo
+        self._last_version = version
         self._n = n
         return True
 
-    def flat_routes(self, switch_alive: Optional[Dict[int, bool]] = None) -> List[RoutingEntry]:
-        return [r for sid, routes in self.routes_by_switch.items()
-                if switch_alive is None or switch_alive.get(sid, False)
-                for r in routes]
+    @property
+    def version(self) -> Optional[int]:
+        # Topology version routes_by_switch was computed for
+        return self._last_version
+
+    def restore(self, topo: Topology, n: int, version: int,
+                tables: Dict[int, RouteTable]) -> None:
+        # Tables from a checkpoint; the incremental router rebuilds its trees
+        # on the next change
+        self.routes_by_switch = tables
+        self._last_topo = topo
+        self._last_version = version
+        self._n = n
 
-    def _compute_routing_tables(self, topo: Topology, n: int) -> Dict[int, List[RoutingEntry]]:
-        by_switch: Dict[int, List[RoutingEntry]] = {}
+    def _compute(self, topo: Topology, n: int) -> None:
+        old = self._computed_topo if self._computed_n == n else None
+        if self._router is not None:
+            router = self._router
+            changed = router.update(old, topo, n)
+            fresh = {}
+            for sid in changed:
+                prev = self._computed_tables.get(sid) if router.dirty is not None else None
+                if prev is None:
+                    fresh[sid] = RouteTable.from_tree(sid, router.dist[sid], router.hop[sid])
+                else:
+                    # Only the rows the repair touched can differ
+                    fresh[sid] = prev.patched(router.dist[sid], router.hop[sid],
+                                              router.dirty[sid])
+        elif self._engine == ROUTING_CSR:
+            fresh = csr_routing_tables(topo, n)
+        else:
+            fresh = self._full_tables(topo, n)
+        affected: Iterable[int] = range(n)
+        if old is None:
+            tables = fresh
+        else:
+            # Alternates only for switches whose own or neighbors' rows changed
+            tables, changed, moved = merge_tables(self._computed_tables, fresh)
+            affected = backup_dependents(changed, moved, old, topo)
+        add_alternates(tables, topo, affected, self.ecmp_paths)
+        self._computed_topo = topo
+        self._computed_tables = tables
+        self._computed_n = n
+        self.routes_by_switch = tables
+
+    def _check_against_full(self, topo: Topology, n: int) -> None:
+        # Compare engine results with a full recompute, keep the full one on mismatch
+        expected = self._compute_routing_tables(topo, n)
+        add_alternates(expected, topo, range(n), self.ecmp_paths)
+        bad = [sid for sid in range(n) if expected[sid] != self.routes_by_switch.get(sid)]
+        if bad:
+            self.verify_mismatches += 1
+            print(f"Routing verify: {self._engine} result differs for switches {bad}, "
+                  f"using full recompute", file=sys.stderr)
+            self.routes_by_switch = expected
+            if self._router is not None:
+                self._router.rebuild(topo, n)
+            self._computed_topo = topo
+            self._computed_tables = dict(expected)
+            self._computed_n = n
+
+    def flat_routes(self, switch_alive: Optional[Dict[int, bool]] = None) -> Iterator[RoutingEntry]:
+        # Rows are built one switch at a time as the consumer iterates
+        for sid, table in self.routes_by_switch.items():
+            if switch_alive is None or switch_alive.get(sid, False):
+                yield from table.rows()
+
+    def _full_tables(self, topo: Topology, n: int) -> Dict[int, RouteTable]:
+        trees = self._parallel.trees(topo, n) if self._parallel is not None else None
+        if trees is None:
+            return self._compute_routing_tables(topo, n)
+        dists, _, hops = trees
+        return {sid: RouteTable.from_tree(sid, dists[sid], hops[sid]) for sid in range(n)}
+
+    def _compute_routing_tables(self, topo: Topology, n: int) -> Dict[int, RouteTable]:
+        by_switch: Dict[int, RouteTable] = {}
         for sid in range(n):
             dist, hop = self._dijkstra(sid, topo, n)
-            by_switch[sid] = []
-            for did in range(n):
-                if dist[did] == float('inf'):
-                    by_switch[sid].append([sid, did, UNREACHABLE_HOP, UNREACHABLE_DISTANCE])
-                else:
-                    by_switch[sid].append([sid, did, hop[did], int(dist[did])])
+            by_switch[sid] = RouteTable.from_tree(sid, [dist[did] for did in range(n)],
+                                                  [hop[did] for did in range(n)])
         return by_switch
 
     def _dijkstra(self, src: int, topo: Topology, n: int) -> Tuple[Dict[int, float], Dict[int, int]]:
@@ -190,6 +401,12 @@ class RoutingCache:
 
         return dist, hop
 
+def add_alternates(tables: Dict[int, RouteTable], topo: Topology, sids: Iterable[int],
+                   max_paths: int = 1) -> None:
+    # Loop-free alternates for local fast reroute and equal-cost next-hop sets
+    for sid, backup, ecmp in switch_alternates(tables, topo, sids, max_paths):
+        tables[sid] = tables[sid].with_alternates(backup, ecmp)
+
 def build_neighbor_list(topo: Topology, sid: int, sw: Dict[int, SwitchInfo],
                         switch_alive: Optional[Dict[int, bool]] = None) -> List[NeighborInfo]:
     nbrs = []
@@ -202,67 +419,74 @@ def build_neighbor_list(topo: Topology, sid: int, sw: Dict[int, SwitchInfo],
         })
     return nbrs
 
-def bootstrap(port: int, cfg: str) -> Tuple[socket.socket, Dict[int, SwitchInfo], Topology]:
-    # Register Switches with the Controller
-
-    # Parse the config file to get topology information
-    topo: Topology = {}
-    n: int = 0
-    with open(cfg, 'r') as f:
-        lines = f.readlines()
-        n = int(lines[0].strip())
-
-        # Initialize topology for all switches
-        for i in range(n):
-            topo[i] = []
-
-        # Parse topology edges
-        for line in lines[1:]:
-            line = line.strip()
-            if line:
-                parts = line.split()
-                s1 = int(parts[0])
-                s2 = int(parts[1])
-                dist = int(parts[2])
-                # Bidirectional
-                topo[s1].append((s2, dist))
-                topo[s2].append((s1, dist))
+def load_config(cfg: str) -> Topology:
+    # Parse the config file (text or binary) to get topology information
+    return load_topology(cfg).to_topology()
 
+def open_controller_socket(port: int) -> socket.socket:
     # Controller binds to a well-known port number
     ctrl = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     ctrl.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     ctrl.bind((LOCALHOST, port))
+    return ctrl
+
+def bootstrap(port: int, topo: Topology, quorum: Optional[int] = None,
+              deadline: Optional[float] = None,
+              joins: Optional["JoinTracker"] = None) -> Tuple[socket.socket, Dict[int, SwitchInfo], Topology]:
+    # Register Switches with the Controller: wait for quorum switches (all of
+    # them by default), but no longer than deadline seconds. Switches that
+    # register later join the running controller one by one
+    n = len(topo)
+    ctrl = open_controller_socket(port)
 
     # Store information about registered switches
     sw: Dict[int, SwitchInfo] = {}
-    while len(sw) < n:
+    quorum = n if quorum is None else min(quorum, n)
+    give_up = None if deadline is None else time.time() + deadline
+    while len(sw) < quorum:
         # Receive Register Request from switch
-        data, addr = ctrl.recvfrom(BUFFER_SIZE)
-        msg_type = struct.unpack('!B', data[:1])[0]
-
-        assert msg_type == BIN_REGISTER_REQUEST
+        if give_up is not None:
+            ctrl.settimeout(max(give_up - time.time(), 1e-3))
+        try:
+            data, addr = ctrl.recvfrom(BUFFER_SIZE)
+        except socket.timeout:
+            break
+        if message_type(data) != BIN_REGISTER_REQUEST:
+            # e.g. a traffic source looking up a switch too early
+            continue
 
         sid, sport = deserialize_register_request(data)
+        if sid not in topo:
+            continue
 
         # Log the Register Request
         register_request_received(sid)
+        if joins is not None:
+            joins.registered(sid, time.time())
 
         # Store switch information
         sw[sid] = {
             KEY_HOST: addr[0],
             KEY_PORT: sport
         }
+    ctrl.settimeout(None)
 
-    # Send Register Response to each switch once they've been registered
+    send_register_responses(ctrl, topo, sw)
+    return ctrl, sw, topo
+
+def send_register_responses(ctrl: socket.socket, topo: Topology, sw: Dict[int, SwitchInfo],
+                            logging: bool = True) -> None:
+    # Send Register Response to each switch once they've been registered;
+    # switches still missing are listed as dead neighbors
+    registered = {sid: True for sid in sw}
     for sid, info in sw.items():
-        nbrs = build_neighbor_list(topo, sid, sw)
+        nbrs = build_neighbor_list(topo, sid, sw, registered)
         ctrl.sendto(
             serialize_register_response(nbrs),
             (info[KEY_HOST], info[KEY_PORT])
         )
-        register_response_sent(sid)
-
-    return ctrl, sw, topo
+        if logging:
+            register_response_sent(sid)
 
 def build_topology(topo_template: Topology, switch_alive: Dict[int, bool],
                    switch_neighbors: Dict[int, Dict[int, bool]]) -> Topology:
@@ -280,142 +504,615 @@ def build_topology(topo_template: Topology, switch_alive: Dict[int, bool],
                 current_topo[sid].append((nid, cost))
     return current_topo
 
+class RoutingUpdateTracker:
+    """Remembers the table and version last sent to each switch, so that
+    later updates only carry the rows that changed."""
+
+    def __init__(self) -> None:
+        self.sent: Dict[int, RouteTable] = {}
+        self.version: Dict[int, int] = {}
+
+    def forget(self, sid: int) -> None:
+        # Next update to this switch will be a full table
+        self.sent.pop(sid, None)
+
+    def changed_rows(self, sid: int, table: RouteTable) -> Optional[List[RoutingEntry]]:
+        """Rows of table that differ from the last sent table, or None if
+        the switch needs a full table."""
+        last = self.sent.get(sid)
+        if last is None or len(last) != len(table):
+            return None
+        return table.changed_rows(last)
+
+    def record(self, sid: int, table: RouteTable) -> int:
+        # Tables are replaced, never modified, once computed, so keeping a reference is safe
+        self.sent[sid] = table
+        self.version[sid] = self.version.get(sid, 0) + 1
+        return self.version[sid]
+
+class RouteSender:
+    """How routing tables reach the switches: as ROUTING_UPDATE, ROUTING_DELTA
+    or ROUTING_FRAGMENT datagrams sent through ctrl. The simulator swaps in
+    one that hands the tables over in memory."""
+
+    def send_table(self, ctrl: socket.socket, addr: Tuple[str, int],
+                   table: RouteTable, version: int) -> None:
+        for data in serialize_routing_fragments(table.wire_rows(), version):
+            ctrl.sendto(data, addr)
+
+    def send_delta(self, ctrl: socket.socket, addr: Tuple[str, int],
+                   rows: List[RoutingEntry], version: int) -> None:
+        for data in serialize_routing_fragments(rows, version, delta=True):
+            ctrl.sendto(data, addr)
+
+DATAGRAM_SENDER = RouteSender()
+
+def send_full_table(ctrl: socket.socket, addr: Tuple[str, int], sid: int,
+                    table: RouteTable, tracker: RoutingUpdateTracker,
+                    sender: RouteSender = DATAGRAM_SENDER) -> None:
+    version = tracker.record(sid, table)
+    sender.send_table(ctrl, addr, table, version)
+
 def send_routing_updates(ctrl: socket.socket, sw: Dict[int, SwitchInfo],
-                         routes_by_switch: Dict[int, List[RoutingEntry]],
-                         switch_alive: Optional[Dict[int, bool]] = None) -> None:
-    # Send routing update to each switch (binary format)
+                         routes_by_switch: Dict[int, RouteTable],
+                         switch_alive: Optional[Dict[int, bool]] = None,
+                         tracker: Optional[RoutingUpdateTracker] = None,
+                         sender: RouteSender = DATAGRAM_SENDER) -> None:
+    # Send routing update to each switch (binary format); with a tracker only
+    # switches whose table changed get a message, holding just the changed rows
     for sid, rt in routes_by_switch.items():
         if sid not in sw:
             continue
         if switch_alive is not None and not switch_alive.get(sid, False):
             continue
-        ctrl.sendto(
-            serialize_routing_update(rt),
-            (sw[sid][KEY_HOST], sw[sid][KEY_PORT])
+        addr = (sw[sid][KEY_HOST], sw[sid][KEY_PORT])
+        if tracker is None:
+            sender.send_table(ctrl, addr, rt, 0)
+            continue
+        delta = tracker.changed_rows(sid, rt)
+        if delta is None:
+            send_full_table(ctrl, addr, sid, rt, tracker, sender)
+        elif delta:
+            version = tracker.record(sid, rt)
+            sender.send_delta(ctrl, addr, delta, version)
+
+class RecomputeDebouncer:
+    """Folds bursts of topology events into one recompute.
+
+    A batch opens with its first event and is due hold_down after its latest
+    event, but never later than max_delay after its first, so a steady stream
+    of events cannot postpone routing forever. A hold_down of 0 recomputes on
+    every event. Counts how many recomputes batching saved and how long the
+    window held events back.
+    """
+
+    def __init__(self, hold_down: float = RECOMPUTE_HOLD_DOWN,
+                 max_delay: float = RECOMPUTE_MAX_DELAY) -> None:
+        self.hold_down = max(0.0, hold_down)
+        self.max_delay = max(max_delay, self.hold_down)
+        self._first: Optional[float] = None
+        self._last: float = 0.0
+        self.events: int = 0
+        self.recomputes: int = 0
+        self.total_delay: float = 0.0
+        self.max_added_delay: float = 0.0
+
+    def record(self, now: float) -> None:
+        self.events += 1
+        if self._first is None:
+            self._first = now
+        self._last = now
+
+    def deadline(self) -> Optional[float]:
+        """When the pending batch is due, or None if nothing is pending."""
+        if self._first is None:
+            return None
+        return min(self._last + self.hold_down, self._first + self.max_delay)
+
+    def take(self, now: float) -> bool:
+        """Consume the pending batch if it is due at now."""
+        due = self.deadline()
+        if due is None or now < due:
+            return False
+        delay = now - self._first
+        self.recomputes += 1
+        self.total_delay += delay
+        self.max_added_delay = max(self.max_added_delay, delay)
+        self._first = None
+        return True
+
+    @property
+    def saved(self) -> int:
+        return self.events - self.recomputes
+
+    def summary(self) -> str:
+        mean = self.total_delay / self.recomputes if self.recomputes else 0.0
+        return (f"Recompute batching: {self.events} events, {self.recomputes} recomputes, "
+                f"{self.saved} saved, added delay mean {mean * 1000:.1f}ms "
+                f"max {self.max_added_delay * 1000:.1f}ms")
+
+class JoinTracker:
+    """Time from each switch's REGISTER_REQUEST to the first routing table
+    sent to it. With report, each switch's time is printed as it happens;
+    otherwise only the summary is kept, so large fabrics get no line per switch."""
+
+    def __init__(self, report: bool = False) -> None:
+        self.report = report
+        self.pending: Dict[int, float] = {}
+        self.latency: Dict[int, float] = {}
+
+    def registered(self, sid: int, now: float) -> None:
+        self.pending[sid] = now
+
+    def routes_sent(self, sent: Dict[int, RouteTable], now: float) -> None:
+        # sent holds the switches that have been sent a table, see RoutingUpdateTracker
+        for sid in [sid for sid in self.pending if sid in sent]:
+            latency = now - self.pending.pop(sid)
+            self.latency[sid] = latency
+            if self.report:
+                print(f"Switch {sid} first route {latency * 1000:.1f}ms after registering")
+
+    def summary(self) -> str:
+        values = sorted(self.latency.values())
+        if not values:
+            return f"Time to first route: no switches routed, {len(self.pending)} waiting"
+        return (f"Time to first route: {len(values)} switches, "
+                f"p50 {values[len(values) // 2] * 1000:.1f}ms, max {values[-1] * 1000:.1f}ms, "
+                f"{len(self.pending)} waiting")
+
+class Controller:
+    """Live topology and liveness state of the controller after bootstrap.
+
+    Message handlers and the liveness check only touch this object and send
+    through ctrl, which may be a socket or an asyncio transport. Callers are
+    responsible for serialising access to it.
+
+    sw may hold only some of the switches in topo_template. The others
+    count as dead until their REGISTER_REQUEST arrives, and then join like
+    a restarted switch.
+    """
+
+    def __init__(self, ctrl: socket.socket, sw: Dict[int, SwitchInfo], topo_template: Topology,
+                 cache: RoutingCache, tracker: Optional[RoutingUpdateTracker] = None,
+                 debouncer: Optional[RecomputeDebouncer] = None,
+                 liveness_tick: float = LIVENESS_TICK,
+                 detector: Optional[FailureDetector] = None,
+                 joins: Optional[JoinTracker] = None,
+                 checkpoint: Optional[CheckpointWriter] = None,
+                 clock: Callable[[], float] = time.time, logging: bool = True,
+                 sender: RouteSender = DATAGRAM_SENDER) -> None:
+        self.ctrl = ctrl
+        self.sender = sender
+        self.sw = sw
+        self.topo_template = topo_template
+        self.cache = cache
+        self.tracker = tracker if tracker is not None else RoutingUpdateTracker()
+        self.debouncer = debouncer if debouncer is not None else RecomputeDebouncer()
+        self.joins = joins
+        self.checkpoint = checkpoint
+        # Source of the current time, and whether events go to Controller.log
+        self.clock = clock
+        self.logging = logging
+        self.n = len(topo_template)
+        self.switch_alive: Dict[int, bool] = {sid: True for sid in sw}
+        now = clock()
+        self.last_heard: Dict[int, float] = {}
+        # Each live switch has a timer at the deadline its failure detector gives
+        self.detector = detector if detector is not None else FixedTimeout()
+        self.liveness = TimerWheel(now, liveness_tick)
+        for sid in sw:
+            self.heard(sid, now)
+        self.switch_neighbors: Dict[int, Dict[int, bool]] = {}
+        for sid in sw:
+            self.switch_neighbors[sid] = {nid: True for nid, _ in topo_template[sid]}
+        self.messages_handled: int = 0
+        # Bumped on every change to switch_alive/switch_neighbors that can affect routes
+        self.topology_version: int = 0
+        self._topology: Optional[Topology] = None
+        # Last TOPOLOGY_UPDATE datagram per switch; a byte-identical repeat changes nothing
+        self._last_report: Dict[int, bytes] = {}
+        # Sequence number of the last TOPOLOGY_UPDATE applied per switch
+        self.topology_seq: Dict[int, int] = {}
+        self.address_changes: int = 0
+        # Table version a switch's heartbeat reported while behind the last one sent to it
+        self._lagging: Dict[int, int] = {}
+
+    def start(self, resume: Optional[Checkpoint] = None) -> None:
+        if resume is not None:
+            self.restore(resume)
+            return
+        # Compute, log and send the initial routing tables
+        self.cache.update(self.current_topology(), self.n, self.topology_version)
+        self.log(routing_table_update, self.cache.flat_routes())
+        send_routing_updates(self.ctrl, self.sw, self.cache.routes_by_switch, tracker=self.tracker,
+                             sender=self.sender)
+        if self.joins is not None:
+            self.joins.routes_sent(self.tracker.sent, self.clock())
+
+    def log(self, event: Callable, *args) -> None:
+        if self.logging:
+            event(*args)
+
+    def restore(self, cp: Checkpoint) -> None:
+        """Pick up from a checkpoint taken by a previous controller process.
+        Switches keep the tables they have; every switch counted alive gets a
+        fresh deadline and is declared dead unless a heartbeat arrives by then.
+        """
+        self.switch_alive = dict(cp.switch_alive)
+        self.switch_neighbors = {sid: dict(nbrs) for sid, nbrs in cp.switch_neighbors.items()}
+        self.topology_seq = dict(cp.topology_seq)
+        self.topology_version = cp.topology_version
+        self._topology = None
+        for sid, alive in self.switch_alive.items():
+            if not alive:
+                self.liveness.cancel(sid)
+                self.detector.forget(sid)
+        # Tables sent after the checkpoint was taken are unknown, so the next
+        # update to each switch is a full table with a version it will accept
+        self.tracker.sent.clear()
+        self.tracker.version = {sid: version + RESTORE_VERSION_GAP
+                                for sid, version in cp.versions.items()}
+        if cp.tables:
+            self.cache.restore(self.current_topology(), self.n, self.topology_version, cp.tables)
+        else:
+            self.request_recompute()
+
+    def snapshot(self) -> Checkpoint:
+        return Checkpoint(self.n, self.topology_version, self.sw, self.switch_alive,
+                          self.switch_neighbors, self.topology_seq,
+                          self.cache.routes_by_switch, self.tracker.version)
+
+    def maybe_checkpoint(self, now: float) -> None:
+        # Cheap signature first: only a changed state is written out. Tables
+        # still being recomputed for the current topology are not saved
+        if (self.checkpoint is None or not self.checkpoint.due(now)
+                or self.cache.version != self.topology_version):
+            return
+        signature = (self.topology_version, sum(self.tracker.version.values()),
+                     self.address_changes, len(self.sw))
+        self.checkpoint.maybe_save(now, signature, self.snapshot)
+
+    def current_topology(self) -> Topology:
+        # Rebuilt only after a change; callers must not mutate the result
+        if self._topology is None:
+            self._topology = build_topology(self.topo_template, self.switch_alive,
+                                            self.switch_neighbors)
+        return self._topology
+
+    def topology_changed(self) -> None:
+        self.topology_version += 1
+        self._topology = None
+
+    def recompute_and_send(self) -> None:
+        if self.cache.update(self.current_topology(), self.n, self.topology_version):
+            self.publish_routes()
+
+    def publish_routes(self) -> None:
+        self.log(routing_table_update, self.cache.flat_routes(self.switch_alive))
+        send_routing_updates(self.ctrl, self.sw, self.cache.routes_by_switch,
+                             self.switch_alive, self.tracker, self.sender)
+        if self.joins is not None:
+            self.joins.routes_sent(self.tracker.sent, self.clock())
+
+    def request_recompute(self) -> None:
+        now = self.clock()
+        self.debouncer.record(now)
+        self.run_due_recompute(now)
+
+    def run_due_recompute(self, now: float) -> None:
+        # Called by the serving loop once the debouncer's deadline has passed
+        if self.debouncer.take(now):
+            self.recompute_and_send()
+
+    def send_table(self, sid: int) -> None:
+        # Full table to one switch, e.g. after re-registration or a resync request
+        if sid in self.sw and sid in self.cache.routes_by_switch:
+            send_full_table(self.ctrl, (self.sw[sid][KEY_HOST], self.sw[sid][KEY_PORT]),
+                            sid, self.cache.routes_by_switch[sid], self.tracker, self.sender)
+            if self.joins is not None:
+                self.joins.routes_sent(self.tracker.sent, self.clock())
+
+    def heard(self, sid: int, now: float) -> None:
+        self.last_heard[sid] = now
+        self.liveness.schedule(sid, self.detector.heard(sid, now))
+
+    def refresh(self, sid: int, now: float) -> None:
+        # Sign of life that is not a heartbeat: pushes the deadline out without
+        # giving the failure detector an inter-arrival sample, since bursts of
+        # such messages would shrink its learned heartbeat interval
+        self.last_heard[sid] = now
+        self.liveness.schedule(sid, self.detector.deadline(sid, now))
+
+    def check_liveness(self, now: float) -> None:
+        # Called every liveness tick; only switches whose timer ran out are visited
+        changed = False
+        for sid in self.liveness.expire(now):
+            if self.switch_alive.get(sid, False):
+                self.switch_alive[sid] = False
+                self.detector.forget(sid)
+                self._last_report.pop(sid, None)
+                self.log(topology_update_switch_dead, sid)
+                changed = True
+        if changed:
+            self.topology_changed()
+            self.request_recompute()
+        self.maybe_checkpoint(now)
+
+    def handle_message(self, data: bytes, addr: Tuple[str, int]) -> None:
+        msg_type = message_type(data)
+        self.messages_handled += 1
+
+        if msg_type == BIN_SWITCH_HEARTBEAT:
+            self.handle_heartbeat(data, addr)
+        elif msg_type == BIN_TOPOLOGY_UPDATE:
+            self.handle_topology_update(data, addr)
+        elif msg_type == BIN_REGISTER_REQUEST:
+            self.handle_register_request(data, addr)
+        elif msg_type == BIN_ROUTING_RESYNC:
+            # Switch missed a delta and asks for its full table
+            sid_resync, _ = deserialize_routing_resync(data)
+            self.send_table(sid_resync)
+        elif msg_type == BIN_SWITCH_LOOKUP:
+            # A traffic tool asks where to inject packets for a switch
+            sid_lookup, _, _ = deserialize_switch_lookup(data)
+            info = self.sw.get(sid_lookup)
+            reply = serialize_switch_lookup(sid_lookup, info[KEY_HOST], info[KEY_PORT]) \
+                if info is not None else serialize_switch_lookup(sid_lookup)
+            self.ctrl.sendto(reply, addr)
+
+    def update_address(self, sid: int, addr: Tuple[str, int]) -> None:
+        # Follow the switch's address (handles port changes on restart)
+        info = self.sw[sid]
+        if info[KEY_PORT] != addr[1] or info[KEY_HOST] != addr[0]:
+            info[KEY_HOST] = addr[0]
+            info[KEY_PORT] = addr[1]
+            self.address_changes += 1
+
+    def revive(self, sid: int) -> bool:
+        # A switch declared dead was heard from again
+        if self.switch_alive.get(sid, True):
+            return False
+        self.switch_alive[sid] = True
+        self.log(topology_update_switch_alive, sid)
+        return True
+
+    def request_topology(self, sid: int) -> None:
+        info = self.sw[sid]
+        self.ctrl.sendto(serialize_topology_resync(self.topology_seq.get(sid, 0)),
+                         (info[KEY_HOST], info[KEY_PORT]))
+
+    def handle_heartbeat(self, data: bytes, addr: Tuple[str, int]) -> None:
+        sender_id, seq, version = deserialize_switch_heartbeat(data)
+        if sender_id not in self.sw:
+            return
+
+        self.heard(sender_id, self.clock())
+        self.update_address(sender_id, addr)
+
+        if self.revive(sender_id):
+            # Its neighbor states may have moved on while it was considered dead
+            self.topology_changed()
+            self.request_recompute()
+            self.request_topology(sender_id)
+        elif seq > self.topology_seq.get(sender_id, 0):
+            # A TOPOLOGY_UPDATE from this switch was lost
+            self.request_topology(sender_id)
+        self.check_table_version(sender_id, version)
+
+    def check_table_version(self, sid: int, version: int) -> None:
+        # A switch reporting the same older table version in two heartbeats in
+        # a row lost the last update sent to it, which it cannot notice by
+        # itself; the first report may just have crossed the update in flight
+        if sid not in self.tracker.sent or version >= self.tracker.version.get(sid, 0):
+            self._lagging.pop(sid, None)
+        elif self._lagging.get(sid) == version:
+            del self._lagging[sid]
+            self.send_table(sid)
+        else:
+            self._lagging[sid] = version
+
+    def handle_topology_update(self, data: bytes, addr: Tuple[str, int]) -> None:
+        sender_id = topology_update_sender(data)
+        if sender_id not in self.sw:
+            return
+
+        self.refresh(sender_id, self.clock())
+
+        # Repeat of the last report from the same address: nothing to do
+        info = self.sw[sender_id]
+        if (self._last_report.get(sender_id) == data and info[KEY_PORT] == addr[1]
+                and info[KEY_HOST] == addr[0]):
+            return
+        _, seq, nbr_status = deserialize_topology_update(data)
+        if seq < self.topology_seq.get(sender_id, 0):
+            # Overtaken by a newer report
+            return
+        self._last_report[sender_id] = bytes(data)
+        self.topology_seq[sender_id] = seq
+
+        self.update_address(sender_id, addr)
+        changed = self.revive(sender_id)
+
+        # Detect link deaths
+        old_nbrs = self.switch_neighbors.get(sender_id, {})
+        for nid, alive in nbr_status:
+            was_alive = old_nbrs.get(nid, True)
+            if was_alive and not alive:
+                self.log(topology_update_link_dead, sender_id, nid)
+
+        # Update neighbor status
+        new_nbrs = {nid: alive for nid, alive in nbr_status}
+        if new_nbrs != old_nbrs:
+            self.switch_neighbors[sender_id] = new_nbrs
+            changed = True
+
+        if changed:
+            self.topology_changed()
+            self.request_recompute()
+
+    def handle_register_request(self, data: bytes, addr: Tuple[str, int]) -> None:
+        # Handle a switch joining late or re-registering after a restart
+        sid_restart, sport_restart = deserialize_register_request(data)
+        if sid_restart not in self.topo_template:
+            return
+        first_join = sid_restart not in self.sw
+        if self.joins is not None:
+            self.joins.registered(sid_restart, self.clock())
+
+        self.sw[sid_restart] = {KEY_HOST: addr[0], KEY_PORT: sport_restart}
+        self.address_changes += 1
+
+        self.tracker.forget(sid_restart)
+        self._last_report.pop(sid_restart, None)
+        # A restarted switch numbers its reports from zero again
+        self.topology_seq.pop(sid_restart, None)
+
+        # Send register response with current neighbor info
+        nbrs = build_neighbor_list(self.topo_template, sid_restart, self.sw, self.switch_alive)
+        self.ctrl.sendto(
+            serialize_register_response(nbrs),
+            (addr[0], sport_restart)
         )
+        self.log(register_request_received, sid_restart)
+        self.log(register_response_sent, sid_restart)
+
+        # Mark switch alive
+        was_dead = not self.switch_alive.get(sid_restart, True)
+        self.switch_alive[sid_restart] = True
+        # A new incarnation: its heartbeat intervals start afresh
+        self.detector.forget(sid_restart)
+        self.refresh(sid_restart, self.clock())
+        self.switch_neighbors[sid_restart] = {
+            nid: True for nid, _ in self.topo_template.get(sid_restart, [])}
+
+        if was_dead:
+            self.log(topology_update_switch_alive, sid_restart)
+
+        self.topology_changed()
+        self.request_recompute()
+
+        # Send this switch its specific routes, unless the recompute already did.
+        # A switch joining for the first time waits for the recompute: the
+        # current tables were computed without it
+        if sid_restart not in self.tracker.sent and not first_join:
+            self.send_table(sid_restart)
+
+def serve_threaded(controller: Controller) -> None:
+    """Blocking recv loop plus a timer thread for liveness checks and
+    batched recomputes, serialised by one lock."""
+    cond = threading.Condition()
+
+    def timers() -> None:
+        next_check = time.time() + controller.liveness.tick
+        with cond:
+            while True:
+                due = controller.debouncer.deadline()
+                wake = next_check if due is None else min(next_check, due)
+                cond.wait(max(0.0, wake - time.time()))
+                now = time.time()
+                if now >= next_check:
+                    controller.check_liveness(now)
+                    next_check = max(next_check + controller.liveness.tick, now)
+                controller.run_due_recompute(now)
+
+    # Start timer thread
+    timer = threading.Thread(target=timers, daemon=True)
+    timer.start()
+
+    # Main thread: recv loop
+    while True:
+        data, addr = controller.ctrl.recvfrom(BUFFER_SIZE)
+        with cond:
+            controller.handle_message(data, addr)
+            # A new event may have opened a batch the timer is not waiting for
+            cond.notify()
 
 def main() -> None:
+    global LOG_WRITER
+
     # Check for number of arguments and exit if host/port not provided
     num_args: int = len(sys.argv)
     if num_args < 3:
-        print("Usage: python controller.py <port> <config file>\n")
+        print("Usage: python controller.py <port> <config file> "
+              "[--routing full|incremental|csr] [--workers N] [--verify-routing] [--async] "
+              "[--ecmp N] [--route-cache N] [--route-cache-mb MB] "
+              "[--incremental-join] [--quorum N] [--join-deadline S] "
+              "[--checkpoint FILE] [--checkpoint-interval S] "
+              "[--hold-down S] [--max-delay S] [--liveness-tick S] [--phi-threshold X] "
+              "[--sync-log] [--log-flush-interval S] [--log-flush-size N]\n"
+              "  --routing csr needs numpy, and scipy for speed; all pairs of 5000 switches\n"
+              "  take several seconds on one core, most of it in scipy's Dijkstra\n"
+              "  --ecmp N ships up to N equal-cost next hops per destination (default 1, off)\n")
         sys.exit(1)
 
     port = int(sys.argv[1])
     cfg = str(sys.argv[2])
+    try:
+        topo = load_config(cfg)
+    except TopologyConfigError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    engine = get_option(sys.argv, '--routing', ROUTING_INCREMENTAL)
+    if engine not in ROUTING_ENGINES:
+        print(f"Unknown routing engine '{engine}', expected one of {', '.join(ROUTING_ENGINES)}")
+        sys.exit(1)
+    if engine == ROUTING_CSR and np is None:
+        print("The csr routing engine requires numpy (and optionally scipy)")
+        sys.exit(1)
 
-    cache = RoutingCache()
-
-    # Setup socket connection to switches
-    ctrl, sw, topo = bootstrap(port, cfg)
-
-    # Compute routing tables
-    n = len(sw)
-    cache.update(topo, n)
-
-    # Log routing update
-    routing_table_update(cache.flat_routes())
-
-    # Send routing updates to all switches
-    send_routing_updates(ctrl, sw, cache.routes_by_switch)
-
-    # Initialize state for topology change tracking
-    topo_template = topo
-    lock = threading.Lock()
-    switch_alive: Dict[int, bool] = {sid: True for sid in sw}
-    last_heard: Dict[int, float] = {sid: time.time() for sid in sw}
-    switch_neighbors: Dict[int, Dict[int, bool]] = {}
-    for sid in sw:
-        switch_neighbors[sid] = {nid: True for nid, _ in topo_template[sid]}
-
-    def recompute_and_send() -> None:
-        current_topo = build_topology(topo_template, switch_alive, switch_neighbors)
-        if cache.update(current_topo, n):
-            routing_table_update(cache.flat_routes(switch_alive))
-            send_routing_updates(ctrl, sw, cache.routes_by_switch, switch_alive)
-
-    def periodic_check() -> None:
-        while True:
-            time.sleep(UPDATE_DELAY)
-            with lock:
-                now = time.time()
-                changed = False
-                for sid in list(last_heard.keys()):
-                    if switch_alive.get(sid, False) and (now - last_heard[sid]) >= TIMEOUT:
-                        switch_alive[sid] = False
-                        topology_update_switch_dead(sid)
-                        changed = True
-                if changed:
-                    recompute_and_send()
-
-    # Start periodic check thread
-    checker = threading.Thread(target=periodic_check, daemon=True)
-    checker.start()
-
-    # Main thread: recv loop
-    while True:
-        data, addr = ctrl.recvfrom(BUFFER_SIZE)
-        msg_type = struct.unpack('!B', data[:1])[0]
-
-        if msg_type == BIN_TOPOLOGY_UPDATE:
-            sender_id, nbr_status = deserialize_topology_update(data)
-
-            with lock:
-                last_heard[sender_id] = time.time()
-
-                # Update switch address (handles port changes on restart)
-                sw[sender_id][KEY_HOST] = addr[0]
-                sw[sender_id][KEY_PORT] = addr[1]
-
-                # Check if switch was previously dead
-                if not switch_alive.get(sender_id, True):
-                    switch_alive[sender_id] = True
-                    topology_update_switch_alive(sender_id)
-
-                # Detect link deaths
-                old_nbrs = switch_neighbors.get(sender_id, {})
-                for nid, alive in nbr_status:
-                    was_alive = old_nbrs.get(nid, True)
-                    if was_alive and not alive:
-                        topology_update_link_dead(sender_id, nid)
-
-                # Update neighbor status
-                switch_neighbors[sender_id] = {nid: alive for nid, alive in nbr_status}
-
-                recompute_and_send()
-
-        elif msg_type == BIN_REGISTER_REQUEST:
-            # Handle re-registration of a restarted switch
-            sid_restart, sport_restart = deserialize_register_request(data)
-
-            with lock:
-                sw[sid_restart] = {KEY_HOST: addr[0], KEY_PORT: sport_restart}
-
-                # Send register response with current neighbor info
-                nbrs = build_neighbor_list(topo_template, sid_restart, sw, switch_alive)
-                ctrl.sendto(
-                    serialize_register_response(nbrs),
-                    (addr[0], sport_restart)
-                )
-                register_request_received(sid_restart)
-                register_response_sent(sid_restart)
-
-                # Mark switch alive
-                was_dead = not switch_alive.get(sid_restart, True)
-                switch_alive[sid_restart] = True
-                last_heard[sid_restart] = time.time()
-                switch_neighbors[sid_restart] = {nid: True for nid, _ in topo_template.get(sid_restart, [])}
-
-                if was_dead:
-                    topology_update_switch_alive(sid_restart)
-
-                recompute_and_send()
-
-                # Send this switch its specific routes
-                ctrl.sendto(
-                    serialize_routing_update(cache.routes_by_switch.get(sid_restart, [])),
-                    (addr[0], sport_restart)
-                )
+    cache = RoutingCache(engine, verify=has_flag(sys.argv, '--verify-routing'),
+                         workers=int(get_option(sys.argv, '--workers', '1')),
+                         ecmp_paths=int(get_option(sys.argv, '--ecmp', str(ECMP_MAX_PATHS))),
+                         memo=RoutingTableLRU(
+                             int(get_option(sys.argv, '--route-cache', str(ROUTE_CACHE_ENTRIES))),
+                             int(get_option(sys.argv, '--route-cache-mb', str(ROUTE_CACHE_MB))) << 20))
+    atexit.register(lambda: print(cache.memo.summary()))
+    debouncer = RecomputeDebouncer(
+        float(get_option(sys.argv, '--hold-down', str(RECOMPUTE_HOLD_DOWN))),
+        float(get_option(sys.argv, '--max-delay', str(RECOMPUTE_MAX_DELAY))))
+    atexit.register(lambda: print(debouncer.summary()))
+    liveness_tick = float(get_option(sys.argv, '--liveness-tick', str(LIVENESS_TICK)))
+    detector = detector_from_args(sys.argv)
+    LOG_WRITER = log_writer_from_args(sys.argv)
+
+    # Without --incremental-join every switch must register before any gets
+    # a response; with it, switches are served as they register
+    quorum = get_option(sys.argv, '--quorum', '0' if has_flag(sys.argv, '--incremental-join')
+                        else None)
+    deadline = get_option(sys.argv, '--join-deadline')
+    # Per-switch join times only when switches are served as they register
+    joins = JoinTracker(report=has_flag(sys.argv, '--incremental-join'))
+    atexit.register(lambda: print(joins.summary()))
+
+    # A checkpoint left by a previous controller for this fabric replaces
+    # bootstrap: its switches are running and will not register again
+    checkpointer = checkpoint_writer_from_args(sys.argv)
+    resume: Optional[Checkpoint] = None
+    if checkpointer is not None:
+        loaded_at = time.perf_counter()
+        resume = load_checkpoint(checkpointer.path, len(topo))
+    if resume is not None:
+        ctrl = open_controller_socket(port)
+        sw = resume.sw
+        print(f"Resumed from checkpoint {checkpointer.path} ({len(sw)} switches, "
+              f"saved {datetime.fromtimestamp(resume.saved_at):%H:%M:%S}) in "
+              f"{(time.perf_counter() - loaded_at) * 1000:.1f}ms")
+    else:
+        # Setup socket connection to switches
+        ctrl, sw, topo = bootstrap(port, topo, None if quorum is None else int(quorum),
+                                   None if deadline is None else float(deadline), joins)
+
+    if has_flag(sys.argv, '--async'):
+        from controller_async import serve_async
+        serve_async(ctrl, sw, topo, cache, debouncer, liveness_tick, detector, joins,
+                    checkpointer, resume)
+        return
+
+    controller = Controller(ctrl, sw, topo, cache, debouncer=debouncer,
+                            liveness_tick=liveness_tick, detector=detector, joins=joins,
+                            checkpoint=checkpointer)
+    controller.start(resume)
+    serve_threaded(controller)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""asyncio event loop for the Controller
+Message dispatch, liveness timers and recompute scheduling run on a single
+event loop; route computation runs in an executor so the loop keeps
+receiving while tables are computed. Recomputes are batched by the
+controller's RecomputeDebouncer, armed as a loop timer.
+
+Author: Matt Bowring
+Email: mbowring@purdue.edu
+"""
+
+import asyncio
+import socket
+import sys
+import traceback
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, Optional, Set, Tuple
+
+from checkpoint import Checkpoint, CheckpointWriter
+from common import Topology, SwitchInfo, LIVENESS_TICK
+from controller import (
+    Controller, JoinTracker, RoutingCache, RoutingUpdateTracker, RecomputeDebouncer,
+)
+from liveness import FailureDetector
+
+
+class AsyncController(Controller):
+    """Controller whose recomputes are scheduled on the event loop and run
+    in an executor. At most one recompute is in flight; a batch that falls
+    due meanwhile is started as soon as the running one finishes.
+    """
+
+    def __init__(self, ctrl, sw: Dict[int, SwitchInfo], topo_template: Topology,
+                 cache: RoutingCache, loop: asyncio.AbstractEventLoop,
+                 executor: Optional[Executor] = None,
+                 tracker: Optional[RoutingUpdateTracker] = None,
+                 debouncer: Optional[RecomputeDebouncer] = None,
+                 liveness_tick: float = LIVENESS_TICK,
+                 detector: Optional[FailureDetector] = None,
+                 joins: Optional[JoinTracker] = None,
+                 checkpoint: Optional[CheckpointWriter] = None) -> None:
+        super().__init__(ctrl, sw, topo_template, cache, tracker, debouncer, liveness_tick,
+                         detector, joins, checkpoint)
+        self.loop = loop
+        # One worker: RoutingCache is only ever updated by one computation at a time
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=1)
+        self._computing = False
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._pending_tables: Set[int] = set()
+
+    def request_recompute(self) -> None:
+        now = self.clock()
+        self.debouncer.record(now)
+        self.run_due_recompute(now)
+
+    def run_due_recompute(self, now: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._computing:
+            # _recompute_done picks up the batch
+            return
+        if self.debouncer.take(now):
+            self._start_recompute()
+            return
+        due = self.debouncer.deadline()
+        if due is not None:
+            self._timer = self.loop.call_later(max(0.0, due - now), self._fire)
+
+    def _fire(self) -> None:
+        self._timer = None
+        self.run_due_recompute(self.clock())
+
+    def send_table(self, sid: int) -> None:
+        # Tables are being rewritten by the executor; send once it is done
+        if self._computing:
+            self._pending_tables.add(sid)
+        else:
+            super().send_table(sid)
+
+    def _start_recompute(self) -> None:
+        self._computing = True
+        # Snapshot the topology on the loop; the executor only sees the snapshot
+        topo = self.current_topology()
+        fut = self.loop.run_in_executor(self.executor, self.cache.update,
+                                        topo, self.n, self.topology_version)
+        fut.add_done_callback(self._recompute_done)
+
+    def _recompute_done(self, fut: "asyncio.Future[bool]") -> None:
+        self._computing = False
+        try:
+            changed = fut.result()
+        except Exception as e:
+            print(f"Routing recompute failed: {e}", file=sys.stderr)
+            traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
+            changed = False
+        if changed:
+            self.publish_routes()
+        pending, self._pending_tables = self._pending_tables, set()
+        for sid in pending:
+            if sid not in self.tracker.sent:
+                super().send_table(sid)
+        self.run_due_recompute(self.clock())
+
+    def schedule_liveness(self) -> None:
+        interval = self.liveness.tick
+
+        def tick() -> None:
+            self.check_liveness(self.clock())
+            self.loop.call_later(interval, tick)
+        self.loop.call_later(interval, tick)
+
+
+class ControllerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, controller: AsyncController) -> None:
+        self.controller = controller
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.controller.ctrl = transport
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        self.controller.handle_message(data, addr)
+
+
+async def start_async_controller(ctrl: socket.socket, sw: Dict[int, SwitchInfo],
+                                 topo: Topology, cache: RoutingCache,
+                                 debouncer: Optional[RecomputeDebouncer] = None,
+                                 liveness_tick: float = LIVENESS_TICK,
+                                 detector: Optional[FailureDetector] = None,
+                                 joins: Optional[JoinTracker] = None,
+                                 checkpoint: Optional[CheckpointWriter] = None,
+                                 resume: Optional[Checkpoint] = None) -> AsyncController:
+    """Attach an AsyncController to an already bound socket and send the
+    initial routes, or pick up from resume."""
+    loop = asyncio.get_running_loop()
+    controller = AsyncController(ctrl, sw, topo, cache, loop, debouncer=debouncer,
+                                 liveness_tick=liveness_tick, detector=detector, joins=joins,
+                                 checkpoint=checkpoint)
+    ctrl.setblocking(False)
+    await loop.create_datagram_endpoint(lambda: ControllerProtocol(controller), sock=ctrl)
+    controller.start(resume)
+    controller.schedule_liveness()
+    return controller
+
+
+def serve_async(ctrl: socket.socket, sw: Dict[int, SwitchInfo], topo: Topology,
+                cache: RoutingCache, debouncer: Optional[RecomputeDebouncer] = None,
+                liveness_tick: float = LIVENESS_TICK,
+                detector: Optional[FailureDetector] = None,
+                joins: Optional[JoinTracker] = None,
+                checkpoint: Optional[CheckpointWriter] = None,
+                resume: Optional[Checkpoint] = None) -> None:
+    async def run() -> None:
+        await start_async_controller(ctrl, sw, topo, cache, debouncer, liveness_tick, detector,
+                                     joins, checkpoint, resume)
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
@@ -0,0 +1,158 @@
+"""Buffered background writer for Controller and Switch logs
+Author: Matt Bowring
+Email: mbowring@purdue.edu
+"""
+
+import atexit
+import queue
+import signal
+import sys
+import threading
+import time
+from typing import Dict, IO, List, Optional, Tuple
+
+from common import get_option, has_flag
+
+LOG_FLUSH_INTERVAL: float = 0.5  # (seconds)
+LOG_FLUSH_SIZE: int = 512  # records per batch
+LOG_QUEUE_SIZE: int = 65536  # records
+
+
+class AsyncLogWriter:
+    """Collects log records on a bounded queue and appends them to their
+    files from a background thread with batched writelines.
+
+    Each record is written exactly as write_to_log used to write it: a blank
+    line separator followed by the record's lines. A batch is flushed when it
+    reaches flush_size records or flush_interval seconds after its first
+    record, whichever comes first. Records for several files may share one
+    writer. write never blocks and never loses a record: once the writer
+    has fallen max_queue records behind, new records go to an overflow
+    list, in order, which the writer thread drains right after the queue.
+    """
+
+    def __init__(self, flush_interval: float = LOG_FLUSH_INTERVAL,
+                 flush_size: int = LOG_FLUSH_SIZE, max_queue: int = LOG_QUEUE_SIZE) -> None:
+        self.flush_interval = flush_interval
+        self.flush_size = max(1, flush_size)
+        self._queue: "queue.Queue[Optional[Tuple[str, List[str]]]]" = queue.Queue(max_queue)
+        # Records that found the queue full; while any are waiting, later
+        # records join them so that the file order is kept
+        self._overflow: List[Tuple[str, List[str]]] = []
+        self._overflow_lock = threading.Lock()
+        self._files: Dict[str, IO[str]] = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, path: str, log: List[str]) -> None:
+        if self._closed:
+            return
+        with self._overflow_lock:
+            if not self._overflow:
+                try:
+                    self._queue.put_nowait((path, log))
+                    return
+                except queue.Full:
+                    pass
+            self._overflow.append((path, log))
+
+    def flush(self) -> None:
+        """Block until every record written so far is on disk."""
+        # Overflow records are only waiting while the queue is not empty,
+        # and are written with the batch that empties it
+        self._queue.join()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while item is not None and len(batch) < self.flush_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+            overflow = self._drain_overflow(batch)
+            self._write_batch([rec for rec in batch if rec is not None] + overflow)
+            for _ in batch:
+                self._queue.task_done()
+            if None in batch:
+                return
+
+    def _drain_overflow(self, batch: List[Optional[Tuple[str, List[str]]]]
+                        ) -> List[Tuple[str, List[str]]]:
+        # Overflow records are newer than everything still queued, so take
+        # the rest of the queue into the batch first
+        with self._overflow_lock:
+            if not self._overflow:
+                return []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            overflow, self._overflow = self._overflow, []
+        return overflow
+
+    def _write_batch(self, batch: List[Tuple[str, List[str]]]) -> None:
+        by_path: Dict[str, List[str]] = {}
+        for path, log in batch:
+            lines = by_path.setdefault(path, [])
+            lines.append("\n\n")
+            lines.extend(log)
+        for path, lines in by_path.items():
+            try:
+                f = self._files.get(path)
+                if f is None:
+                    f = self._files[path] = open(path, 'a+')
+                f.writelines(lines)
+                f.flush()
+            except OSError as e:
+                print(f"Log writer: cannot write {path}: {e}", file=sys.stderr)
+
+
+def _exit_on_sigterm(signum: int, frame) -> None:
+    # Exit through atexit so queued records get flushed; ignore repeats meanwhile
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    sys.exit(0)
+
+
+def start_log_writer(flush_interval: float = LOG_FLUSH_INTERVAL,
+                     flush_size: int = LOG_FLUSH_SIZE) -> AsyncLogWriter:
+    """Start a writer that is flushed when the process exits, including on SIGTERM."""
+    writer = AsyncLogWriter(flush_interval, flush_size)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+        def close_at_exit() -> None:
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            writer.close()
+        atexit.register(close_at_exit)
+    else:
+        atexit.register(writer.close)
+    return writer
+
+
+def log_writer_from_args(argv: List[str]) -> Optional[AsyncLogWriter]:
+    """Writer configured by --log-flush-interval/--log-flush-size, or None
+    for synchronous logging when --sync-log is given."""
+    if has_flag(argv, '--sync-log'):
+        return None
+    return start_log_writer(
+        float(get_option(argv, '--log-flush-interval', str(LOG_FLUSH_INTERVAL))),
+        int(get_option(argv, '--log-flush-size', str(LOG_FLUSH_SIZE))))
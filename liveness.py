@@ -0,0 +1,186 @@
+"""Liveness timers for the Controller and Switches
+Author: Matt Bowring
+Email: mbowring@purdue.edu
+"""
+
+import math
+from collections import deque
+from statistics import NormalDist
+from typing import Deque, Dict, Hashable, List, Optional, Tuple, Union
+
+from common import TIMEOUT, UPDATE_DELAY, LIVENESS_TICK, get_option
+
+PHI_THRESHOLD: float = 8.0
+PHI_WINDOW: int = 100  # inter-arrival samples kept per peer
+PHI_MIN_SAMPLES: int = 3
+PHI_MIN_STD_RATIO: float = 0.1  # std floor as a fraction of the mean interval
+
+
+class TimerWheel:
+    """Hashed timer wheel of keyed deadlines.
+
+    Time is cut into tick-sized slots laid round a ring covering span
+    seconds. A key lives in the slot of its deadline, so rescheduling or
+    cancelling it is O(1) and expire only visits the slots that time has
+    passed, costing O(expired) plus O(slots advanced) rather than a scan of
+    every key. Deadlines further out than span simply stay in their slot
+    for another lap.
+    """
+
+    def __init__(self, now: float, tick: float = LIVENESS_TICK,
+                 span: float = TIMEOUT + UPDATE_DELAY) -> None:
+        self.tick = tick
+        self._slots: List[Dict[Hashable, float]] = [
+            {} for _ in range(max(1, math.ceil(span / tick)) + 1)]
+        self._slot_of: Dict[Hashable, int] = {}
+        self._next = int(now / tick)
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._slot_of
+
+    def schedule(self, key: Hashable, deadline: float) -> None:
+        """Arm key to expire at deadline, replacing any earlier deadline."""
+        self.cancel(key)
+        # A deadline already passed goes in the next slot to be visited
+        index = max(int(deadline / self.tick), self._next) % len(self._slots)
+        self._slots[index][key] = deadline
+        self._slot_of[key] = index
+
+    def cancel(self, key: Hashable) -> None:
+        index = self._slot_of.pop(key, None)
+        if index is not None:
+            del self._slots[index][key]
+
+    def expire(self, now: float) -> List[Hashable]:
+        """Remove and return every key whose deadline is at or before now."""
+        expired: List[Hashable] = []
+        current = int(now / self.tick)
+        while self._next <= current:
+            slot = self._slots[self._next % len(self._slots)]
+            if slot:
+                due = [key for key, deadline in slot.items() if deadline <= now]
+                for key in due:
+                    del slot[key]
+                    del self._slot_of[key]
+                expired.extend(due)
+            if self._next == current:
+                # Only part of this slot has passed; visit it again next time
+                break
+            self._next += 1
+        return expired
+
+
+class FixedTimeout:
+    """Failure detector declaring a peer dead timeout seconds after it was last heard."""
+
+    def __init__(self, timeout: float = TIMEOUT) -> None:
+        self.timeout = timeout
+
+    def heard(self, key: Hashable, now: float) -> float:
+        """Record a heartbeat from key and return when to suspect it."""
+        return now + self.timeout
+
+    def deadline(self, key: Hashable, now: float) -> float:
+        """When to suspect key if it stays silent from now on, without
+        recording a heartbeat."""
+        return now + self.timeout
+
+    def forget(self, key: Hashable) -> None:
+        pass
+
+
+class PhiAccrualDetector:
+    """Phi-accrual failure detector (Hayashibara et al.).
+
+    Keeps a sliding window of heartbeat inter-arrival times per peer and
+    models them as a normal distribution. phi is -log10 of the probability
+    that a heartbeat would still arrive after the silence seen so far; a
+    peer is suspected once phi reaches threshold. Since phi only grows with
+    silence, heard returns the instant it will cross the threshold, which
+    is put on a TimerWheel like any fixed deadline.
+
+    Until a peer has min_samples intervals it gets bootstrap_timeout. The
+    standard deviation is floored at min_std_ratio of the mean, so a
+    perfectly regular link still tolerates some jitter.
+    """
+
+    def __init__(self, threshold: float = PHI_THRESHOLD, window: int = PHI_WINDOW,
+                 min_samples: int = PHI_MIN_SAMPLES, min_std_ratio: float = PHI_MIN_STD_RATIO,
+                 bootstrap_timeout: float = TIMEOUT) -> None:
+        # 1 - 10^-phi rounds to 1.0 beyond about phi 15
+        self.threshold = min(max(threshold, 0.1), 15.0)
+        self.window = window
+        self.min_samples = max(1, min_samples)
+        self.min_std_ratio = min_std_ratio
+        self.bootstrap_timeout = bootstrap_timeout
+        self._z = NormalDist().inv_cdf(1.0 - 10 ** -self.threshold)
+        self._intervals: Dict[Hashable, Deque[float]] = {}
+        self._sums: Dict[Hashable, Tuple[float, float]] = {}
+        self._last: Dict[Hashable, float] = {}
+
+    def heard(self, key: Hashable, now: float) -> float:
+        """Record a heartbeat from key and return when phi will reach the threshold."""
+        last = self._last.get(key)
+        self._last[key] = now
+        if last is not None and now > last:
+            self._add_interval(key, now - last)
+        return self.deadline(key, now)
+
+    def deadline(self, key: Hashable, now: float) -> float:
+        """When phi would reach the threshold for a silence starting at now,
+        for other signs of life that are not heartbeats: the interval
+        statistics are left alone."""
+        stats = self._stats(key)
+        if stats is None:
+            return now + self.bootstrap_timeout
+        mean, std = stats
+        return now + mean + self._z * std
+
+    def forget(self, key: Hashable) -> None:
+        # A peer declared dead starts a new silence; the gap is not a sample
+        self._last.pop(key, None)
+
+    def phi(self, key: Hashable, now: float) -> float:
+        stats = self._stats(key)
+        last = self._last.get(key)
+        if stats is None or last is None:
+            return 0.0
+        mean, std = stats
+        later = 1.0 - NormalDist(mean, std).cdf(now - last)
+        return -math.log10(max(later, 1e-300))
+
+    def _add_interval(self, key: Hashable, interval: float) -> None:
+        intervals = self._intervals.get(key)
+        if intervals is None:
+            intervals = self._intervals[key] = deque()
+        total, squares = self._sums.get(key, (0.0, 0.0))
+        if len(intervals) == self.window:
+            old = intervals.popleft()
+            total -= old
+            squares -= old * old
+        intervals.append(interval)
+        self._sums[key] = (total + interval, squares + interval * interval)
+
+    def _stats(self, key: Hashable) -> Optional[Tuple[float, float]]:
+        intervals = self._intervals.get(key)
+        if intervals is None or len(intervals) < self.min_samples:
+            return None
+        total, squares = self._sums[key]
+        count = len(intervals)
+        mean = total / count
+        variance = max(0.0, squares / count - mean * mean)
+        return mean, max(math.sqrt(variance), self.min_std_ratio * mean)
+
+
+FailureDetector = Union[FixedTimeout, PhiAccrualDetector]
+
+
+def detector_from_args(argv: List[str]) -> FailureDetector:
+    """PhiAccrualDetector when --phi-threshold is given, else FixedTimeout."""
+    threshold = get_option(argv, '--phi-threshold', '')
+    if not threshold:
+        return FixedTimeout()
+    return PhiAccrualDetector(float(threshold))
@@ -22,6 +22,7 @@ from common import (
     BIN_REGISTER_REQUEST, BIN_REGISTER_RESPONSE,
     BIN_ROUTING_UPDATE, BIN_KEEP_ALIVE, BIN_TOPOLOGY_UPDATE,
 )
+from topology import TopologyConfigError, load_topology
 
 PERF_LOG_FILE = "Performance.log"
 
@@ -32,12 +33,12 @@ MSG_SIZE_FIXED = {
 }
 MSG_SIZE_HEADER = {
     BIN_REGISTER_RESPONSE: struct.calcsize('!BH'),
-    BIN_ROUTING_UPDATE: struct.calcsize('!BH'),
-    BIN_TOPOLOGY_UPDATE: struct.calcsize('!BiH'),
+    BIN_ROUTING_UPDATE: struct.calcsize('!BIH'),
+    BIN_TOPOLOGY_UPDATE: struct.calcsize('!BiIH'),
 }
 MSG_SIZE_PER_ITEM = {
     BIN_REGISTER_RESPONSE: struct.calcsize('!iBi') + len(LOCALHOST.encode() + b'\x00'),
-    BIN_ROUTING_UPDATE: struct.calcsize('!iiii'),
+    BIN_ROUTING_UPDATE: struct.calcsize('!iiiii'),
     BIN_TOPOLOGY_UPDATE: struct.calcsize('!iB'),
 }
 
@@ -288,17 +289,13 @@ def main() -> None:
         print(f"Error: Config file '{config_file}' not found")
         sys.exit(1)
 
-    with open(config_file, 'r') as f:
-        lines = f.readlines()
-    num_switches = int(lines[0].strip())
-    neighbor_counts: Dict[int, int] = {i: 0 for i in range(num_switches)}
-    for line in lines[1:]:
-        line = line.strip()
-        if line:
-            parts = line.split()
-            s1, s2 = int(parts[0]), int(parts[1])
-            neighbor_counts[s1] += 1
-            neighbor_counts[s2] += 1
+    try:
+        compact = load_topology(config_file)
+    except TopologyConfigError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    num_switches = compact.n
+    neighbor_counts: Dict[int, int] = dict(enumerate(compact.degrees()))
 
     monitor = PerfMonitor(num_switches, neighbor_counts, interval)
     monitor.run()
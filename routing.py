@@ -0,0 +1,992 @@
+"""Routing engines for the Controller
+Author: Matt Bowring
+Email: mbowring@purdue.edu
+"""
+
+import heapq
+import multiprocessing
+import os
+import sys
+import warnings
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from common import (
+    Topology, RoutingEntry,
+    UNREACHABLE_DISTANCE, UNREACHABLE_HOP,
+)
+
+# Optional dependencies for the CSR backend
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra as csgraph_dijkstra
+except ImportError:
+    csr_matrix = None
+    csgraph_dijkstra = None
+
+Edge = Tuple[int, int, int]  # (from_id, to_id, cost)
+
+# Distance of unreachable nodes: the largest int32, so that trees fit array('i')
+INF: int = 0x7FFFFFFF
+NO_PARENT: int = -1
+
+PARALLEL_MIN_SWITCHES: int = 256  # below this the process pool costs more than it saves
+PARALLEL_SHARDS_PER_WORKER: int = 4
+ALTERNATES_BATCH_CELLS: int = 1 << 20  # (link, destination) pairs compared at once
+
+
+def edge_delta(old: Topology, new: Topology) -> Tuple[List[Edge], List[Edge]]:
+    """Directed edges removed from and added to old to obtain new.
+    A cost change shows up as one removal plus one addition.
+    """
+    removed: List[Edge] = []
+    added: List[Edge] = []
+    for u in set(old) | set(new):
+        old_edges = old.get(u, [])
+        new_edges = new.get(u, [])
+        if old_edges == new_edges:
+            continue
+        before = Counter(old_edges)
+        after = Counter(new_edges)
+        for (v, cost), k in (before - after).items():
+            removed.extend([(u, v, cost)] * k)
+        for (v, cost), k in (after - before).items():
+            added.extend([(u, v, cost)] * k)
+    return removed, added
+
+
+def reverse_topology(topo: Topology, n: int) -> List[List[Tuple[int, int]]]:
+    rev: List[List[Tuple[int, int]]] = [[] for _ in range(n)]
+    for u, edges in topo.items():
+        for v, cost in edges:
+            rev[v].append((u, cost))
+    return rev
+
+
+def dijkstra_tree(src: int, topo: Topology, n: int) -> Tuple[List[int], List[int]]:
+    """Shortest path tree from src as (dist, parent) lists.
+    Ties are broken exactly as RoutingCache._dijkstra breaks them: the parent
+    of a node is its tight predecessor with the smallest (dist, id).
+    """
+    dist = [INF] * n
+    parent = [NO_PARENT] * n
+    dist[src] = 0
+    done = [False] * n
+
+    pq = [(0, src)]
+    while pq:
+        d, u = heapq.heappop(pq)
+        if done[u]:
+            continue
+        done[u] = True
+        for v, cost in topo.get(u, []):
+            alt = d + cost
+            if alt < dist[v]:
+                dist[v] = alt
+                parent[v] = u
+                heapq.heappush(pq, (alt, v))
+    return dist, parent
+
+
+def first_hops(src: int, dist: Sequence[int], parent: Sequence[int]) -> List[int]:
+    """Next hop from src towards every node, derived from the parent tree."""
+    n = len(parent)
+    hop = [UNREACHABLE_HOP] * n
+    hop[src] = src
+    known = [False] * n
+    known[src] = True
+    for dst in range(n):
+        if known[dst] or dist[dst] == INF:
+            continue
+        # Walk up to the first node whose hop is already known
+        path = []
+        node = dst
+        while not known[node]:
+            path.append(node)
+            p = parent[node]
+            if p == NO_PARENT:
+                break
+            node = p
+        if known[node]:
+            h = node if node == src else hop[node]
+            for v in reversed(path):
+                if h == src:
+                    h = v
+                hop[v] = h
+                known[v] = True
+        else:
+            for v in path:
+                known[v] = True
+    return hop
+
+
+class RouteTable:
+    """One switch's routing table as next-hop, distance and backup-hop
+    vectors in the routing table encoding, 12 bytes per destination, plus
+    the equal-cost next-hop sets of the destinations that have more than
+    one. RoutingEntry rows are only built on demand, for logging and
+    serialization.
+    """
+
+    __slots__ = ('sid', 'hop', 'dist', 'backup', 'ecmp')
+
+    def __init__(self, sid: int, hop: array, dist: array, backup: Optional[array] = None,
+                 ecmp: Optional[Dict[int, Tuple[int, ...]]] = None) -> None:
+        self.sid = sid
+        self.hop = hop
+        self.dist = dist
+        self.backup = backup if backup is not None else array('i', [UNREACHABLE_HOP]) * len(hop)
+        # dest -> equal-cost next hops, primary first; only for dests with several
+        self.ecmp: Dict[int, Tuple[int, ...]] = ecmp if ecmp is not None else {}
+
+    @classmethod
+    def from_tree(cls, sid: int, dist: Sequence[int], hop: Sequence[int]) -> "RouteTable":
+        """From a shortest path result, where unreachable nodes have distance
+        INF or more (the full engine's reference Dijkstra uses float infinity)."""
+        return cls(sid,
+                   array('i', [UNREACHABLE_HOP if d >= INF else h for d, h in zip(dist, hop)]),
+                   array('i', [UNREACHABLE_DISTANCE if d >= INF else int(d) for d in dist]))
+
+    def patched(self, dist: Sequence[int], hop: Sequence[int], dids: Iterable[int]) -> "RouteTable":
+        """Copy of this table, without alternates, whose rows for dids are
+        taken from a shortest path result as in from_tree."""
+        new_hop, new_dist = self.hop[:], self.dist[:]
+        for did in dids:
+            d = dist[did]
+            if d >= INF:
+                new_hop[did], new_dist[did] = UNREACHABLE_HOP, UNREACHABLE_DISTANCE
+            else:
+                new_hop[did], new_dist[did] = hop[did], d
+        return RouteTable(self.sid, new_hop, new_dist)
+
+    def with_alternates(self, backup: array, ecmp: Dict[int, Tuple[int, ...]]) -> "RouteTable":
+        # Tables are shared with the update tracker, so never modify one in place
+        return RouteTable(self.sid, self.hop, self.dist, backup, ecmp)
+
+    def __len__(self) -> int:
+        return len(self.hop)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, RouteTable):
+            return NotImplemented
+        return (self.sid == other.sid and self.hop == other.hop and self.dist == other.dist
+                and self.backup == other.backup and self.ecmp == other.ecmp)
+
+    __hash__ = None
+
+    def rows(self) -> List[RoutingEntry]:
+        """One row per destination, with the primary next hop."""
+        sid = self.sid
+        return [[sid, did, h, d, b]
+                for did, (h, d, b) in enumerate(zip(self.hop, self.dist, self.backup))]
+
+    def wire_rows(self) -> List[RoutingEntry]:
+        """Rows as sent to the switch: each destination's row is followed by
+        one row per further equal-cost next hop."""
+        if not self.ecmp:
+            return self.rows()
+        return self._expand(range(len(self.hop)))
+
+    def changed_rows(self, old: "RouteTable") -> List[RoutingEntry]:
+        """Wire rows of the destinations that differ from old, a table of the same size."""
+        if self == old:
+            return []
+        if np is not None:
+            diff = np.zeros(len(self.hop), dtype=bool)
+            for mine, theirs in ((self.hop, old.hop), (self.dist, old.dist),
+                                 (self.backup, old.backup)):
+                diff |= np.frombuffer(mine, dtype=np.intc) != np.frombuffer(theirs, dtype=np.intc)
+            changed = np.flatnonzero(diff).tolist()
+        else:
+            changed = [did for did, (h, d, b, old_h, old_d, old_b) in enumerate(zip(
+                           self.hop, self.dist, self.backup, old.hop, old.dist, old.backup))
+                       if h != old_h or d != old_d or b != old_b]
+        if self.ecmp != old.ecmp:
+            changed = sorted(set(changed).union(
+                did for did in self.ecmp.keys() | old.ecmp.keys()
+                if self.ecmp.get(did) != old.ecmp.get(did)))
+        return self._expand(changed)
+
+    def _expand(self, dids: Iterable[int]) -> List[RoutingEntry]:
+        sid, hop, dist, backup, ecmp = self.sid, self.hop, self.dist, self.backup, self.ecmp
+        rows: List[RoutingEntry] = []
+        for did in dids:
+            d, b = dist[did], backup[did]
+            rows.append([sid, did, hop[did], d, b])
+            for h in ecmp.get(did, ())[1:]:
+                rows.append([sid, did, h, d, b])
+        return rows
+
+
+def alternate_hops(sid: int, topo: Topology, tables: Dict[int, RouteTable],
+                   max_paths: int = 1) -> Tuple[array, Dict[int, Tuple[int, ...]]]:
+    """Backup next hop of sid towards every destination, and the equal-cost
+    next-hop sets of up to max_paths hops.
+
+    A neighbor N other than the primary next hop is a loop-free alternate
+    (RFC 5286) for destination D when dist(N, D) < dist(N, sid) + dist(sid, D):
+    its own shortest path to D does not come back through sid, so sid can
+    hand it packets the moment the primary link fails. Of several alternates
+    the one with the cheapest path through it wins, then the lowest id.
+    Destinations without one get UNREACHABLE_HOP.
+
+    N is an equal-cost next hop when cost(sid, N) + dist(N, D) = dist(sid, D).
+    A set holds the primary first, then the others by id.
+    """
+    own = tables[sid]
+    backup = array('i', [UNREACHABLE_HOP]) * len(own)
+    best = [INF] * len(own)
+    equal: Dict[int, List[int]] = {}
+    for nid, cost in sorted(set(topo.get(sid, []))):
+        table = tables.get(nid)
+        if table is None or sid >= len(table.dist):
+            continue
+        to_sid = table.dist[sid]
+        if to_sid == UNREACHABLE_DISTANCE:
+            continue
+        for did, (h, d, nd) in enumerate(zip(own.hop, own.dist, table.dist)):
+            if h == nid or h == UNREACHABLE_HOP or did == sid or nd == UNREACHABLE_DISTANCE:
+                continue
+            if max_paths > 1 and cost + nd == d:
+                hops = equal.get(did)
+                if hops is None:
+                    equal[did] = [h, nid]
+                elif len(hops) < max_paths:
+                    hops.append(nid)
+            if nd >= to_sid + d or cost + nd >= best[did]:
+                continue
+            best[did] = cost + nd
+            backup[did] = nid
+    return backup, {did: tuple(hops) for did, hops in equal.items()}
+
+
+def switch_alternates(tables: Dict[int, RouteTable], topo: Topology, sids: Iterable[int],
+                      max_paths: int = 1) -> Iterator[Tuple[int, array, Dict[int, Tuple[int, ...]]]]:
+    """alternate_hops for each of sids that has a table, as (sid, backup, ecmp).
+    With numpy the neighbors' distance rows of many switches are compared
+    at once."""
+    sids = [sid for sid in sids if sid in tables]
+    if np is None:
+        for sid in sids:
+            yield (sid, *alternate_hops(sid, topo, tables, max_paths))
+        return
+    n = len(tables[sids[0]]) if sids else 0
+    batch: List[int] = []
+    links: List[Tuple[int, int, int]] = []
+    for sid in sids:
+        own = [(nid, cost) for nid, cost in sorted(set(topo.get(sid, [])))
+               if nid in tables and sid < len(tables[nid].dist)
+               and tables[nid].dist[sid] != UNREACHABLE_DISTANCE]
+        if len(tables[sid]) != n or any(len(tables[nid].dist) != n for nid, _ in own):
+            # Tables of different sizes only line up over the shorter one
+            yield (sid, *alternate_hops(sid, topo, tables, max_paths))
+            continue
+        if batch and (len(links) + len(own)) * n > ALTERNATES_BATCH_CELLS:
+            yield from _alternates_np(tables, batch, links, n, max_paths)
+            batch, links = [], []
+        links.extend((len(batch), nid, cost) for nid, cost in own)
+        batch.append(sid)
+    if batch:
+        yield from _alternates_np(tables, batch, links, n, max_paths)
+
+
+def _alternates_np(tables: Dict[int, RouteTable], sids: List[int], links: List[Tuple[int, int, int]],
+                   n: int, max_paths: int) -> Iterator[Tuple[int, array, Dict[int, Tuple[int, ...]]]]:
+    # One row per (switch, neighbor, cost) link, in alternate_hops order, so
+    # that the first of equally cheap alternates is the lowest row of its
+    # switch; slot is the link's switch as an index into sids
+    if not links:
+        for sid in sids:
+            yield sid, array('i', [UNREACHABLE_HOP]) * n, {}
+        return
+    rows = np.arange(len(links))
+    slot = np.array([i for i, _, _ in links], dtype=np.intp)
+    nids = np.array([nid for _, nid, _ in links], dtype=np.intc)
+    cost = np.array([c for _, _, c in links], dtype=np.int64)
+    own = np.array(sids, dtype=np.intp)[slot]
+    starts = np.flatnonzero(np.r_[True, slot[1:] != slot[:-1]])
+    sizes = np.diff(np.r_[starts, len(links)])
+    local = rows - np.repeat(starts, sizes)
+    widest = int(sizes.max())
+    nd = np.stack([np.frombuffer(tables[nid].dist, dtype=np.intc) for _, nid, _ in links])
+    dist = np.stack([np.frombuffer(tables[sid].dist, dtype=np.intc) for sid in sids])
+    hop = np.stack([np.frombuffer(tables[sid].hop, dtype=np.intc) for sid in sids])
+
+    # Work in int32 when no sum or ranking key below can overflow it
+    bound = (int(cost.max()) + int(nd.max()) + int(dist.max()) + 1) * widest
+    wide = cost.min() < 0 or bound >= INF
+    if wide:
+        nd, dist = nd.astype(np.int64), dist.astype(np.int64)
+    d = dist[slot]
+    h = hop[slot]
+    valid = h != UNREACHABLE_HOP
+    valid &= h != nids[:, None]
+    valid &= nd != UNREACHABLE_DISTANCE
+    valid[rows, own] = False
+    through = nd + cost.astype(nd.dtype)[:, None]
+    if wide:
+        valid &= through < INF
+
+    equal: Dict[int, Dict[int, Tuple[int, ...]]] = {}
+    if max_paths > 1:
+        # Equal-cost hops per (switch, destination) in row order, cut to max_paths
+        eq = valid & (through == d)
+        seen = np.zeros((len(starts), n), dtype=np.int32)
+        for j in range(widest):
+            more = np.flatnonzero(sizes > j)
+            at = starts[more] + j
+            hit = eq[at] & (seen[more] < max_paths - 1)
+            eq[at] = hit
+            seen[more] += hit
+        r, did = np.nonzero(eq)
+        group = slot[r] * n + did
+        order = np.argsort(group, kind='stable')
+        r, did, group = r[order], did[order], group[order]
+        first = np.flatnonzero(np.diff(group, prepend=-1))
+        count = np.diff(np.r_[first, len(r)])
+        owner, dest = slot[r[first]], did[first]
+        hops = [h[r[first], dest]] + [nids[r[np.minimum(first + j, len(r) - 1)]]
+                                      for j in range(max_paths - 1)]
+        # Tuples are built a column at a time, for the sets of each size
+        for size in np.unique(count).tolist():
+            sel = np.flatnonzero(count == size)
+            sets = list(zip(*(col[sel].tolist() for col in hops[:size + 1])))
+            dests = dest[sel].tolist()
+            bounds = np.flatnonzero(np.diff(owner[sel], prepend=-1)).tolist() + [len(sel)]
+            for b, e in zip(bounds, bounds[1:]):
+                equal.setdefault(sids[owner[sel[b]]], {}).update(zip(dests[b:e], sets[b:e]))
+
+    # Loop-free: dist(N, D) < dist(N, sid) + dist(sid, D); then the cheapest
+    # path through N wins, ranked by cost then row
+    d += nd[rows, own][:, None]
+    valid &= nd < d
+    through *= widest
+    through += local.astype(nd.dtype)[:, None]
+    never = np.iinfo(through.dtype).max
+    np.copyto(through, never, where=~valid)
+    best = through[starts]
+    for j in range(1, widest):
+        more = np.flatnonzero(sizes > j)
+        if len(more) == len(starts):
+            np.minimum(best, through[starts + j], out=best)
+        else:
+            best[more] = np.minimum(best[more], through[starts[more] + j])
+    found = best < never
+    pick = np.where(found, starts[:, None] + best % widest, 0)
+    backup = np.full((len(sids), n), UNREACHABLE_HOP, dtype=np.intc)
+    backup[slot[starts]] = np.where(found, nids[pick], UNREACHABLE_HOP)
+    for i, sid in enumerate(sids):
+        out = array('i')
+        out.frombytes(backup[i].tobytes())
+        yield sid, out, equal.get(sid, {})
+
+
+def backup_dependents(changed: List[int], moved: List[int], old: Optional[Topology],
+                      new: Topology) -> set:
+    """Switches whose alternates may differ once the tables of changed were
+    replaced: those switches, the neighbors of moved (the changed switches
+    whose distances changed) and the ends of changed links."""
+    affected = set(changed)
+    for sid in moved:
+        affected.update(nid for nid, _ in new.get(sid, []))
+    if old is not None:
+        removed, added = edge_delta(old, new)
+        for u, v, _ in removed + added:
+            affected.update((u, v))
+    return affected
+
+
+def merge_tables(base: Dict[int, RouteTable], fresh: Dict[int, RouteTable]
+                 ) -> Tuple[Dict[int, RouteTable], List[int], List[int]]:
+    """base with the tables of fresh that differ from it in next hops or
+    distances; unchanged switches keep their base table and its alternates.
+    Also returns the switches whose tables were replaced and those among
+    them whose distances changed."""
+    tables = dict(base)
+    changed, moved = [], []
+    for sid, table in fresh.items():
+        prev = base.get(sid)
+        if prev is None or prev.dist != table.dist:
+            moved.append(sid)
+        elif prev.hop == table.hop:
+            continue
+        tables[sid] = table
+        changed.append(sid)
+    return tables, changed, moved
+
+
+Trees = Tuple[List[array], List[array], List[array]]  # dist, parent, hop per source, array('i')
+
+# Topology of the current recompute in a pool worker, keyed by shared memory name
+_worker_topology: Tuple[Optional[str], Topology] = (None, {})
+
+
+def _init_worker() -> None:
+    global _worker_topology
+    _worker_topology = (None, {})
+
+
+def _attach_topology(name: str, n: int, num_edges: int) -> Topology:
+    # Rebuild the topology from the shared CSR arrays once per recompute
+    global _worker_topology
+    if _worker_topology[0] != name:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            ints = array('i', bytes(shm.buf[:4 * (n + 1 + 2 * num_edges)]))
+        finally:
+            shm.close()
+        indptr = ints[:n + 1]
+        indices = ints[n + 1:n + 1 + num_edges]
+        weights = ints[n + 1 + num_edges:]
+        topo: Topology = {u: list(zip(indices[indptr[u]:indptr[u + 1]],
+                                      weights[indptr[u]:indptr[u + 1]]))
+                          for u in range(n) if indptr[u] != indptr[u + 1]}
+        _worker_topology = (name, topo)
+    return _worker_topology[1]
+
+
+def _shard_trees(name: str, n: int, num_edges: int, lo: int, hi: int) -> Tuple[int, bytes, bytes, bytes]:
+    """Shortest path trees for sources lo..hi-1, flattened into arrays."""
+    topo = _attach_topology(name, n, num_edges)
+    dist_out = array('i')
+    parent_out = array('i')
+    hop_out = array('i')
+    for src in range(lo, hi):
+        dist, parent = dijkstra_tree(src, topo, n)
+        dist_out.extend(dist)
+        parent_out.extend(parent)
+        hop_out.extend(first_hops(src, dist, parent))
+    return lo, dist_out.tobytes(), parent_out.tobytes(), hop_out.tobytes()
+
+
+class ParallelRouter:
+    """Per-source Dijkstras sharded across a process pool.
+
+    Each recompute writes the topology once into a shared memory segment as
+    CSR int arrays; workers rebuild it once per recompute and compute whole
+    shards of sources, returning flat int32 arrays that are sliced into one
+    array per source. trees returns None when the graph is too small for the
+    pool to pay off, or the pool failed, so callers fall back to serial.
+    """
+
+    def __init__(self, workers: int, min_switches: int = PARALLEL_MIN_SWITCHES) -> None:
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.min_switches = min_switches
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def trees(self, topo: Topology, n: int) -> Optional[Trees]:
+        if self.workers <= 1 or n < self.min_switches:
+            return None
+        try:
+            return self._compute(topo, n)
+        except Exception as e:
+            print(f"Parallel routing failed, computing serially: {e}", file=sys.stderr)
+            self.close()
+            return None
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _compute(self, topo: Topology, n: int) -> Trees:
+        if self._pool is None:
+            # spawn: the controller has threads running, which fork does not mix well with
+            self._pool = ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker)
+        indptr = array('i', [0])
+        indices = array('i')
+        weights = array('i')
+        for u in range(n):
+            for v, cost in topo.get(u, []):
+                indices.append(v)
+                weights.append(cost)
+            indptr.append(len(indices))
+        data = indptr.tobytes() + indices.tobytes() + weights.tobytes()
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        try:
+            shm.buf[:len(data)] = data
+            shards = self.workers * PARALLEL_SHARDS_PER_WORKER
+            step = max(1, -(-n // shards))
+            futures = [self._pool.submit(_shard_trees, shm.name, n, len(indices),
+                                         lo, min(lo + step, n))
+                       for lo in range(0, n, step)]
+            dists: List[array] = [array('i') for _ in range(n)]
+            parents: List[array] = [array('i') for _ in range(n)]
+            hops: List[array] = [array('i') for _ in range(n)]
+            for fut in futures:
+                lo, dist_b, parent_b, hop_b = fut.result()
+                for out, data in ((dists, dist_b), (parents, parent_b), (hops, hop_b)):
+                    flat = array('i')
+                    flat.frombytes(data)
+                    for k in range(len(flat) // n):
+                        out[lo + k] = flat[k * n:(k + 1) * n]
+        finally:
+            shm.close()
+            shm.unlink()
+        return dists, parents, hops
+
+
+class IncrementalRouter:
+    """All-pairs shortest paths kept up to date per source from edge deltas.
+
+    Each source keeps its shortest path tree. On a topology change only the
+    subtrees hanging off removed tree edges are invalidated; they are re-seeded
+    from their intact in-neighbours and repaired together with any
+    improvements from added edges by a bounded Dijkstra. Sources whose tree
+    does not touch the delta are left alone, and within a repaired tree only
+    the next hops of nodes whose parent changed, and of their subtrees, are
+    redone. Trees are kept as one dist, parent and hop array('i') per source,
+    12 bytes per pair of switches, plus a child index (first child and next
+    sibling, 8 bytes more) for the sources that have been repaired.
+    """
+
+    def __init__(self, max_delta_ratio: float = 0.25,
+                 parallel: Optional[ParallelRouter] = None) -> None:
+        self.max_delta_ratio = max_delta_ratio
+        self.parallel = parallel
+        self.n: int = 0
+        self.dist: List[array] = []
+        self.parent: List[array] = []
+        self.hop: List[array] = []
+        # Per source: first child and next sibling of every node, or None
+        # until the source's tree is first repaired
+        self.child: List[Optional[array]] = []
+        self.sibling: List[Optional[array]] = []
+        # Nodes whose dist or hop may have changed in the last update, per
+        # changed source; None after a rebuild, when every node may have
+        self.dirty: Optional[Dict[int, set]] = None
+        self.full_rebuilds: int = 0
+        self.incremental_updates: int = 0
+
+    def rebuild(self, topo: Topology, n: int) -> List[int]:
+        self.n = n
+        self.full_rebuilds += 1
+        self.dirty = None
+        self.child, self.sibling = [None] * n, [None] * n
+        trees = self.parallel.trees(topo, n) if self.parallel is not None else None
+        if trees is not None:
+            self.dist, self.parent, self.hop = trees
+            return list(range(n))
+        self.dist, self.parent, self.hop = [], [], []
+        for src in range(n):
+            dist, parent = dijkstra_tree(src, topo, n)
+            self.dist.append(array('i', dist))
+            self.parent.append(array('i', parent))
+            self.hop.append(array('i', first_hops(src, dist, parent)))
+        return list(range(n))
+
+    def update(self, old: Optional[Topology], new: Topology, n: int) -> List[int]:
+        """Bring the trees in line with new and return the sources whose
+        routes changed. Falls back to a full rebuild when there is no
+        previous state or the delta is large relative to the graph.
+        """
+        if old is None or n != self.n:
+            return self.rebuild(new, n)
+        removed, added = edge_delta(old, new)
+        if not removed and not added:
+            self.dirty = {}
+            return []
+        num_edges = sum(len(edges) for edges in new.values())
+        if len(removed) + len(added) > self.max_delta_ratio * max(num_edges, 1):
+            return self.rebuild(new, n)
+
+        rev = reverse_topology(new, n)
+        # Costs still available on each removed (u, v) pair, for duplicate links
+        remaining: Dict[Tuple[int, int], List[int]] = {}
+        for u, v, _ in removed:
+            if (u, v) not in remaining:
+                remaining[(u, v)] = [c for w, c in new.get(u, []) if w == v]
+
+        self.dirty = {}
+        changed = []
+        for src in range(n):
+            if self._repair(src, new, rev, removed, added, remaining):
+                changed.append(src)
+        self.incremental_updates += 1
+        return changed
+
+    def _children(self, src: int) -> Tuple[array, array]:
+        # Child index of src's tree, built from the parents on first use
+        child = self.child[src]
+        if child is None:
+            n = self.n
+            if np is not None:
+                # Nodes grouped by parent: each points at the next in its group
+                parent = np.frombuffer(self.parent[src], dtype=np.intc)
+                order = np.argsort(parent, kind="stable").astype(np.intc)
+                grouped = parent[order]
+                nxt = np.full(n, NO_PARENT, dtype=np.intc)
+                same = grouped[1:] == grouped[:-1]
+                nxt[:-1][same] = order[1:][same]
+                first = np.r_[True, ~same] & (grouped != NO_PARENT)
+                heads = np.full(n, NO_PARENT, dtype=np.intc)
+                heads[grouped[first]] = order[first]
+                sib = np.empty(n, dtype=np.intc)
+                sib[order] = nxt
+                child = array('i', heads.tobytes())
+                sibling = array('i', sib.tobytes())
+            else:
+                child = array('i', [NO_PARENT]) * n
+                sibling = array('i', [NO_PARENT]) * n
+                for v, p in enumerate(self.parent[src]):
+                    if p != NO_PARENT:
+                        sibling[v] = child[p]
+                        child[p] = v
+            self.child[src], self.sibling[src] = child, sibling
+        return child, self.sibling[src]
+
+    def _repair(self, src: int, topo: Topology, rev: List[List[Tuple[int, int]]],
+                removed: List[Edge], added: List[Edge],
+                remaining: Dict[Tuple[int, int], List[int]]) -> bool:
+        n = self.n
+        dist = self.dist[src]
+        parent = self.parent[src]
+
+        # Subtrees below broken tree edges lose their distances
+        roots = [v for u, v, _ in removed
+                 if parent[v] == u and dist[v] - dist[u] not in remaining[(u, v)]]
+        affected = [False] * n if roots else None
+        stale: List[int] = []
+        if roots:
+            child, sibling = self._children(src)
+            stack = list(roots)
+            while stack:
+                v = stack.pop()
+                if affected[v]:
+                    continue
+                affected[v] = True
+                stale.append(v)
+                c = child[v]
+                while c != NO_PARENT:
+                    stack.append(c)
+                    c = sibling[c]
+            # Detach the subtrees; their nodes get parents again in _fix_parents
+            hop = self.hop[src]
+            for v in set(roots):
+                if parent[v] != NO_PARENT and not affected[parent[v]]:
+                    self._unlink(src, v)
+            for v in stale:
+                dist[v] = INF
+                parent[v] = NO_PARENT
+                hop[v] = UNREACHABLE_HOP
+                child[v] = sibling[v] = NO_PARENT
+
+        pq: List[Tuple[int, int]] = []
+        for v in stale:
+            best = INF
+            for u, cost in rev[v]:
+                if not affected[u] and dist[u] + cost < best:
+                    best = dist[u] + cost
+            if best < INF:
+                dist[v] = best
+                pq.append((best, v))
+        for u, v, cost in added:
+            if dist[u] + cost < dist[v]:
+                dist[v] = dist[u] + cost
+                pq.append((dist[v], v))
+
+        if not stale and not pq:
+            # Only non-tree edges changed; parents may still shift on ties
+            candidates = {v for _, v, _ in removed} | {v for _, v, _ in added}
+            return self._fix_parents(src, candidates, rev, set())
+
+        heapq.heapify(pq)
+        touched = set(stale)
+        while pq:
+            d, u = heapq.heappop(pq)
+            if d > dist[u]:
+                continue
+            touched.add(u)
+            for v, cost in topo.get(u, []):
+                alt = d + cost
+                if alt < dist[v]:
+                    dist[v] = alt
+                    heapq.heappush(pq, (alt, v))
+
+        candidates = set(touched)
+        for u in touched:
+            for v, _ in topo.get(u, []):
+                candidates.add(v)
+        candidates.update(v for _, v, _ in removed)
+        candidates.update(v for _, v, _ in added)
+        self._fix_parents(src, candidates, rev, touched)
+        return True
+
+    def _fix_parents(self, src: int, candidates: set,
+                     rev: List[List[Tuple[int, int]]], dirty: set) -> bool:
+        dist = self.dist[src]
+        parent = self.parent[src]
+        moved = []
+        for v in candidates:
+            if v == src:
+                continue
+            best = NO_PARENT
+            if dist[v] != INF:
+                key = None
+                for u, cost in rev[v]:
+                    if dist[u] + cost == dist[v] and (key is None or (dist[u], u) < key):
+                        key = (dist[u], u)
+                        best = u
+            if parent[v] != best:
+                moved.append((v, best))
+        if not moved and not dirty:
+            return False
+        child, sibling = self._children(src)
+        for v, p in moved:
+            if parent[v] != NO_PARENT:
+                self._unlink(src, v)
+            parent[v] = p
+            if p != NO_PARENT:
+                sibling[v] = child[p]
+                child[p] = v
+        # Next hops change only below nodes that got a new parent; ancestors
+        # are redone last when they tie on distance, so the order is safe
+        hop = self.hop[src]
+        moved.sort(key=lambda vp: dist[vp[0]])
+        for v, _ in moved:
+            stack = [v]
+            while stack:
+                x = stack.pop()
+                p = parent[x]
+                hop[x] = UNREACHABLE_HOP if p == NO_PARENT else x if p == src else hop[p]
+                dirty.add(x)
+                c = child[x]
+                while c != NO_PARENT:
+                    stack.append(c)
+                    c = sibling[c]
+        self.dirty[src] = dirty
+        return True
+
+    def _unlink(self, src: int, v: int) -> None:
+        # Take v out of its parent's child list
+        child, sibling = self.child[src], self.sibling[src]
+        p = self.parent[src][v]
+        c = child[p]
+        if c == v:
+            child[p] = sibling[v]
+        else:
+            while sibling[c] != v:
+                c = sibling[c]
+            sibling[c] = sibling[v]
+        sibling[v] = NO_PARENT
+
+
+class CSRGraph:
+    """Topology as compressed sparse row arrays.
+    Edges out of u are indices[indptr[u]:indptr[u+1]] with matching weights.
+    Parallel links between the same pair are collapsed to the cheapest one.
+    """
+
+    def __init__(self, topo: Topology, n: int) -> None:
+        src, dst, cost = [], [], []
+        for u, edges in topo.items():
+            for v, c in edges:
+                src.append(u)
+                dst.append(v)
+                cost.append(c)
+        src_a = np.asarray(src, dtype=np.int32)
+        dst_a = np.asarray(dst, dtype=np.int32)
+        cost_a = np.asarray(cost, dtype=np.int64)
+        if len(src_a):
+            # Sort by (u, v, cost) and keep the first of each (u, v) run
+            order = np.lexsort((cost_a, dst_a, src_a))
+            src_a, dst_a, cost_a = src_a[order], dst_a[order], cost_a[order]
+            keep = np.ones(len(src_a), dtype=bool)
+            keep[1:] = (src_a[1:] != src_a[:-1]) | (dst_a[1:] != dst_a[:-1])
+            src_a, dst_a, cost_a = src_a[keep], dst_a[keep], cost_a[keep]
+        self.n = n
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src_a, minlength=n), out=self.indptr[1:])
+        self.indices = dst_a
+        self.weights = cost_a
+        self.sources = src_a
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices)
+
+
+class CSRRouter:
+    """All-pairs routing computed in batches of sources with NumPy.
+
+    Distances and shortest path predecessors come from scipy.sparse.csgraph
+    when it is installed, on costs offset so that it breaks ties as the
+    Dijkstra engines do, otherwise from a vectorised Bellman-Ford over the
+    CSR edge list after which parents are settled with the same tie-breaking.
+    The resulting tables are identical, and next hops are read off the
+    parent trees by pointer jumping.
+    """
+
+    def __init__(self, batch_cells: int = 1 << 24) -> None:
+        if np is None:
+            raise RuntimeError("The CSR routing backend requires numpy")
+        self.batch_cells = batch_cells
+
+    def compute(self, topo: Topology, n: int) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Return (dist, hop) as n x n int matrices in the routing table encoding."""
+        g = CSRGraph(topo, n)
+        dist = np.full((n, n), UNREACHABLE_DISTANCE, dtype=np.intc)
+        hop = np.full((n, n), UNREACHABLE_HOP, dtype=np.intc)
+        if n == 0:
+            return dist, hop
+
+        # With scipy, adding v - u to every edge u -> v keeps the shortest
+        # paths but makes distances unique and ordered like (dist, id), so its
+        # Dijkstra settles nodes in the same order as the reference one and
+        # keeps the same predecessors, with no tie-breaking left to do. Zero-cost
+        # links come out negative, but every cycle keeps its original cost, so
+        # none is negative. Sums stay exact below 2 ** 53
+        scale = 0
+        if csgraph_dijkstra is not None and (
+                not g.num_edges or float(g.weights.max()) * (n + 1) * n < 2 ** 53):
+            scale = n + 1
+        if scale:
+            weights = (g.weights * scale + (g.indices - g.sources)).astype(np.float64)
+            m = csr_matrix((weights, g.indices, g.indptr), shape=(n, n))
+            edges = (np.zeros(0, dtype=np.int64),) * 5
+        elif g.num_edges and g.weights.min() == 0:
+            # Past zero-cost links the reference order also depends on when a
+            # node was first reached, which only a real Dijkstra replays
+            return self._reference(topo, n, dist, hop)
+        elif csgraph_dijkstra is not None:
+            # Built once and shared by every batch
+            m = csr_matrix((g.weights.astype(np.float64), g.indices, g.indptr), shape=(n, n))
+            # Dijkstra's predecessor is a tight one of least distance; another
+            # can only tie with it over an in-edge of the same cost
+            edges = self._grouped_edges(g, ties_only=True)
+        else:
+            m = None
+            edges = self._grouped_edges(g, ties_only=False)
+
+        step = max(1, min(n, self.batch_cells // max(n, len(edges[0]), 1)))
+        for lo in range(0, n, step):
+            srcs = np.arange(lo, min(lo + step, n))
+            if m is not None:
+                with warnings.catch_warnings():
+                    warnings.filterwarnings("ignore", message="Graph has negative weights")
+                    d, pred = csgraph_dijkstra(m, directed=True, indices=srcs,
+                                               return_predecessors=True)
+            else:
+                d, pred = self._bellman_ford(g, srcs, *edges), None
+            hop[lo:lo + len(srcs)] = self._first_hops(srcs, d, pred, *edges)
+            if scale:
+                d -= np.arange(n) - srcs[:, None]
+                d /= scale
+            reach = np.isfinite(d)
+            dist[lo:lo + len(srcs)][reach] = d[reach].astype(np.intc)
+        return dist, hop
+
+    @staticmethod
+    def _reference(topo: Topology, n: int, dist, hop):
+        for src in range(n):
+            tree_dist, parent = dijkstra_tree(src, topo, n)
+            row = np.array(tree_dist, dtype=np.int64)
+            reach = row < INF
+            dist[src][reach] = row[reach]
+            hop[src] = np.where(reach, first_hops(src, tree_dist, parent), UNREACHABLE_HOP)
+        return dist, hop
+
+    @staticmethod
+    def _grouped_edges(g: CSRGraph, ties_only: bool):
+        # Edges sorted by destination, with the start of each destination's run.
+        # ties_only keeps the edges sharing their destination and cost with another
+        order = np.lexsort((g.sources, g.weights, g.indices))
+        e_src = g.sources[order].astype(np.int64)
+        e_dst = g.indices[order]
+        e_cost = g.weights[order]
+        if ties_only and len(e_dst):
+            same = (e_dst[1:] == e_dst[:-1]) & (e_cost[1:] == e_cost[:-1])
+            keep = np.zeros(len(e_dst), dtype=bool)
+            keep[1:] |= same
+            keep[:-1] |= same
+            e_src, e_dst, e_cost = e_src[keep], e_dst[keep], e_cost[keep]
+        heads = np.flatnonzero(np.r_[True, e_dst[1:] != e_dst[:-1]]) if len(e_dst) else e_dst
+        head_nodes = e_dst[heads] if len(e_dst) else e_dst
+        return e_src, e_dst, e_cost, heads, head_nodes
+
+    def _bellman_ford(self, g: CSRGraph, srcs, e_src, e_dst, e_cost, heads, head_nodes):
+        n = g.n
+        d = np.full((len(srcs), n), np.inf)
+        d[np.arange(len(srcs)), srcs] = 0
+        if not len(e_src):
+            return d
+        for _ in range(n):
+            cand = d[:, e_src] + e_cost
+            best = np.minimum.reduceat(cand, heads, axis=1)
+            current = d[:, head_nodes]
+            if not (best < current).any():
+                break
+            d[:, head_nodes] = np.minimum(current, best)
+        return d
+
+    def _first_hops(self, srcs, d, pred, e_src, e_dst, e_cost, heads, head_nodes):
+        rows = len(srcs)
+        n = d.shape[1]
+        r = np.arange(rows)
+        reach = np.isfinite(d)
+
+        # Parent of v is its tight predecessor with the smallest (dist, id),
+        # compared as dist * n + id. scipy's predecessor already has the least
+        # distance, so it is only checked on destinations with tie edges
+        big = np.iinfo(np.int64).max
+        cols = head_nodes
+        if pred is not None:
+            parent = pred.astype(np.int32)
+        else:
+            parent = np.full((rows, n), -1, dtype=np.int32)
+        if len(e_src):
+            if pred is not None:
+                p = np.maximum(parent[:, cols], 0).astype(np.int64)
+                key = np.where(parent[:, cols] >= 0,
+                               np.where(reach[r[:, None], p], d[r[:, None], p], 0).astype(np.int64) * n + p,
+                               big)
+            else:
+                key = np.full((rows, len(cols)), big, dtype=np.int64)
+            du = d[:, e_src]
+            tight = np.isfinite(du) & (du + e_cost == d[:, e_dst])
+            cand = np.where(tight, du, 0).astype(np.int64)
+            cand *= n
+            cand += e_src
+            cand[~tight] = big
+            best = np.minimum.reduceat(cand, heads, axis=1)
+            better = best < key
+            if better.any():
+                sub = parent[:, cols]
+                sub[better] = best[better] % n
+                parent[:, cols] = sub
+        parent[r, srcs] = -1
+
+        # Children of the source point at themselves, then every node jumps to
+        # the root's child; rows are flattened so each jump is one gather
+        base = (r * n).astype(np.int32)[:, None]
+        jump = np.where((parent == srcs[:, None]) | (parent < 0),
+                        np.arange(n, dtype=np.int32), parent)
+        jump += base
+        jump = jump.ravel()
+        while True:
+            nxt = jump[jump]
+            if np.array_equal(nxt, jump):
+                break
+            jump = nxt
+        hop = np.where(reach, jump.reshape(rows, n) - base, UNREACHABLE_HOP).astype(np.int32)
+        hop[r, srcs] = srcs
+        return hop
+
+
+def csr_routing_tables(topo: Topology, n: int) -> Dict[int, RouteTable]:
+    dist, hop = CSRRouter().compute(topo, n)
+    by_switch: Dict[int, RouteTable] = {}
+    for sid in range(n):
+        hop_row, dist_row = array('i'), array('i')
+        hop_row.frombytes(hop[sid].tobytes())
+        dist_row.frombytes(dist[sid].tobytes())
+        by_switch[sid] = RouteTable(sid, hop_row, dist_row)
+    return by_switch
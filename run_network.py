@@ -1,21 +1,31 @@
 #!/usr/bin/env python
 
 """
-Automated Network Launcher (MacOS)
-Starts the Controller and all Switches in separate terminal windows
+Automated Network Launcher
+On macOS starts the Controller and all Switches in separate terminal windows.
+With --headless (the default on other platforms) starts them as supervised
+background processes instead.
 """
 
 import sys
 import os
+import signal
 import subprocess
 import time
+from datetime import date, datetime, time as time_of_day
+
+from common import parse_failures
+from topology import TopologyConfigError, switch_count
+
+# Restart backoff for crashed switches (seconds)
+RESTART_BACKOFF_MIN = 1.0
+RESTART_BACKOFF_MAX = 30.0
+# A switch that stays up this long gets its backoff reset
+RESTART_STABLE_AFTER = 60.0
 
 def parse_config(config_file):
     """Parse config file to determine number of switches"""
-    with open(config_file, 'r') as f:
-        lines = f.readlines()
-        num_switches = int(lines[0].strip())
-    return num_switches
+    return switch_count(config_file)
 
 def open_terminal(command, title):
     """Open a new Terminal window on macOS and execute command"""
@@ -28,21 +38,196 @@ def open_terminal(command, title):
     '''
     subprocess.run(['osascript', '-e', script])
 
+def udp_port_bound(port):
+    """Check /proc/net/udp for a socket bound to port (Linux)"""
+    try:
+        with open("/proc/net/udp") as f:
+            next(f)
+            for line in f:
+                local = line.split()[1]
+                if int(local.split(":")[1], 16) == port:
+                    return True
+    except (OSError, StopIteration):
+        return False
+    return False
+
+def wait_for_port(port, proc, timeout=10.0):
+    """Wait until the controller has bound its port, or give up after timeout"""
+    if not os.path.exists("/proc/net/udp"):
+        time.sleep(1)
+        return True
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            return False
+        if udp_port_bound(port):
+            return True
+        time.sleep(0.01)
+    return False
+
+class SupervisedSwitch:
+    """A switch subprocess that is restarted with exponential backoff when it dies"""
+
+    def __init__(self, switch_id, controller_port, failed_neighbor=None):
+        self.switch_id = switch_id
+        self.cmd = [sys.executable, "switch.py", str(switch_id), "localhost", str(controller_port)]
+        if failed_neighbor is not None:
+            self.cmd += ["-f", str(failed_neighbor)]
+        self.log_path = f"switch{switch_id}.log"
+        self.proc = None
+        self.started = 0.0
+        self.backoff = RESTART_BACKOFF_MIN
+        self.restart_at = None
+        self.restarts = 0
+
+    def start(self):
+        # Own session, so Ctrl+C reaches only the launcher, which then stops everything
+        self.proc = subprocess.Popen(self.cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                     start_new_session=True)
+        self.started = time.time()
+        self.restart_at = None
+
+    def check(self, now):
+        """Restart the switch if it crashed and its backoff has elapsed"""
+        if self.restart_at is not None:
+            if now >= self.restart_at:
+                self.restarts += 1
+                print(f"Restarting switch {self.switch_id} (restart {self.restarts})")
+                self.start()
+            return
+        code = self.proc.poll()
+        if code is None:
+            if now - self.started >= RESTART_STABLE_AFTER:
+                self.backoff = RESTART_BACKOFF_MIN
+            return
+        print(f"Switch {self.switch_id} exited with code {code}, restarting in {self.backoff:.0f}s")
+        self.restart_at = now + self.backoff
+        self.backoff = min(self.backoff * 2, RESTART_BACKOFF_MAX)
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+
+def log_timestamp(line, now):
+    """Epoch time of a log record's timestamp line (HH:MM:SS[.ffffff]), or None"""
+    try:
+        t = time_of_day.fromisoformat(line.strip())
+    except ValueError:
+        return None
+    stamp = datetime.combine(date.fromtimestamp(now), t).timestamp()
+    # Written just before midnight, read just after
+    if stamp > now + 43200:
+        stamp -= 86400
+    return stamp
+
+class RoutingWatcher:
+    """Watches a switch log for its first routing table after launch, and
+    takes the time it was installed from the record's own timestamp, since
+    the log may be written out well after the event"""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = os.path.getsize(path) if os.path.exists(path) else 0
+        self.installed_at = None
+
+    def poll(self, now):
+        if self.installed_at is not None or not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            f.seek(self.offset)
+            text = f.read()
+        if "Routing Complete" not in text:
+            return
+        prev = ""
+        for line in text.splitlines():
+            if line == "Routing Update":
+                stamp = log_timestamp(prev, now)
+                self.installed_at = stamp if stamp is not None else now
+                return
+            prev = line
+
+def run_headless(controller_port, config_file, num_switches, enable_perf, failures):
+    """Start everything as background processes and supervise the switches"""
+    children = []
+    start = time.time()
+
+    if enable_perf:
+        perf_cmd = [sys.executable, "perf.py", config_file]
+        print(f"\nStarting perf monitor: {' '.join(perf_cmd)}")
+        children.append(subprocess.Popen(perf_cmd, start_new_session=True))
+
+    controller_cmd = [sys.executable, "controller.py", str(controller_port), config_file]
+    print(f"\nStarting controller: {' '.join(controller_cmd)}")
+    controller = subprocess.Popen(controller_cmd, start_new_session=True)
+    children.append(controller)
+
+    switches = [SupervisedSwitch(sid, controller_port, failures.get(sid))
+                for sid in range(num_switches)]
+    watchers = [RoutingWatcher(sw.log_path) for sw in switches]
+
+    def shutdown(signum=None, frame=None):
+        for sw in switches:
+            sw.stop()
+        for proc in children:
+            if proc.poll() is None:
+                proc.terminate()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+
+    try:
+        if not wait_for_port(controller_port, controller):
+            print("Error: controller did not start")
+            shutdown()
+        print(f"Controller ready after {time.time() - start:.3f}s")
+
+        # Start all switches at once; the controller waits for every registration
+        for sw in switches:
+            sw.start()
+        print(f"Started {num_switches} switches")
+
+        reported = False
+        while True:
+            now = time.time()
+            if controller.poll() is not None:
+                print(f"Controller exited with code {controller.returncode}")
+                shutdown()
+            for sw in switches:
+                sw.check(now)
+            if not reported:
+                for watcher in watchers:
+                    watcher.poll(now)
+                if all(w.installed_at is not None for w in watchers):
+                    last = max(w.installed_at for w in watchers)
+                    print(f"\nNetwork started: routing tables installed on all "
+                          f"{num_switches} switches {last - start:.3f}s after launch")
+                    reported = True
+            time.sleep(0.05 if not reported else 0.5)
+    except KeyboardInterrupt:
+        shutdown()
+
 def main():
     if len(sys.argv) < 3:
-        print("Usage: python run_network.py <controller_port> <config_file> [-p]")
+        print("Usage: python run_network.py <controller_port> <config_file> [-p] [--headless] "
+              "[-f <switch_id>:<neighbor_id> ...]")
         sys.exit(1)
 
     controller_port = int(sys.argv[1])
     config_file = sys.argv[2]
     enable_perf = "-p" in sys.argv
+    headless = "--headless" in sys.argv or sys.platform != "darwin"
+    failures = parse_failures(sys.argv)
 
     if not os.path.exists(config_file):
         print(f"Error: Config file '{config_file}' not found")
         sys.exit(1)
 
     # Parse config to get number of switches
-    num_switches = parse_config(config_file)
+    try:
+        num_switches = parse_config(config_file)
+    except TopologyConfigError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
 
     print(f"Starting network with {num_switches} switches...")
     print(f"Controller port: {controller_port}")
@@ -50,6 +235,10 @@ def main():
     if enable_perf:
         print("Performance monitor: enabled")
 
+    if headless:
+        run_headless(controller_port, config_file, num_switches, enable_perf, failures)
+        return
+
     # Start performance monitor first so it catches initial registration
     if enable_perf:
         perf_cmd = f"python perf.py {config_file}"
@@ -68,6 +257,8 @@ def main():
     # Start all switches
     for switch_id in range(num_switches):
         switch_cmd = f"python switch.py {switch_id} localhost {controller_port}"
+        if switch_id in failures:
+            switch_cmd += f" -f {failures[switch_id]}"
         print(f"Starting switch {switch_id}: {switch_cmd}")
         open_terminal(switch_cmd, f"Switch {switch_id}")
         time.sleep(0.5)
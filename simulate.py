@@ -0,0 +1,546 @@
+#!/usr/bin/env python
+
+"""Discrete-event simulator for the Controller/Switch protocol
+Runs the controller's and the switches' own protocol code (Controller,
+RoutingCache, Switch) against an in-memory transport in virtual time, so a
+failure scenario that takes tens of seconds on real sockets replays as fast
+as the events can be processed, in one process and without sleeps.
+Datagrams are delayed and dropped by a latency/loss model. Routing tables
+are handed to the switches in memory rather than encoded into fragments,
+and are counted and delayed as the datagrams they would have been. From
+CSR_MIN_SWITCHES switches on, routes are computed by the csr engine
+unless --routing says otherwise.
+
+Usage: python simulate.py <config file> | --topology ring|grid|fat-tree|geometric|scale-free --switches N
+           [--duration S] [--latency S] [--jitter S] [--loss P] [--seed K]
+           [--fail-switch SID@T ...] [--restart-switch SID@T ...]
+           [--fail-link A:B@T ...] [--recover-link A:B@T ...]
+           [--routing full|incremental|csr] [--ecmp N] [--hold-down S] [--max-delay S]
+           [--liveness-tick S] [--heartbeat S] [--phi-threshold X]
+
+Author: Matt Bowring
+Email: mbowring@purdue.edu
+"""
+
+import heapq
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import common
+from common import (
+    Topology, SwitchInfo, RoutingEntry,
+    LOCALHOST, UPDATE_DELAY, TIMEOUT, LIVENESS_TICK, KEY_HOST, KEY_PORT,
+    BIN_REGISTER_REQUEST, deserialize_register_request, message_type, get_option,
+    routing_fragments_size,
+)
+from controller import (
+    Controller, RoutingCache, RecomputeDebouncer, RouteSender,
+    ROUTING_INCREMENTAL, ROUTING_CSR, ROUTING_ENGINES, ECMP_MAX_PATHS,
+    RECOMPUTE_HOLD_DOWN, RECOMPUTE_MAX_DELAY,
+    load_config, send_register_responses,
+)
+from routing import RouteTable, np
+from liveness import TimerWheel, FailureDetector, detector_from_args
+from switch import Switch
+from topogen import GENERATORS, generate
+from topology import TopologyConfigError
+
+CONTROLLER_PORT: int = 1
+SWITCH_PORT_BASE: int = 1024
+RESTART_PORT_SHIFT: int = 1 << 20  # a restarted switch comes back on a new port
+REGISTER_SPREAD: float = 0.5  # (seconds) over which switches start and register
+CSR_MIN_SWITCHES: int = 1000  # default to the csr routing engine from this size, given numpy
+
+Address = Tuple[str, int]
+
+MESSAGE_NAMES: Dict[int, str] = {
+    value: name[len('BIN_'):] for name, value in vars(common).items() if name.startswith('BIN_')}
+
+
+class LatencyModel:
+    """One-way delay of latency plus up to jitter seconds, uniformly
+    distributed; each datagram is lost with probability loss."""
+
+    def __init__(self, latency: float = 0.001, jitter: float = 0.0, loss: float = 0.0,
+                 seed: int = 0) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+
+    def delay(self) -> Optional[float]:
+        """Delay of the next datagram, or None if it is lost."""
+        if self.loss and self.rng.random() < self.loss:
+            return None
+        return self.latency + (self.rng.random() * self.jitter if self.jitter else 0.0)
+
+
+class EventQueue:
+    """Virtual clock and the callbacks scheduled on it, run in time order
+    (insertion order among equal times)."""
+
+    def __init__(self) -> None:
+        self.now: float = 0.0
+        self.processed: int = 0
+        self._heap: List[Tuple[float, int, Callable, tuple]] = []
+        self._seq: int = 0
+
+    def at(self, when: float, fn: Callable, *args) -> None:
+        self._seq += 1
+        heapq.heappush(self._heap, (when, self._seq, fn, args))
+
+    def run(self, until: float) -> None:
+        heap = self._heap
+        while heap and heap[0][0] <= until:
+            when, _, fn, args = heapq.heappop(heap)
+            self.now = when
+            fn(*args)
+            self.processed += 1
+        self.now = until
+
+
+class SimNetwork:
+    """In-memory datagram transport. Endpoints are handlers keyed by
+    address; a datagram reaches its handler after the model's delay,
+    unless it is lost, its link is down or nobody is listening by then."""
+
+    def __init__(self, events: EventQueue, model: LatencyModel) -> None:
+        self.events = events
+        self.model = model
+        self.endpoints: Dict[Address, Callable[[bytes, Address], None]] = {}
+        self.down: Set[frozenset] = set()
+        # Per message type: [sent, bytes, dropped]
+        self.stats: Dict[int, List[int]] = {}
+
+    def send(self, src: Address, dst: Address, data: bytes) -> None:
+        stats = self.stats.setdefault(data[0], [0, 0, 0])
+        stats[0] += 1
+        stats[1] += len(data)
+        delay = self.model.delay()
+        if delay is None or (self.down and frozenset((src, dst)) in self.down):
+            stats[2] += 1
+            return
+        # Copy, as the kernel would: senders may reuse their buffers
+        self.events.at(self.events.now + delay, self._deliver, dst, bytes(data), src)
+
+    def _deliver(self, dst: Address, data: bytes, src: Address) -> None:
+        handler = self.endpoints.get(dst)
+        if handler is None:
+            self.stats[data[0]][2] += 1
+            return
+        handler(data, src)
+
+    def carry(self, src: Address, dst: Address, msg_type: int, count: int, size: int,
+              fn: Callable, *args) -> None:
+        """Call fn(*args) in place of delivering count datagrams of msg_type,
+        size bytes in all, that are never built: when the last of them would
+        arrive, and only if none of them is lost and dst still listens."""
+        stats = self.stats.setdefault(msg_type, [0, 0, 0])
+        stats[0] += count
+        stats[1] += size
+        if self.down and frozenset((src, dst)) in self.down:
+            stats[2] += count
+            return
+        last, lost = 0.0, 0
+        for _ in range(count):
+            delay = self.model.delay()
+            if delay is None:
+                lost += 1
+            elif delay > last:
+                last = delay
+        if lost:
+            stats[2] += lost
+            return
+        self.events.at(self.events.now + last, self._deliver_carried, dst, msg_type, count,
+                       fn, args)
+
+    def _deliver_carried(self, dst: Address, msg_type: int, count: int, fn: Callable,
+                         args: tuple) -> None:
+        if dst not in self.endpoints:
+            self.stats[msg_type][2] += count
+            return
+        fn(*args)
+
+
+class SimSocket:
+    """The part of a UDP socket the Controller and Switch use."""
+
+    def __init__(self, net: SimNetwork, addr: Address) -> None:
+        self.net = net
+        self.addr = addr
+        self.closed = False
+
+    def sendto(self, data: bytes, addr: Address) -> None:
+        if not self.closed:
+            self.net.send(self.addr, addr, data)
+
+    def getsockname(self) -> Address:
+        return self.addr
+
+
+class SimRouteSender(RouteSender):
+    """Hands routing tables to the switches in memory instead of encoding
+    them into datagrams and decoding them again. They still go through the
+    network as the datagrams they would take, for the delay, loss and
+    message statistics; a full table is passed as the controller's vectors,
+    which are never modified once computed."""
+
+    def __init__(self, sim: "Simulation") -> None:
+        self.sim = sim
+
+    def send_table(self, ctrl: SimSocket, addr: Address, table: RouteTable, version: int) -> None:
+        if ctrl.closed:
+            return
+        num_routes = len(table) + sum(map(len, table.ecmp.values())) - len(table.ecmp)
+        self.sim.net.carry(ctrl.addr, addr, *routing_fragments_size(num_routes),
+                           self.sim._routes_received, addr, version, table, None)
+
+    def send_delta(self, ctrl: SimSocket, addr: Address, rows: List[RoutingEntry],
+                   version: int) -> None:
+        if ctrl.closed:
+            return
+        self.sim.net.carry(ctrl.addr, addr, *routing_fragments_size(len(rows), delta=True),
+                           self.sim._routes_received, addr, version, None, rows)
+
+
+class SimController(Controller):
+    """Controller that keeps the wall time spent computing and sending
+    routes, so the report can tell it apart from the simulation's own cost,
+    and the virtual time of every routing update it publishes."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.compute_time: float = 0.0
+        self.recomputes: int = 0
+        self.published: List[float] = []
+
+    def start(self, resume=None) -> None:
+        began = time.perf_counter()
+        super().start(resume)
+        self.compute_time += time.perf_counter() - began
+        self.published.append(self.clock())
+
+    def recompute_and_send(self) -> None:
+        began = time.perf_counter()
+        super().recompute_and_send()
+        self.compute_time += time.perf_counter() - began
+        self.recomputes += 1
+
+    def publish_routes(self) -> None:
+        super().publish_routes()
+        self.published.append(self.clock())
+
+
+class Incident:
+    """A scheduled failure or recovery and when the fabric reacted to it."""
+
+    def __init__(self, at: float, label: str) -> None:
+        self.at = at
+        self.label = label
+        self.detected: Optional[float] = None  # controller's topology first changed
+        self.published: Optional[float] = None  # last routing update sent
+        self.installed: Optional[float] = None  # last table change at a switch
+
+    def describe(self) -> str:
+        def since(t: Optional[float]) -> str:
+            return "-" if t is None else f"+{t - self.at:.3f}s"
+        return (f"t={self.at:.3f}s {self.label}: detected {since(self.detected)}, "
+                f"routes published {since(self.published)}, "
+                f"last switch updated {since(self.installed)}")
+
+
+class Simulation:
+    """A controller and one Switch per switch in topo on a SimNetwork.
+
+    Switches register during the first REGISTER_SPREAD seconds; the
+    controller answers once all have, as bootstrap() does. After that the
+    controller runs its liveness check every liveness tick and recomputes
+    when its debouncer says so, and each switch ticks every heartbeat, with
+    the ticks spread evenly over the interval, as in switch_host.py.
+    """
+
+    def __init__(self, topo: Topology, model: LatencyModel, cache: RoutingCache,
+                 debouncer: RecomputeDebouncer, detector: Callable[[], FailureDetector],
+                 heartbeat: float = UPDATE_DELAY, liveness_tick: float = LIVENESS_TICK) -> None:
+        self.topo = topo
+        self.n = len(topo)
+        self.events = EventQueue()
+        self.net = SimNetwork(self.events, model)
+        self.cache = cache
+        self.debouncer = debouncer
+        self.new_detector = detector
+        self.heartbeat = heartbeat
+        self.liveness_tick = liveness_tick
+        self.controller_addr: Address = (LOCALHOST, CONTROLLER_PORT)
+        self.controller: Optional[SimController] = None
+        self.registered: Dict[int, SwitchInfo] = {}
+        self.bootstrapped_at: Optional[float] = None
+        self._recompute_at: Optional[float] = None
+        self._topology_version: int = 0
+        self.incidents: List[Incident] = []
+
+        # Switches share one liveness wheel and failure detector, drained here
+        self.liveness = TimerWheel(0.0, liveness_tick)
+        self.detector = detector()
+        self.switches: Dict[int, Switch] = {}
+        self._by_addr: Dict[Address, Switch] = {}
+        self.failed: Set[int] = set()
+        self._register_sent: Dict[int, float] = {}
+        self.net.endpoints[self.controller_addr] = self._bootstrap_receive
+        rng = random.Random(model.rng.random())
+        for sid in topo:
+            self._add_switch(sid, SWITCH_PORT_BASE + sid)
+            self.events.at(rng.random() * REGISTER_SPREAD, self._register, sid)
+            self.events.at(REGISTER_SPREAD + heartbeat * sid / max(1, self.n),
+                           self._tick_switch, sid, self.switches[sid])
+        self.events.at(liveness_tick, self._drain_liveness)
+
+    def now(self) -> float:
+        return self.events.now
+
+    # Switches
+
+    def _add_switch(self, sid: int, port: int) -> None:
+        addr = (LOCALHOST, port)
+        sw = Switch(sid, SimSocket(self.net, addr), self.controller_addr,
+                    liveness=self.liveness, detector=self.detector)
+        self.switches[sid] = sw
+        self._by_addr[addr] = sw
+        self.net.endpoints[addr] = lambda data, src: self._switch_receive(sw, data, src)
+
+    def _register(self, sid: int) -> None:
+        self._register_sent[sid] = self.now()
+        self.switches[sid].register()
+
+    def _switch_receive(self, sw: Switch, data: bytes, src: Address) -> None:
+        version = sw.table.version
+        sw.handle_message(data, src, self.now())
+        if sw.table.version != version and self.incidents:
+            self.incidents[-1].installed = self.now()
+
+    def _routes_received(self, addr: Address, version: int, table: Optional[RouteTable],
+                         rows: Optional[List[RoutingEntry]]) -> None:
+        # A full table or a delta from SimRouteSender
+        sw = self._by_addr[addr]
+        before = sw.table.version
+        if table is not None:
+            sw.install_vectors(version, table.sid, table.hop, table.dist, table.backup, table.ecmp)
+        else:
+            sw.apply_routes(version, rows, True)
+        if sw.table.version != before and self.incidents:
+            self.incidents[-1].installed = self.now()
+
+    def _tick_switch(self, sid: int, sw: Switch) -> None:
+        if self.switches.get(sid) is not sw:
+            # Failed, or replaced by a restart
+            return
+        now = self.now()
+        # Registration is retried as switch_host.py does, in case it was lost
+        if not sw.registered and now - self._register_sent.get(sid, now) >= TIMEOUT:
+            self._register(sid)
+        sw.tick(now)
+        self.events.at(now + self.heartbeat, self._tick_switch, sid, sw)
+
+    def _drain_liveness(self) -> None:
+        now = self.now()
+        expired: Dict[int, List[int]] = {}
+        for sid, nid in self.liveness.expire(now):
+            expired.setdefault(sid, []).append(nid)
+        for sid, nids in expired.items():
+            sw = self.switches.get(sid)
+            if sw is not None:
+                sw.expire_neighbors(nids)
+        if self.controller is not None:
+            self.controller.check_liveness(now)
+            self._after_controller()
+        self.events.at(now + self.liveness_tick, self._drain_liveness)
+
+    # Controller
+
+    def _bootstrap_receive(self, data: bytes, src: Address) -> None:
+        # Collect every switch's REGISTER_REQUEST, then answer them all at once
+        if message_type(data) != BIN_REGISTER_REQUEST:
+            return
+        sid, sport = deserialize_register_request(data)
+        if sid not in self.topo:
+            return
+        self.registered[sid] = {KEY_HOST: src[0], KEY_PORT: sport}
+        if len(self.registered) < self.n:
+            return
+        sock = SimSocket(self.net, self.controller_addr)
+        send_register_responses(sock, self.topo, self.registered, logging=False)
+        self.controller = SimController(sock, self.registered, self.topo, self.cache,
+                                        debouncer=self.debouncer,
+                                        liveness_tick=self.liveness_tick,
+                                        detector=self.new_detector(),
+                                        clock=self.now, logging=False,
+                                        sender=SimRouteSender(self))
+        self.controller.start()
+        self.bootstrapped_at = self.now()
+        self.net.endpoints[self.controller_addr] = self._controller_receive
+
+    def _controller_receive(self, data: bytes, src: Address) -> None:
+        self.controller.handle_message(data, src)
+        self._after_controller()
+
+    def _after_controller(self) -> None:
+        controller = self.controller
+        if controller.topology_version != self._topology_version:
+            self._topology_version = controller.topology_version
+            if self.incidents and self.incidents[-1].detected is None:
+                self.incidents[-1].detected = self.now()
+        if self.incidents and controller.published and \
+                controller.published[-1] >= self.incidents[-1].at:
+            self.incidents[-1].published = controller.published[-1]
+        # Wake up when the debouncer's batch falls due
+        due = controller.debouncer.deadline()
+        if due is not None and due != self._recompute_at:
+            self._recompute_at = due
+            self.events.at(due, self._recompute, due)
+
+    def _recompute(self, due: float) -> None:
+        if due != self._recompute_at:
+            # Superseded by a later deadline
+            return
+        self._recompute_at = None
+        self.controller.run_due_recompute(self.now())
+        self._after_controller()
+
+    # Scenario
+
+    def fail_switch(self, when: float, sid: int) -> None:
+        def fail() -> None:
+            sw = self.switches.pop(sid, None)
+            if sw is None:
+                return
+            self.incidents.append(Incident(self.now(), f"switch {sid} failed"))
+            sw.sock.closed = True
+            del self.net.endpoints[sw.sock.addr]
+            self.failed.add(sid)
+        self.events.at(when, fail)
+
+    def restart_switch(self, when: float, sid: int) -> None:
+        def restart() -> None:
+            if sid not in self.failed:
+                return
+            self.failed.discard(sid)
+            self.incidents.append(Incident(self.now(), f"switch {sid} restarted"))
+            self._add_switch(sid, SWITCH_PORT_BASE + sid + RESTART_PORT_SHIFT)
+            self._register(sid)
+            self._tick_switch(sid, self.switches[sid])
+        self.events.at(when, restart)
+
+    def set_link(self, when: float, a: int, b: int, up: bool) -> None:
+        def change() -> None:
+            pair = frozenset(sw.sock.addr for sw in (self.switches.get(a), self.switches.get(b))
+                             if sw is not None)
+            self.incidents.append(Incident(self.now(), f"link {a}-{b} {'up' if up else 'down'}"))
+            if up:
+                self.net.down.discard(pair)
+            else:
+                self.net.down.add(pair)
+        self.events.at(when, change)
+
+    def run(self, duration: float) -> float:
+        """Run duration seconds of virtual time; returns the wall time taken."""
+        began = time.perf_counter()
+        self.events.run(duration)
+        return time.perf_counter() - began
+
+    def converged(self) -> Tuple[int, int]:
+        """Live switches whose installed next hops match the controller's
+        current tables, and the number of live switches."""
+        if self.controller is None:
+            return 0, len(self.switches)
+        tables = self.controller.cache.routes_by_switch
+        good = sum(1 for sid, sw in self.switches.items()
+                   if sid in tables and sw.table.next_hop == tables[sid].hop)
+        return good, len(self.switches)
+
+    def report(self, duration: float, wall: float) -> None:
+        print(f"Simulated {duration:.1f}s of a {self.n}-switch fabric in {wall:.2f}s wall "
+              f"({duration / max(wall, 1e-9):.1f}x real time), "
+              f"{self.events.processed:,} events ({self.events.processed / max(wall, 1e-9):,.0f}/s)")
+        if self.controller is None:
+            print(f"Bootstrap incomplete: {len(self.registered)} of {self.n} switches registered")
+            return
+        controller = self.controller
+        print(f"Bootstrap done at t={self.bootstrapped_at:.3f}s; computing and sending routes "
+              f"took {controller.compute_time:.2f}s wall over {controller.recomputes + 1} recomputes")
+        print(f"{'message':<18}{'sent':>12}{'bytes':>16}{'dropped':>10}")
+        for msg_type, (sent, size, dropped) in sorted(self.net.stats.items()):
+            print(f"{MESSAGE_NAMES.get(msg_type, str(msg_type)):<18}{sent:>12,}{size:>16,}{dropped:>10,}")
+        for incident in self.incidents:
+            print(incident.describe())
+        good, live = self.converged()
+        print(f"Converged: {good} of {live} live switches hold the controller's current tables")
+
+
+def parse_events(argv: List[str], flag: str) -> List[Tuple[float, str]]:
+    """Every <what>@<time> given for flag, which may be repeated."""
+    found = []
+    for i, arg in enumerate(argv):
+        if arg == flag and i + 1 < len(argv):
+            what, when = argv[i + 1].split('@')
+            found.append((float(when), what))
+    return found
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        print("simulate.py <config file> | --topology KIND --switches N [--duration S] [--latency S] [--jitter S] "
+              "[--loss P] [--seed K] [--fail-switch SID@T] [--restart-switch SID@T] "
+              "[--fail-link A:B@T] [--recover-link A:B@T] [--routing full|incremental|csr] "
+              "[--ecmp N] [--hold-down S] [--max-delay S] [--liveness-tick S] "
+              "[--heartbeat S] [--phi-threshold X]\n")
+        sys.exit(1)
+
+    kind = get_option(sys.argv, '--topology')
+    if kind is not None:
+        if kind not in GENERATORS:
+            print(f"Unknown topology '{kind}', expected one of {', '.join(GENERATORS)}")
+            sys.exit(1)
+        topo = generate(kind, int(get_option(sys.argv, '--switches', '100')),
+                        int(get_option(sys.argv, '--seed', '0')))
+    else:
+        try:
+            topo = load_config(sys.argv[1])
+        except TopologyConfigError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    default = ROUTING_CSR if len(topo) >= CSR_MIN_SWITCHES and np is not None else ROUTING_INCREMENTAL
+    engine = get_option(sys.argv, '--routing', default)
+    if engine not in ROUTING_ENGINES:
+        print(f"Unknown routing engine '{engine}', expected one of {', '.join(ROUTING_ENGINES)}")
+        sys.exit(1)
+
+    duration = float(get_option(sys.argv, '--duration', '30'))
+    model = LatencyModel(float(get_option(sys.argv, '--latency', '0.001')),
+                         float(get_option(sys.argv, '--jitter', '0')),
+                         float(get_option(sys.argv, '--loss', '0')),
+                         int(get_option(sys.argv, '--seed', '0')))
+    cache = RoutingCache(engine,
+                         ecmp_paths=int(get_option(sys.argv, '--ecmp', str(ECMP_MAX_PATHS))))
+    debouncer = RecomputeDebouncer(
+        float(get_option(sys.argv, '--hold-down', str(RECOMPUTE_HOLD_DOWN))),
+        float(get_option(sys.argv, '--max-delay', str(RECOMPUTE_MAX_DELAY))))
+    sim = Simulation(topo, model, cache, debouncer, lambda: detector_from_args(sys.argv),
+                     float(get_option(sys.argv, '--heartbeat', str(UPDATE_DELAY))),
+                     float(get_option(sys.argv, '--liveness-tick', str(LIVENESS_TICK))))
+
+    for when, sid in parse_events(sys.argv, '--fail-switch'):
+        sim.fail_switch(when, int(sid))
+    for when, sid in parse_events(sys.argv, '--restart-switch'):
+        sim.restart_switch(when, int(sid))
+    for flag, up in (('--fail-link', False), ('--recover-link', True)):
+        for when, link in parse_events(sys.argv, flag):
+            a, b = link.split(':')
+            sim.set_link(when, int(a), int(b), up)
+
+    sim.report(duration, sim.run(duration))
+
+
+if __name__ == "__main__":
+    main()
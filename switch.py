@@ -7,20 +7,26 @@ Email: mbowring@purdue.edu
 
 import sys
 import socket
-import struct
 import threading
 import time
+from array import array
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 from common import (
     RoutingEntry, NeighborInfo,
-    LOCALHOST, BUFFER_SIZE, UPDATE_DELAY, TIMEOUT,
-    KEY_NEIGHBOR_ID, KEY_ALIVE, KEY_HOST, KEY_PORT,
-    BIN_REGISTER_RESPONSE, BIN_ROUTING_UPDATE, BIN_KEEP_ALIVE,
+    LOCALHOST, BUFFER_SIZE, UPDATE_DELAY, TIMEOUT, FRAGMENT_TIMEOUT, LIVENESS_TICK,
+    KEY_NEIGHBOR_ID, KEY_HOST, KEY_PORT,
+    BIN_REGISTER_RESPONSE, BIN_ROUTING_UPDATE, BIN_ROUTING_DELTA, BIN_ROUTING_FRAGMENT,
+    BIN_KEEP_ALIVE, BIN_TOPOLOGY_RESYNC, BIN_DATA, UNREACHABLE_HOP,
     serialize_register_request, deserialize_register_response, deserialize_routing_update,
+    deserialize_routing_fragment,
     serialize_keep_alive, deserialize_keep_alive, serialize_topology_update,
+    serialize_routing_resync, serialize_switch_heartbeat, message_type, get_option,
+    data_destination, with_ttl,
 )
+from eventlog import AsyncLogWriter, log_writer_from_args
+from liveness import TimerWheel, FailureDetector, FixedTimeout, detector_from_args
 
 # Please do not modify the name of the log file, otherwise you will lose points because the grader won't be able to find your log file
 LOG_FILE = "switch#.log" # The log file for switches are switch#.log, where # is the id of that switch (i.e. switch0.log, switch1.log). The code for replacing # with a real number has been given to you in the main function.
@@ -32,22 +38,22 @@ LOG_FILE = "switch#.log" # The log file for switches are switch#.log, where # is
 # Timestamp
 # Register Request Sent
 
-def register_request_sent() -> None:
+def register_request_sent(log_file: Optional[str] = None) -> None:
     log: List[str] = []
     log.append(str(datetime.time(datetime.now())) + "\n")
     log.append(f"Register Request Sent\n")
-    write_to_log(log)
+    write_to_log(log, log_file)
 
 # "Register Response" Format is below:
 #
 # Timestamp
 # Register Response Received
 
-def register_response_received() -> None:
+def register_response_received(log_file: Optional[str] = None) -> None:
     log: List[str] = []
     log.append(str(datetime.time(datetime.now())) + "\n")
     log.append(f"Register Response Received\n")
-    write_to_log(log)
+    write_to_log(log, log_file)
 
 # For the parameter "routing_table", it should be a list of lists in the form of [[...], [...], ...].
 # Within each list in the outermost list, the first element is <Switch ID>. The second is <Dest ID>, and the third is <Next Hop>.
@@ -63,72 +69,473 @@ def register_response_received() -> None:
 # You should also include all of the Self routes in your routing_table argument -- e.g.,  Switch (ID = 4) should include the following entry:
 # 4,4:4
 
-def routing_table_update(routing_table: List[RoutingEntry]) -> None:
+def routing_table_update(routing_table: List[RoutingEntry], log_file: Optional[str] = None) -> None:
     log: List[str] = []
     log.append(str(datetime.time(datetime.now())) + "\n")
     log.append("Routing Update\n")
     for row in routing_table:
         log.append(f"{row[0]},{row[1]}:{row[2]}\n")
     log.append("Routing Complete\n")
-    write_to_log(log)
+    write_to_log(log, log_file)
 
 # "Unresponsive/Dead Neighbor Detected" Format is below:
 #
 # Timestamp
 # Neighbor Dead <Neighbor ID>
 
-def neighbor_dead(switch_id: int) -> None:
+def neighbor_dead(switch_id: int, log_file: Optional[str] = None) -> None:
     log: List[str] = []
     log.append(str(datetime.time(datetime.now())) + "\n")
     log.append(f"Neighbor Dead {switch_id}\n")
-    write_to_log(log)
+    write_to_log(log, log_file)
 
 # "Unresponsive/Dead Neighbor comes back online" Format is below:
 #
 # Timestamp
 # Neighbor Alive <Neighbor ID>
 
-def neighbor_alive(switch_id: int) -> None:
+def neighbor_alive(switch_id: int, log_file: Optional[str] = None) -> None:
     log: List[str] = []
     log.append(str(datetime.time(datetime.now())) + "\n")
     log.append(f"Neighbor Alive {switch_id}\n")
-    write_to_log(log)
+    write_to_log(log, log_file)
 
-def write_to_log(log: List[str]) -> None:
-    with open(LOG_FILE, 'a+') as log_file:
+# Background writer for log records; None writes synchronously
+LOG_WRITER: Optional[AsyncLogWriter] = None
+
+def write_to_log(log: List[str], path: Optional[str] = None) -> None:
+    path = path or LOG_FILE
+    if LOG_WRITER is not None:
+        LOG_WRITER.write(path, log)
+        return
+    with open(path, 'a+') as log_file:
         log_file.write("\n\n")
         # Write to log
         log_file.writelines(log)
 
-def register_with_controller(sid: int, host: str, port: int) -> Optional[List[NeighborInfo]]:
+def flow_hash(src: int, dst: int, flow: int, salt: int) -> int:
+    # Stable per flow; salting with the switch id keeps switches along a path
+    # from all making the same choice among their equal-cost hops
+    h = (src * 0x9E3779B1 ^ dst * 0x85EBCA77 ^ flow * 0xC2B2AE3D ^ salt * 0x27D4EB2F) & 0xFFFFFFFF
+    h ^= h >> 15
+    h = (h * 0x2C1B3C6D) & 0xFFFFFFFF
+    return h ^ (h >> 12)
+
+class LocalRoutingTable:
+    """Switch's installed routes, keyed by destination, with the controller's
+    table version. next_hop and backup_hop are dense copies of the primary
+    and loop-free alternate hops indexed by destination id, for O(1)
+    forwarding lookups. ecmp holds the equal-cost next-hop sets of the
+    destinations that have several, sent as extra rows right after the
+    destination's primary row."""
+
+    __slots__ = ('version', 'routes', 'next_hop', 'backup_hop', 'ecmp', 'base')
+
+    def __init__(self) -> None:
+        self.version: int = 0
+        self.routes: Dict[int, RoutingEntry] = {}
+        self.next_hop = array('i')
+        self.backup_hop = array('i')
+        self.ecmp: Dict[int, Tuple[int, ...]] = {}
+        # (sid, hop, dist, backup) of a table installed from vectors; rows in
+        # routes override it
+        self.base: Optional[Tuple[int, array, array, array]] = None
+
+    def install(self, version: int, routes: List[RoutingEntry]) -> bool:
+        """Replace the table with a full one. Returns False, leaving the table
+        untouched, for a table older than the installed one."""
+        if version < self.version:
+            return False
+        self.version = version
+        self.routes = {}
+        self.ecmp = {}
+        self.base = None
+        size = max(r[1] for r in routes) + 1 if routes else 0
+        self.next_hop = array('i', [UNREACHABLE_HOP]) * size
+        self.backup_hop = array('i', [UNREACHABLE_HOP]) * size
+        self._set_hops(routes)
+        return True
+
+    def install_vectors(self, version: int, sid: int, hop: array, dist: array, backup: array,
+                        ecmp: Dict[int, Tuple[int, ...]]) -> bool:
+        """Same as install() with the rows of a table given as per-destination
+        vectors, as the simulator hands the controller's tables over. The
+        vectors are shared, not copied, until a delta first changes them, and
+        are only turned into rows by rows()."""
+        if version < self.version:
+            return False
+        self.version = version
+        self.routes = {}
+        self.ecmp = dict(ecmp)
+        self.next_hop = hop
+        self.backup_hop = backup
+        self.base = (sid, hop, dist, backup)
+        return True
+
+    def _set_hops(self, routes: List[RoutingEntry]) -> None:
+        if self.base is not None and self.next_hop is self.base[1]:
+            self.next_hop, self.backup_hop = self.next_hop[:], self.backup_hop[:]
+        next_hop, backup_hop, ecmp = self.next_hop, self.backup_hop, self.ecmp
+        last = None
+        for r in routes:
+            did = r[1]
+            if did == last:
+                # Another equal-cost next hop of the destination just set
+                ecmp[did] = ecmp.get(did, (next_hop[did],)) + (r[2],)
+                continue
+            last = did
+            if did >= len(next_hop):
+                grow = [UNREACHABLE_HOP] * (did + 1 - len(next_hop))
+                next_hop.extend(grow)
+                backup_hop.extend(grow)
+            self.routes[did] = r
+            next_hop[did] = r[2]
+            backup_hop[did] = r[4]
+            ecmp.pop(did, None)
+
+    def lookup(self, dst: int) -> int:
+        return self.next_hop[dst] if 0 <= dst < len(self.next_hop) else UNREACHABLE_HOP
+
+    def select(self, dst: int, src: int, flow: int, salt: int) -> int:
+        """Next hop of a flow: one of the equal-cost hops, chosen by flow hash."""
+        hops = self.ecmp.get(dst)
+        if hops is None:
+            return self.lookup(dst)
+        return hops[flow_hash(src, dst, flow, salt) % len(hops)]
+
+    def next_hops(self, dst: int) -> Tuple[int, ...]:
+        return self.ecmp.get(dst) or (self.lookup(dst),)
+
+    def lookup_backup(self, dst: int) -> int:
+        return self.backup_hop[dst] if 0 <= dst < len(self.backup_hop) else UNREACHABLE_HOP
+
+    def apply_delta(self, version: int, routes: List[RoutingEntry]) -> bool:
+        """Apply changed rows on top of the current table. Returns False on a
+        version gap, in which case the table is left untouched."""
+        if version != self.version + 1:
+            return False
+        self._set_hops(routes)
+        self.version = version
+        return True
+
+    def rows(self) -> List[RoutingEntry]:
+        if self.base is None:
+            return [self.routes[did] for did in sorted(self.routes)]
+        sid, hop, dist, backup = self.base
+        routes = self.routes
+        rows = [routes.get(did) or [sid, did, hop[did], dist[did], backup[did]]
+                for did in range(len(hop))]
+        rows.extend(routes[did] for did in sorted(routes) if did >= len(hop))
+        return rows
+
+class FragmentAssembler:
+    """Reassembles a fragmented routing table. Only the newest version is
+    kept; fragments of older versions are dropped, and a partial table that
+    is not completed within the timeout is abandoned."""
+
+    __slots__ = ('timeout', 'version', 'delta', 'total', 'parts', 'started')
+
+    def __init__(self, timeout: float = FRAGMENT_TIMEOUT) -> None:
+        self.timeout = timeout
+        self.reset()
+
+    def reset(self) -> None:
+        self.version: Optional[int] = None
+        self.delta: bool = False
+        self.total: int = 0
+        self.parts: Dict[int, List[RoutingEntry]] = {}
+        self.started: float = 0.0
+
+    def add(self, version: int, index: int, total: int, delta: bool,
+            routes: List[RoutingEntry], now: float) -> Optional[List[RoutingEntry]]:
+        """Store a fragment and return the whole table once all have arrived."""
+        if self.version is not None and version < self.version:
+            return None
+        if self.version != version or self.delta != delta or self.total != total:
+            # A newer table supersedes whatever was partially received
+            self.reset()
+            self.version, self.delta, self.total, self.started = version, delta, total, now
+        self.parts[index] = routes
+        if len(self.parts) < self.total:
+            return None
+        table = [r for i in range(self.total) for r in self.parts[i]]
+        self.reset()
+        return table
+
+    def expired(self, now: float) -> bool:
+        return self.version is not None and (now - self.started) >= self.timeout
+
+class Neighbor:
+    __slots__ = ('id', 'host', 'port', 'alive', 'last_heard')
+
+    def __init__(self, info: NeighborInfo, now: float) -> None:
+        self.id: int = info[KEY_NEIGHBOR_ID]
+        self.host: str = info[KEY_HOST]
+        self.port: int = info[KEY_PORT]
+        # A neighbor that has not registered yet has no address; it comes
+        # alive with its first KEEP_ALIVE
+        self.alive: bool = self.port != 0
+        self.last_heard: float = now
+
+class Switch:
+    """State and protocol logic of one switch, driven by handle_message for
+    every datagram received on sock, tick every UPDATE_DELAY and
+    check_liveness every liveness tick. Callers are responsible for
+    serialising the three. With log_file None the switch does not log.
+
+    The controller gets a SWITCH_HEARTBEAT every tick and a sequenced
+    TOPOLOGY_UPDATE only when a neighbor's alive state changes, or when it
+    asks for one with TOPOLOGY_RESYNC.
+
+    DATA packets are forwarded to the installed next hop with the TTL
+    decremented; where a destination has several equal-cost next hops, a
+    hash of the packet's flow picks one, so each flow keeps to one path.
+    Packets for this switch go to its attached host, the last non-neighbor
+    address that injected a packet with this switch as source. While the
+    next hop is dead the packet takes another live equal-cost hop, or else
+    the backup hop the controller shipped with the route, so traffic fails
+    over as soon as the neighbor times out rather than when the
+    controller's new table arrives.
+
+    Neighbor timeouts are (sid, neighbor id) keys on a TimerWheel, armed at
+    the deadline the failure detector gives for each KEEP_ALIVE. Wheel and
+    detector may be shared by many switches; whoever drains a shared wheel
+    hands the expired neighbors to expire_neighbors.
+    """
+
+    __slots__ = ('sid', 'sock', 'controller_addr', 'failed_neighbor', 'log_file',
+                 'neighbors', 'table', 'assembler', 'registered_at', 'liveness', 'detector',
+                 'topology_seq', 'host_addr', 'forwarded', 'rerouted', 'delivered', 'dropped')
+
+    def __init__(self, sid: int, sock: socket.socket, controller_addr: Tuple[str, int],
+                 failed_neighbor: Optional[int] = None, log_file: Optional[str] = None,
+                 liveness: Optional[TimerWheel] = None,
+                 detector: Optional[FailureDetector] = None) -> None:
+        self.sid = sid
+        self.sock = sock
+        self.controller_addr = controller_addr
+        self.failed_neighbor = failed_neighbor
+        self.log_file = log_file
+        self.neighbors: Dict[int, Neighbor] = {}
+        self.table = LocalRoutingTable()
+        self.assembler = FragmentAssembler()
+        self.registered_at: Optional[float] = None
+        self.liveness = liveness if liveness is not None else TimerWheel(time.time())
+        self.detector = detector if detector is not None else FixedTimeout()
+        self.topology_seq: int = 0
+        # Host attached to this switch: DATA for this switch is delivered to it
+        self.host_addr: Optional[Tuple[str, int]] = None
+        self.forwarded: int = 0
+        self.rerouted: int = 0
+        self.delivered: int = 0
+        self.dropped: int = 0
+
+    @property
+    def registered(self) -> bool:
+        return self.registered_at is not None
+
+    def log(self, event: Callable, *args) -> None:
+        if self.log_file is not None:
+            event(*args, self.log_file)
+
+    def register(self) -> None:
+        # Send Register Request to controller via UDP (binary format)
+        sport = self.sock.getsockname()[1]
+        self.sock.sendto(serialize_register_request(self.sid, sport), self.controller_addr)
+        self.log(register_request_sent)
+
+    def send_topology_update(self) -> None:
+        nbr_list = [(nid, nbr.alive) for nid, nbr in self.neighbors.items()]
+        self.sock.sendto(serialize_topology_update(self.sid, nbr_list, self.topology_seq),
+                         self.controller_addr)
+
+    def topology_changed(self) -> None:
+        self.topology_seq += 1
+        self.send_topology_update()
+
+    def request_resync(self) -> None:
+        self.sock.sendto(serialize_routing_resync(self.sid, self.table.version),
+                         self.controller_addr)
+
+    def tick(self, now: float) -> None:
+        if not self.registered:
+            return
+
+        # Abandon a fragmented table that stalled, or never got one, and fetch it again
+        if self.assembler.expired(now) or (
+                self.table.version == 0 and now - self.registered_at >= TIMEOUT):
+            self.assembler.reset()
+            self.request_resync()
+
+        self.send_keep_alives()
+
+        # Heartbeat to controller, carrying the seq of our latest topology update
+        # and our table version, so a lost final delta is noticed
+        self.sock.sendto(serialize_switch_heartbeat(self.sid, self.topology_seq,
+                                                    self.table.version),
+                         self.controller_addr)
+
+    def send_keep_alives(self) -> None:
+        # Send KEEP_ALIVE to each alive neighbor (skip failed)
+        keep_alive = serialize_keep_alive(self.sid)
+        for nid, nbr in self.neighbors.items():
+            if not nbr.alive or nid == self.failed_neighbor:
+                continue
+            self.sock.sendto(keep_alive, (nbr.host, nbr.port))
+
+    def check_liveness(self, now: float) -> None:
+        # Only for a wheel owned by this switch
+        self.expire_neighbors([nid for _, nid in self.liveness.expire(now)])
+
+    def expire_neighbors(self, nids: List[int]) -> None:
+        """Mark timed-out neighbors dead and tell the controller right away."""
+        changed = False
+        for nid in nids:
+            nbr = self.neighbors.get(nid)
+            if nbr is not None and nbr.alive:
+                nbr.alive = False
+                self.detector.forget((self.sid, nid))
+                self.log(neighbor_dead, nid)
+                changed = True
+        if changed:
+            self.topology_changed()
+
+    def handle_message(self, data: bytes, addr: Tuple[str, int], now: float) -> None:
+        msg_type = message_type(data)
+
+        if msg_type == BIN_DATA:
+            self.handle_data(data, addr)
+
+        elif msg_type == BIN_KEEP_ALIVE:
+            self.handle_keep_alive(deserialize_keep_alive(data), addr, now)
+
+        elif msg_type == BIN_REGISTER_RESPONSE:
+            if self.registered:
+                return
+            self.log(register_response_received)
+            self.neighbors = {info[KEY_NEIGHBOR_ID]: Neighbor(info, now)
+                              for info in deserialize_register_response(data)}
+            self.registered_at = now
+            for nid, nbr in self.neighbors.items():
+                if nbr.alive:
+                    key = (self.sid, nid)
+                    self.liveness.schedule(key, self.detector.heard(key, now))
+            # Neighbors that joined before us learn our address right away
+            self.send_keep_alives()
+
+        elif msg_type == BIN_TOPOLOGY_RESYNC:
+            # Controller missed one of our updates
+            if self.registered:
+                self.send_topology_update()
+
+        elif msg_type == BIN_ROUTING_UPDATE:
+            version, routes = deserialize_routing_update(data)
+            self.apply_routes(version, routes, False)
+
+        elif msg_type == BIN_ROUTING_DELTA:
+            version, routes = deserialize_routing_update(data)
+            self.apply_routes(version, routes, True)
+
+        elif msg_type == BIN_ROUTING_FRAGMENT:
+            version, index, total, delta, routes = deserialize_routing_fragment(data)
+            if version <= self.table.version:
+                return
+            routes = self.assembler.add(version, index, total, delta, routes, now)
+            if routes is not None:
+                self.apply_routes(version, routes, delta)
+
+    def handle_keep_alive(self, sender_id: int, addr: Tuple[str, int], now: float) -> None:
+        # Ignore keep-alive from failed neighbor
+        if sender_id == self.failed_neighbor:
+            return
+        nbr = self.neighbors.get(sender_id)
+        if nbr is None:
+            return
+        nbr.last_heard = now
+        key = (self.sid, sender_id)
+        self.liveness.schedule(key, self.detector.heard(key, now))
+        # Follow the neighbor's address, it changes when the neighbor restarts
+        nbr.host, nbr.port = addr[0], addr[1]
+        if not nbr.alive:
+            nbr.alive = True
+            self.log(neighbor_alive, sender_id)
+            self.topology_changed()
+
+    def handle_data(self, data: bytes, addr: Tuple[str, int]) -> None:
+        src, dst, ttl, flow = data_destination(data)
+        if src == self.sid and not self.from_neighbor(addr):
+            # Injected by a host, which becomes the attached host
+            self.host_addr = addr
+        if dst == self.sid:
+            if self.host_addr is not None:
+                self.sock.sendto(data, self.host_addr)
+            self.delivered += 1
+            return
+        nbr = self.neighbors.get(self.table.select(dst, src, flow, self.sid))
+        if nbr is not None and not self.usable(nbr):
+            # Local fast reroute
+            nbr = self.reroute(dst)
+            if nbr is not None:
+                self.rerouted += 1
+        if ttl <= 1 or nbr is None:
+            self.dropped += 1
+            return
+        self.sock.sendto(with_ttl(data, ttl - 1), (nbr.host, nbr.port))
+        self.forwarded += 1
+
+    def usable(self, nbr: Neighbor) -> bool:
+        return nbr.alive and nbr.id != self.failed_neighbor
+
+    def reroute(self, dst: int) -> Optional[Neighbor]:
+        """First live equal-cost hop towards dst, else the loop-free alternate."""
+        for nid in self.table.next_hops(dst) + (self.table.lookup_backup(dst),):
+            nbr = self.neighbors.get(nid)
+            if nbr is not None and self.usable(nbr):
+                return nbr
+        return None
+
+    def from_neighbor(self, addr: Tuple[str, int]) -> bool:
+        return any(nbr.port == addr[1] and nbr.host == addr[0]
+                   for nbr in self.neighbors.values())
+
+    def apply_routes(self, version: int, routes: List[RoutingEntry], delta: bool) -> bool:
+        if not delta:
+            if not self.table.install(version, routes):
+                # Delayed behind a newer table
+                return False
+        elif version <= self.table.version:
+            return False
+        elif not self.table.apply_delta(version, routes):
+            # Missed an update, ask the controller for the full table
+            self.request_resync()
+            return False
+        self.table_installed()
+        return True
+
+    def install_vectors(self, version: int, sid: int, hop: array, dist: array, backup: array,
+                        ecmp: Dict[int, Tuple[int, ...]]) -> bool:
+        # A full table handed over in memory rather than in datagrams
+        if not self.table.install_vectors(version, sid, hop, dist, backup, ecmp):
+            return False
+        self.table_installed()
+        return True
+
+    def table_installed(self) -> None:
+        # The rows are only built when they are logged
+        if self.log_file is not None:
+            self.log(routing_table_update, self.table.rows())
+
+def open_switch_socket() -> socket.socket:
     # Create a UDP socket for communication with controller and other switches
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
     # Bind to localhost
     sock.bind((LOCALHOST, 0))
-    sport = sock.getsockname()[1]
-
-    # Send Register Request to controller via UDP (binary format)
-    sock.sendto(
-        serialize_register_request(sid, sport),
-        (host, port)
-    )
-    register_request_sent()
-
-    # Receive Register Response from controller (binary format)
-    data, _ = sock.recvfrom(BUFFER_SIZE)
-    msg_type = struct.unpack('!B', data[:1])[0]
-
-    if msg_type == BIN_REGISTER_RESPONSE:
-        register_response_received()
-        nbrs = deserialize_register_response(data)
-        return sock, nbrs
-
-    return None
+    return sock
 
 def main() -> None:
-    global LOG_FILE
+    global LOG_FILE, LOG_WRITER
 
     # Check for number of arguments and exit if host/port not provided
     if len(sys.argv) < 4:
@@ -140,70 +547,33 @@ def main() -> None:
     port: int = int(sys.argv[3])
 
     LOG_FILE = 'switch' + str(sid) + ".log"
-
-    # Register with controller and get neighbor information
-    result = register_with_controller(sid, host, port)
-    if result is None:
-        sys.exit(1)
-
-    sock, nbrs = result
-
-    # Receive routing update (binary format)
-    data, _ = sock.recvfrom(BUFFER_SIZE)
-    msg_type = struct.unpack('!B', data[:1])[0]
-    if msg_type == BIN_ROUTING_UPDATE:
-        routes = deserialize_routing_update(data)
-        routing_table_update(routes)
+    LOG_WRITER = log_writer_from_args(sys.argv)
 
     # Parse -f flag for link failure simulation
     failed_neighbor: Optional[int] = None
     if len(sys.argv) >= 6 and sys.argv[4] == '-f':
         failed_neighbor = int(sys.argv[5])
 
-    # Initialize neighbor state from register response
+    # Register with controller; the response and routes arrive on the recv loop
+    sock = open_switch_socket()
+    liveness_tick = float(get_option(sys.argv, '--liveness-tick', str(LIVENESS_TICK)))
+    heartbeat = float(get_option(sys.argv, '--heartbeat', str(UPDATE_DELAY)))
+    switch = Switch(sid, sock, (host, port), failed_neighbor, LOG_FILE,
+                    TimerWheel(time.time(), liveness_tick), detector_from_args(sys.argv))
     lock = threading.Lock()
-    neighbors: Dict[int, Dict[str, Any]] = {}
-    for nbr in nbrs:
-        neighbors[nbr[KEY_NEIGHBOR_ID]] = {
-            KEY_HOST: nbr[KEY_HOST],
-            KEY_PORT: nbr[KEY_PORT],
-            KEY_ALIVE: True,
-            'last_heard': time.time()
-        }
-    controller_addr = (host, port)
-
-    def send_topology_update() -> None:
-        nbr_list = [(nid, info[KEY_ALIVE]) for nid, info in neighbors.items()]
-        sock.sendto(
-            serialize_topology_update(sid, nbr_list),
-            controller_addr
-        )
+    switch.register()
 
     def periodic_tasks() -> None:
+        # Liveness every tick, KEEP_ALIVEs and the topology report every heartbeat
+        next_update = time.time() + heartbeat
         while True:
-            time.sleep(UPDATE_DELAY)
+            time.sleep(liveness_tick)
+            now = time.time()
             with lock:
-                now = time.time()
-
-                # Check for timed-out neighbors
-                for nid, info in neighbors.items():
-                    if info[KEY_ALIVE] and (now - info['last_heard']) >= TIMEOUT:
-                        info[KEY_ALIVE] = False
-                        neighbor_dead(nid)
-
-                # Send KEEP_ALIVE to each alive neighbor (skip failed)
-                for nid, info in neighbors.items():
-                    if not info[KEY_ALIVE]:
-                        continue
-                    if failed_neighbor is not None and nid == failed_neighbor:
-                        continue
-                    sock.sendto(
-                        serialize_keep_alive(sid),
-                        (info[KEY_HOST], info[KEY_PORT])
-                    )
-
-                # Send Topology Update to controller
-                send_topology_update()
+                switch.check_liveness(now)
+                if now >= next_update:
+                    switch.tick(now)
+                    next_update = max(next_update + heartbeat, now)
 
     # Start periodic timer thread
     timer = threading.Thread(target=periodic_tasks, daemon=True)
@@ -212,30 +582,8 @@ def main() -> None:
     # Main thread: recv loop
     while True:
         data, addr = sock.recvfrom(BUFFER_SIZE)
-        msg_type = struct.unpack('!B', data[:1])[0]
-
-        if msg_type == BIN_KEEP_ALIVE:
-            sender_id = deserialize_keep_alive(data)
-
-            # Ignore keep-alive from failed neighbor
-            if failed_neighbor is not None and sender_id == failed_neighbor:
-                continue
-
-            with lock:
-                if sender_id in neighbors:
-                    was_dead = not neighbors[sender_id][KEY_ALIVE]
-                    neighbors[sender_id]['last_heard'] = time.time()
-
-                    if was_dead:
-                        neighbors[sender_id][KEY_ALIVE] = True
-                        neighbors[sender_id][KEY_HOST] = addr[0]
-                        neighbors[sender_id][KEY_PORT] = addr[1]
-                        neighbor_alive(sender_id)
-                        send_topology_update()
-
-        elif msg_type == BIN_ROUTING_UPDATE:
-            routes = deserialize_routing_update(data)
-            routing_table_update(routes)
+        with lock:
+            switch.handle_message(data, addr, time.time())
 
 if __name__ == "__main__":
     main()
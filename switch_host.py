@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""Switch Host
+Runs many switches in one process on a single selectors loop with a shared
+timer. Every switch keeps its own UDP socket, neighbor table and
+KEEP_ALIVE/SWITCH_HEARTBEAT/TOPOLOGY_UPDATE behavior, so to the controller they look exactly
+like separate switch.py processes.
+
+Usage: python switch_host.py <Controller hostname> <Controller Port> <num switches>
+           [--first-id K] [--no-log] [--register-batch N] [--liveness-tick S]
+           [--heartbeat S] [--phi-threshold X] [-f <switch id>:<neighbor id> ...]
+
+Author: Matt Bowring
+Email: mbowring@purdue.edu
+"""
+
+import resource
+import selectors
+import sys
+import time
+from typing import Dict, List, Optional
+
+import switch
+from common import (
+    BUFFER_SIZE, UPDATE_DELAY, TIMEOUT, LIVENESS_TICK, get_option, has_flag, parse_failures,
+)
+from eventlog import log_writer_from_args
+from liveness import TimerWheel, detector_from_args
+from switch import Switch, open_switch_socket
+
+REGISTER_BATCH: int = 100  # register requests sent per loop pass during startup
+
+
+def raise_fd_limit(needed: int) -> None:
+    # One socket per switch; lift the soft limit as far as the hard limit allows
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+class SwitchHost:
+    """Multiplexes the sockets of many Switch instances on one selector.
+
+    A single shared timer walks round the switches, ticking each one every
+    UPDATE_DELAY with ticks spread evenly over the interval, so the
+    controller sees a steady trickle of reports rather than one burst per
+    interval. Switches still waiting for their register response are
+    re-registered every TIMEOUT. All switches share one liveness TimerWheel,
+    drained every liveness tick, so neighbor timeouts cost O(expired)
+    however many switches the host runs.
+    """
+
+    def __init__(self, switches: List[Switch], liveness: TimerWheel,
+                 tick: float = UPDATE_DELAY, register_batch: int = REGISTER_BATCH) -> None:
+        self.switches = switches
+        self.by_id: Dict[int, Switch] = {sw.sid: sw for sw in switches}
+        self.liveness = liveness
+        self.tick = tick
+        self.register_batch = register_batch
+        self.selector = selectors.DefaultSelector()
+        for sw in switches:
+            sw.sock.setblocking(False)
+            self.selector.register(sw.sock, selectors.EVENT_READ, sw)
+        self._to_register: List[Switch] = list(reversed(switches))
+        self._registered_at: Dict[int, float] = {}
+        self._cursor = 0
+        self._step = tick / max(1, len(switches))
+
+    def run_once(self, timeout: Optional[float]) -> None:
+        for key, _ in self.selector.select(timeout):
+            sw = key.data
+            now = time.time()
+            # Drain the socket so one busy switch cannot starve the others for long
+            while True:
+                try:
+                    data, addr = sw.sock.recvfrom(BUFFER_SIZE)
+                except BlockingIOError:
+                    break
+                sw.handle_message(data, addr, now)
+
+    def _register_some(self, now: float) -> None:
+        # Stagger registrations so the controller's receive buffer is not flooded
+        for _ in range(min(self.register_batch, len(self._to_register))):
+            sw = self._to_register.pop()
+            sw.register()
+            self._registered_at[sw.sid] = now
+
+    def _retry_registration(self, now: float) -> None:
+        for sw in self.switches:
+            if not sw.registered and now - self._registered_at.get(sw.sid, now) >= TIMEOUT:
+                sw.register()
+                self._registered_at[sw.sid] = now
+
+    def _expire_neighbors(self, now: float) -> None:
+        expired: Dict[int, List[int]] = {}
+        for sid, nid in self.liveness.expire(now):
+            expired.setdefault(sid, []).append(nid)
+        for sid, nids in expired.items():
+            self.by_id[sid].expire_neighbors(nids)
+
+    def _tick_due(self, now: float, next_due: float) -> float:
+        # Tick every switch whose slot has come round, at most one full round
+        for _ in range(len(self.switches)):
+            if now < next_due:
+                break
+            self.switches[self._cursor].tick(now)
+            self._cursor += 1
+            if self._cursor == len(self.switches):
+                self._cursor = 0
+                self._retry_registration(now)
+            next_due += self._step
+        return max(next_due, now - self.tick)
+
+    def run_forever(self) -> None:
+        next_due = time.time() + self.tick
+        next_check = time.time() + self.liveness.tick
+        while True:
+            now = time.time()
+            if self._to_register:
+                self._register_some(now)
+            timeout = 0 if self._to_register else max(0.0, min(next_due, next_check) - now)
+            self.run_once(timeout)
+            now = time.time()
+            if now >= next_check:
+                self._expire_neighbors(now)
+                next_check = max(next_check + self.liveness.tick, now)
+            if self.switches:
+                next_due = self._tick_due(now, next_due)
+
+
+def main() -> None:
+    if len(sys.argv) < 4:
+        print("switch_host.py <Controller hostname> <Controller Port> <num switches> "
+              "[--first-id K] [--no-log] [--register-batch N] [--liveness-tick S] "
+              "[--heartbeat S] [--phi-threshold X] [-f <switch id>:<neighbor id> ...]\n")
+        sys.exit(1)
+
+    host = sys.argv[1]
+    port = int(sys.argv[2])
+    count = int(sys.argv[3])
+    first_id = int(get_option(sys.argv, '--first-id', '0'))
+    register_batch = int(get_option(sys.argv, '--register-batch', str(REGISTER_BATCH)))
+    logging = not has_flag(sys.argv, '--no-log')
+    failures = parse_failures(sys.argv)
+    liveness = TimerWheel(time.time(),
+                          float(get_option(sys.argv, '--liveness-tick', str(LIVENESS_TICK))))
+    detector = detector_from_args(sys.argv)
+    heartbeat = float(get_option(sys.argv, '--heartbeat', str(UPDATE_DELAY)))
+
+    if logging:
+        # One background writer serves every switch's log file
+        switch.LOG_WRITER = log_writer_from_args(sys.argv)
+
+    raise_fd_limit(count + 64)
+    switches = []
+    for sid in range(first_id, first_id + count):
+        log_file = f"switch{sid}.log" if logging else None
+        switches.append(Switch(sid, open_switch_socket(), (host, port),
+                               failures.get(sid), log_file, liveness, detector))
+
+    SwitchHost(switches, liveness, heartbeat, register_batch).run_forever()
+
+
+if __name__ == "__main__":
+    main()
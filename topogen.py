@@ -0,0 +1,158 @@
+"""Synthetic topology generators for benchmarks and simulations
+Every generator takes a switch count and a seed and returns a connected
+Topology with integer link costs. Generators whose shape fixes the size
+(grid, fat-tree) return the nearest size they can build, so use len() of
+the result.
+
+Author: Matt Bowring
+Email: mbowring@purdue.edu
+"""
+
+import math
+import random
+from typing import Callable, Dict, List, Set, Tuple
+
+from common import Topology
+
+
+def _add_link(topo: Topology, a: int, b: int, cost: int) -> bool:
+    if a == b or any(v == b for v, _ in topo[a]):
+        return False
+    topo[a].append((b, cost))
+    topo[b].append((a, cost))
+    return True
+
+
+def ring_topology(n: int, chord: int = 7, seed: int = 0) -> Topology:
+    """Ring with chords every chord switches, costs varying by position."""
+    topo: Topology = {i: [] for i in range(n)}
+    for i in range(n):
+        for j, cost in ((i + 1) % n, 10 + i % 5), ((i + chord) % n, 40 + i % 11):
+            _add_link(topo, i, j, cost)
+    return topo
+
+
+def grid_topology(n: int, seed: int = 0) -> Topology:
+    """Square-ish 2D mesh of n switches, filled row by row, with random costs."""
+    rng = random.Random(seed)
+    cols = max(1, math.ceil(math.sqrt(n)))
+    topo: Topology = {i: [] for i in range(n)}
+    for i in range(n):
+        if (i + 1) % cols and i + 1 < n:
+            _add_link(topo, i, i + 1, rng.randint(1, 20))
+        if i + cols < n:
+            _add_link(topo, i, i + cols, rng.randint(1, 20))
+    return topo
+
+
+def fat_tree_topology(n: int, seed: int = 0) -> Topology:
+    """k-ary fat tree, for the smallest even k with at least n switches
+    (5k^2/4 of them): k pods of k/2 edge and k/2 aggregation switches, and
+    (k/2)^2 core switches. All links cost 1, so most destinations have
+    several equal-cost paths."""
+    k = 2
+    while 5 * k * k // 4 < n:
+        k += 2
+    half = k // 2
+    pods = k * k
+    core = pods  # first core switch id; pod p has edge ids p*k.., aggregation p*k+half..
+    topo: Topology = {i: [] for i in range(pods + half * half)}
+
+    def link(a: int, b: int) -> None:
+        # Every pair is visited once, no need to check for duplicates
+        topo[a].append((b, 1))
+        topo[b].append((a, 1))
+
+    for pod in range(k):
+        for e in range(half):
+            for a in range(half):
+                link(pod * k + e, pod * k + half + a)
+        for a in range(half):
+            for c in range(half):
+                link(pod * k + half + a, core + a * half + c)
+    return topo
+
+
+def _connect_components(topo: Topology, cost: Callable[[int, int], int]) -> None:
+    # Link every component to the one before it, so the whole is connected
+    seen: Set[int] = set()
+    roots: List[int] = []
+    for start in topo:
+        if start in seen:
+            continue
+        roots.append(start)
+        seen.add(start)
+        stack = [start]
+        while stack:
+            u = stack.pop()
+            for v, _ in topo[u]:
+                if v not in seen:
+                    seen.add(v)
+                    stack.append(v)
+    for a, b in zip(roots, roots[1:]):
+        _add_link(topo, a, b, cost(a, b))
+
+
+def random_geometric_topology(n: int, seed: int = 0, radius: float = 0.0) -> Topology:
+    """Switches at random points in the unit square, linked when closer than
+    radius (by default 1.5 times the connectivity threshold), with costs
+    proportional to distance. Stray components are linked up."""
+    rng = random.Random(seed)
+    points = [(rng.random(), rng.random()) for _ in range(n)]
+    if radius <= 0:
+        radius = 1.5 * math.sqrt(math.log(max(n, 2)) / (math.pi * max(n, 1)))
+
+    def cost(a: int, b: int) -> int:
+        return 1 + int(100 * math.dist(points[a], points[b]))
+
+    # Bucket points into radius-sized cells, so only neighboring cells are compared
+    cells: Dict[Tuple[int, int], List[int]] = {}
+    for i, (x, y) in enumerate(points):
+        cells.setdefault((int(x / radius), int(y / radius)), []).append(i)
+    topo: Topology = {i: [] for i in range(n)}
+    for (cx, cy), members in cells.items():
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in cells.get((cx + dx, cy + dy), ()):
+                    for i in members:
+                        if i < j and math.dist(points[i], points[j]) <= radius:
+                            _add_link(topo, i, j, cost(i, j))
+    _connect_components(topo, cost)
+    return topo
+
+
+def scale_free_topology(n: int, seed: int = 0, m: int = 2) -> Topology:
+    """Barabasi-Albert preferential attachment: each new switch links to m
+    existing switches chosen with probability proportional to their degree.
+    Costs are random."""
+    rng = random.Random(seed)
+    topo: Topology = {i: [] for i in range(n)}
+    # Every link end appears once, so a uniform pick is a degree-weighted pick
+    ends: List[int] = []
+    for i in range(1, min(m + 1, n)):
+        _add_link(topo, i, i - 1, rng.randint(1, 20))
+        ends += [i, i - 1]
+    for i in range(m + 1, n):
+        targets: Set[int] = set()
+        while len(targets) < m:
+            targets.add(rng.choice(ends))
+        for t in targets:
+            _add_link(topo, i, t, rng.randint(1, 20))
+            ends += [i, t]
+    return topo
+
+
+GENERATORS: Dict[str, Callable[..., Topology]] = {
+    'ring': ring_topology,
+    'grid': grid_topology,
+    'fat-tree': fat_tree_topology,
+    'geometric': random_geometric_topology,
+    'scale-free': scale_free_topology,
+}
+
+
+def generate(kind: str, n: int, seed: int = 0) -> Topology:
+    """Topology of about n switches from the named generator."""
+    if kind not in GENERATORS:
+        raise ValueError(f"Unknown topology '{kind}', expected one of {', '.join(GENERATORS)}")
+    return GENERATORS[kind](n, seed=seed)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+"""Topology config files
+Streaming loader for the text config format (first line the number of
+switches, then one "<switch> <switch> <cost>" line per link), a binary
+format that loads with a single memory map, and a command line tool to
+convert between the two, generate synthetic fabrics and inspect files.
+
+Usage: python topology.py convert <input> <output> [--binary]
+       python topology.py generate <kind> <num switches> <output> [--seed K] [--binary]
+       python topology.py info <file>
+
+Author: Matt Bowring
+Email: mbowring@purdue.edu
+"""
+
+import gc
+import mmap
+import operator
+import os
+import struct
+import sys
+import time
+from array import array
+from typing import Iterator, Optional, Tuple
+
+from common import Topology, get_option, has_flag
+
+# Optional: whole-column checks and conversions
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TOPOLOGY_MAGIC: bytes = b'SDNT'
+TOPOLOGY_FORMAT: int = 1
+
+# Binary layout, big-endian like the wire format: the header, then the
+# source, destination and cost columns of the links, num_links int32 each
+TOPOLOGY_HEADER = struct.Struct('!4sHxxII')
+
+_SWAP: bool = sys.byteorder == 'little'
+_INT32_MAX: int = 0x7FFFFFFF
+
+
+def _unsigned(column: array) -> memoryview:
+    return memoryview(column).cast('B').cast('I')
+
+
+class TopologyConfigError(ValueError):
+    """A config file that cannot be loaded, with where and why."""
+
+
+class CompactTopology:
+    """Switch count and undirected links of a fabric, as three int32 columns.
+    Each link is stored once; Topology lists it under both ends."""
+
+    __slots__ = ('n', 'src', 'dst', 'cost')
+
+    def __init__(self, n: int, src: Optional[array] = None, dst: Optional[array] = None,
+                 cost: Optional[array] = None) -> None:
+        self.n = n
+        self.src = src if src is not None else array('i')
+        self.dst = dst if dst is not None else array('i')
+        self.cost = cost if cost is not None else array('i')
+
+    def __len__(self) -> int:
+        return self.n
+
+    @property
+    def num_links(self) -> int:
+        return len(self.src)
+
+    @classmethod
+    def from_topology(cls, topo: Topology) -> "CompactTopology":
+        compact = cls(len(topo))
+        for u, edges in topo.items():
+            for v, c in edges:
+                if u < v:
+                    compact.src.append(u)
+                    compact.dst.append(v)
+                    compact.cost.append(c)
+        return compact
+
+    def to_topology(self) -> Topology:
+        # Millions of new tuples would otherwise set off collection after
+        # collection of objects that can never be garbage
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if np is not None and self.num_links:
+                return self._to_topology_np()
+            topo: Topology = {i: [] for i in range(self.n)}
+            for u, v, c in zip(self.src, self.dst, self.cost):
+                # Bidirectional
+                topo[u].append((v, c))
+                topo[v].append((u, c))
+            return topo
+        finally:
+            if enabled:
+                gc.enable()
+
+    def _to_topology_np(self) -> Topology:
+        # Both directions of every link, grouped by their first end and kept
+        # in file order within each switch, like the loop in to_topology
+        src, dst, cost = self._columns()
+        ends = np.empty(2 * self.num_links, dtype=np.int64)
+        ends[0::2], ends[1::2] = src, dst
+        other = np.empty(2 * self.num_links, dtype=np.intc)
+        other[0::2], other[1::2] = dst, src
+        order = np.argsort((ends << 32) | np.arange(len(ends)))
+        pairs = list(zip(other[order].tolist(), np.repeat(cost, 2)[order].tolist()))
+        bounds = np.r_[0, np.cumsum(np.bincount(ends, minlength=self.n))].tolist()
+        return {u: pairs[bounds[u]:bounds[u + 1]] for u in range(self.n)}
+
+    def _columns(self) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        return tuple(np.frombuffer(column, dtype=np.intc)
+                     for column in (self.src, self.dst, self.cost))
+
+    def degrees(self) -> array:
+        """Number of links at each switch."""
+        if np is not None and self.num_links:
+            src, dst, _ = self._columns()
+            degree = array('i')
+            degree.frombytes(np.bincount(np.concatenate((src, dst)), minlength=self.n)
+                             .astype(np.intc).tobytes())
+            return degree
+        degree = array('i', bytes(4 * self.n))
+        for u in self.src:
+            degree[u] += 1
+        for v in self.dst:
+            degree[v] += 1
+        return degree
+
+    def links(self) -> Iterator[Tuple[int, int, int]]:
+        return zip(self.src, self.dst, self.cost)
+
+    def write_text(self, path: str) -> None:
+        with open(path, 'w') as f:
+            f.write(f"{self.n}\n")
+            f.writelines(f"{u} {v} {c}\n" for u, v, c in self.links())
+
+    def write_binary(self, path: str) -> None:
+        with open(path, 'wb') as f:
+            f.write(TOPOLOGY_HEADER.pack(TOPOLOGY_MAGIC, TOPOLOGY_FORMAT, self.n, self.num_links))
+            for column in (self.src, self.dst, self.cost):
+                if _SWAP:
+                    column = array('i', column)
+                    column.byteswap()
+                f.write(column.tobytes())
+
+    def validate(self, path: str) -> None:
+        """Check every link joins two distinct switches below n at a
+        non-negative cost; raises TopologyConfigError otherwise."""
+        if not self.num_links:
+            return
+        if np is not None:
+            src, dst, cost = self._columns()
+            if min(src.min(), dst.min()) < 0 or max(src.max(), dst.max()) >= self.n:
+                raise TopologyConfigError(f"{path}: switch id outside 0..{self.n - 1}")
+            if cost.min() < 0:
+                raise TopologyConfigError(f"{path}: negative link cost")
+            if (src == dst).any():
+                raise TopologyConfigError(f"{path}: link from a switch to itself")
+            return
+        # Read as unsigned, negative ids and costs compare above every valid one
+        if max(_unsigned(self.src)) >= self.n or max(_unsigned(self.dst)) >= self.n:
+            raise TopologyConfigError(f"{path}: switch id outside 0..{self.n - 1}")
+        if max(_unsigned(self.cost)) > _INT32_MAX:
+            raise TopologyConfigError(f"{path}: negative link cost")
+        if any(map(operator.eq, self.src, self.dst)):
+            raise TopologyConfigError(f"{path}: link from a switch to itself")
+
+
+def load_text(path: str) -> CompactTopology:
+    """Stream a text config into compact arrays, validating every line."""
+    compact: Optional[CompactTopology] = None
+    with open(path, 'r') as f:
+        for lineno, line in enumerate(f, 1):
+            parts = line.split()
+            if not parts or parts[0].startswith('#'):
+                continue
+            try:
+                if compact is None:
+                    if len(parts) != 1:
+                        raise ValueError("expected the number of switches")
+                    n = int(parts[0])
+                    if n <= 0:
+                        raise ValueError("the number of switches must be positive")
+                    compact = CompactTopology(n)
+                    continue
+                if len(parts) != 3:
+                    raise ValueError(f"expected '<switch> <switch> <cost>', got {line.strip()!r}")
+                u, v, c = int(parts[0]), int(parts[1]), int(parts[2])
+                if not (0 <= u < compact.n and 0 <= v < compact.n):
+                    raise ValueError(f"switch id outside 0..{compact.n - 1}")
+                if u == v:
+                    raise ValueError("link from a switch to itself")
+                if not 0 <= c <= _INT32_MAX:
+                    raise ValueError(f"link cost {c} out of range")
+            except ValueError as e:
+                raise TopologyConfigError(f"{path}:{lineno}: {e}") from None
+            compact.src.append(u)
+            compact.dst.append(v)
+            compact.cost.append(c)
+    if compact is None:
+        raise TopologyConfigError(f"{path}: empty config")
+    return compact
+
+
+def load_binary(path: str) -> CompactTopology:
+    """Map a binary topology file and copy out its link columns."""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if len(mm) < TOPOLOGY_HEADER.size:
+            raise TopologyConfigError(f"{path}: truncated header")
+        magic, fmt, n, m = TOPOLOGY_HEADER.unpack_from(mm)
+        if magic != TOPOLOGY_MAGIC or fmt != TOPOLOGY_FORMAT:
+            raise TopologyConfigError(f"{path}: not a format {TOPOLOGY_FORMAT} topology file")
+        if len(mm) != TOPOLOGY_HEADER.size + 12 * m:
+            raise TopologyConfigError(f"{path}: {len(mm)} bytes, expected "
+                                      f"{TOPOLOGY_HEADER.size + 12 * m} for {m} links")
+        columns = []
+        offset = TOPOLOGY_HEADER.size
+        for _ in range(3):
+            column = array('i')
+            column.frombytes(mm[offset:offset + 4 * m])
+            if _SWAP:
+                column.byteswap()
+            columns.append(column)
+            offset += 4 * m
+    compact = CompactTopology(n, *columns)
+    compact.validate(path)
+    return compact
+
+
+def is_binary(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(TOPOLOGY_MAGIC)) == TOPOLOGY_MAGIC
+
+
+def load_topology(path: str) -> CompactTopology:
+    """Load a config in either format, told apart by the binary magic."""
+    try:
+        return load_binary(path) if is_binary(path) else load_text(path)
+    except (OSError, UnicodeDecodeError) as e:
+        raise TopologyConfigError(f"{path}: {e}") from None
+
+
+def switch_count(path: str) -> int:
+    """Number of switches in a config, read from its first line or header only."""
+    try:
+        if is_binary(path):
+            with open(path, 'rb') as f:
+                return TOPOLOGY_HEADER.unpack(f.read(TOPOLOGY_HEADER.size))[2]
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip() and not line.lstrip().startswith('#'):
+                    return int(line)
+    except (OSError, ValueError, struct.error) as e:
+        raise TopologyConfigError(f"{path}: {e}") from None
+    raise TopologyConfigError(f"{path}: empty config")
+
+
+def write_topology(compact: CompactTopology, path: str, binary: bool) -> None:
+    if binary:
+        compact.write_binary(path)
+    else:
+        compact.write_text(path)
+
+
+def main() -> None:
+    usage = ("topology.py convert <input> <output> [--binary]\n"
+             "topology.py generate <kind> <num switches> <output> [--seed K] [--binary]\n"
+             "topology.py info <file>\n")
+    args = [arg for i, arg in enumerate(sys.argv[1:], 1)
+            if not arg.startswith('--') and sys.argv[i - 1] != '--seed']
+    if not args:
+        print(usage)
+        sys.exit(1)
+    binary = has_flag(sys.argv, '--binary')
+
+    try:
+        if args[0] == 'convert' and len(args) == 3:
+            compact = load_topology(args[1])
+            write_topology(compact, args[2], binary)
+            print(f"Wrote {compact.n} switches, {compact.num_links} links to {args[2]}")
+        elif args[0] == 'generate' and len(args) == 4:
+            from topogen import GENERATORS, generate
+            if args[1] not in GENERATORS:
+                print(f"Unknown topology '{args[1]}', expected one of {', '.join(GENERATORS)}")
+                sys.exit(1)
+            compact = CompactTopology.from_topology(
+                generate(args[1], int(args[2]), int(get_option(sys.argv, '--seed', '0'))))
+            write_topology(compact, args[3], binary)
+            print(f"Wrote {compact.n} switches, {compact.num_links} links to {args[3]}")
+        elif args[0] == 'info' and len(args) == 2:
+            start = time.perf_counter()
+            compact = load_topology(args[1])
+            elapsed = time.perf_counter() - start
+            degree = compact.degrees()
+            print(f"{args[1]}: {'binary' if is_binary(args[1]) else 'text'}, "
+                  f"{os.path.getsize(args[1]):,} bytes, loaded in {elapsed * 1000:.1f}ms")
+            print(f"  {compact.n} switches, {compact.num_links} links, degree "
+                  f"min {min(degree, default=0)} max {max(degree, default=0)} "
+                  f"mean {2 * compact.num_links / compact.n:.2f}")
+        else:
+            print(usage)
+            sys.exit(1)
+    except TopologyConfigError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
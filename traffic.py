@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+"""Traffic Source/Sink for the Switch data plane
+Injects DATA packets at one switch, addressed to another, at a fixed rate
+and receives them back as the host attached to the destination switch.
+Reports end-to-end throughput, latency percentiles and drops.
+
+Usage: python traffic.py <Controller hostname> <Controller Port> <src switch> <dst switch>
+           [--rate PPS] [--duration SECONDS] [--size BYTES] [--ttl N] [--flows N]
+
+Author: Matt Bowring
+Email: mbowring@purdue.edu
+"""
+
+import socket
+import struct
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from common import (
+    BUFFER_SIZE, DEFAULT_TTL, MAX_DATA_PAYLOAD, BIN_DATA, BIN_SWITCH_LOOKUP,
+    serialize_data, deserialize_data, serialize_switch_lookup, deserialize_switch_lookup,
+    message_type, get_option,
+)
+
+# Payload prefix: sequence number and send time
+PROBE = struct.Struct('!Id')
+ATTACH_SEQ: int = 0xFFFFFFFF  # probe sent to attach to the destination switch
+DRAIN_TIME: float = 1.0  # (seconds) to wait for packets still in flight
+
+
+def lookup_switch(sock: socket.socket, controller: Tuple[str, int], sid: int,
+                  retries: int = 5) -> Tuple[str, int]:
+    """Address of a switch, as registered with the controller."""
+    sock.settimeout(1.0)
+    try:
+        for _ in range(retries):
+            sock.sendto(serialize_switch_lookup(sid), controller)
+            try:
+                while True:
+                    data, _ = sock.recvfrom(BUFFER_SIZE)
+                    if message_type(data) == BIN_SWITCH_LOOKUP:
+                        found, host, port = deserialize_switch_lookup(data)
+                        if found == sid:
+                            break
+            except socket.timeout:
+                continue
+            if port < 0:
+                raise SystemExit(f"Switch {sid} is not registered with the controller")
+            return host, port
+    finally:
+        sock.settimeout(None)
+    raise SystemExit("No answer from the controller")
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+class TrafficRun:
+    """One source/sink session over a single UDP socket, which is the host
+    attached to both the source and the destination switch."""
+
+    def __init__(self, sock: socket.socket, src: int, dst: int,
+                 src_addr: Tuple[str, int], dst_addr: Tuple[str, int],
+                 size: int, ttl: int, flows: int = 1) -> None:
+        self.sock = sock
+        self.src = src
+        self.dst = dst
+        self.src_addr = src_addr
+        self.dst_addr = dst_addr
+        self.padding = bytes(max(0, min(size, MAX_DATA_PAYLOAD) - PROBE.size))
+        self.ttl = ttl
+        self.flows = max(1, flows)
+        self.sent: int = 0
+        self.received: Dict[int, float] = {}  # seq -> latency
+        self.attached = threading.Event()
+
+    def receive(self) -> None:
+        while True:
+            try:
+                data, _ = self.sock.recvfrom(BUFFER_SIZE)
+            except OSError:
+                return
+            now = time.perf_counter()
+            if message_type(data) != BIN_DATA:
+                continue
+            _, _, _, payload = deserialize_data(data)
+            seq, sent_at = PROBE.unpack_from(payload)
+            if seq == ATTACH_SEQ:
+                self.attached.set()
+            elif seq not in self.received:
+                self.received[seq] = now - sent_at
+
+    def attach(self) -> None:
+        # A packet from the host to the destination switch, addressed to itself,
+        # makes us its attached host and comes straight back
+        probe = serialize_data(self.dst, self.dst, 1, PROBE.pack(ATTACH_SEQ, 0.0))
+        for _ in range(10):
+            self.sock.sendto(probe, self.dst_addr)
+            if self.attached.wait(0.5):
+                return
+        raise SystemExit(f"Could not attach to switch {self.dst}")
+
+    def send(self, rate: float, duration: float) -> float:
+        """Send at rate packets/s for duration seconds; returns the time taken."""
+        interval = 1.0 / rate
+        start = time.perf_counter()
+        end = start + duration
+        next_send = start
+        while True:
+            now = time.perf_counter()
+            if now >= end:
+                break
+            # Catch up in a burst if the sender fell behind its schedule
+            while next_send <= now:
+                payload = PROBE.pack(self.sent, time.perf_counter()) + self.padding
+                # Packets are spread round robin over flows, and so over equal-cost paths
+                self.sock.sendto(serialize_data(self.src, self.dst, self.ttl, payload,
+                                                self.sent % self.flows), self.src_addr)
+                self.sent += 1
+                next_send += interval
+            time.sleep(max(0.0, min(next_send, end) - time.perf_counter()))
+        return time.perf_counter() - start
+
+    def report(self, elapsed: float) -> None:
+        latencies = sorted(self.received.values())
+        received = len(latencies)
+        payload_bytes = received * (PROBE.size + len(self.padding))
+        print(f"Traffic {self.src} -> {self.dst}: sent {self.sent}, received {received}, "
+              f"dropped {self.sent - received} "
+              f"({100.0 * (self.sent - received) / max(self.sent, 1):.2f}%)")
+        print(f"  throughput {received / elapsed:,.0f} pkts/s, "
+              f"{payload_bytes * 8 / elapsed / 1e6:.2f} Mbit/s payload")
+        if latencies:
+            print("  latency " + ", ".join(
+                f"p{p} {percentile(latencies, p) * 1000:.3f}ms" for p in (50, 90, 99))
+                + f", max {latencies[-1] * 1000:.3f}ms")
+
+
+def main() -> None:
+    if len(sys.argv) < 5:
+        print("traffic.py <Controller hostname> <Controller Port> <src switch> <dst switch> "
+              "[--rate PPS] [--duration SECONDS] [--size BYTES] [--ttl N] [--flows N]\n")
+        sys.exit(1)
+
+    controller = (sys.argv[1], int(sys.argv[2]))
+    src = int(sys.argv[3])
+    dst = int(sys.argv[4])
+    rate = float(get_option(sys.argv, '--rate', '1000'))
+    duration = float(get_option(sys.argv, '--duration', '5'))
+    size = int(get_option(sys.argv, '--size', '64'))
+    ttl = int(get_option(sys.argv, '--ttl', str(DEFAULT_TTL)))
+    flows = int(get_option(sys.argv, '--flows', '1'))
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    sock.bind(('', 0))
+    src_addr = lookup_switch(sock, controller, src)
+    dst_addr = lookup_switch(sock, controller, dst)
+
+    run = TrafficRun(sock, src, dst, src_addr, dst_addr, size, ttl, flows)
+    threading.Thread(target=run.receive, daemon=True).start()
+    run.attach()
+    elapsed = run.send(rate, duration)
+    time.sleep(DRAIN_TIME)
+    run.report(elapsed)
+
+
+if __name__ == "__main__":
+    main()